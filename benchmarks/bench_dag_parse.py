@@ -0,0 +1,100 @@
+""" DAG parse time benchmark (DagBag import of the dags folder)
+
+usage: python benchmarks/bench_dag_parse.py [--revs HEAD~1 WORKTREE] [--repeat 5] [--seed-variables]
+each parse runs in a fresh process with airflow already imported, like a scheduler parse loop.
+revs are git revisions of the repo (WORKTREE is the working copy), extracted in a temp dir.
+--seed-variables stores a dummy value for every missing variable read by the DAG files
+(metadata database of the current AIRFLOW_HOME), otherwise eager Variable.get fails the import.
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+VARIABLE_NAME = re.compile(r"""(?:Variable\.get|variable|var\.value\.)\(?['"]?(\w+)""")
+
+
+def worker(dag_folder: str) -> None:
+    """
+    parse the dag folder once and print timings as json
+    """
+    import time  # pylint: disable=import-outside-toplevel
+    from airflow.models import Variable  # pylint: disable=import-outside-toplevel
+    from airflow.models.dagbag import DagBag  # pylint: disable=import-outside-toplevel
+    sys.path.insert(0, dag_folder)
+    calls = []
+    get = Variable.get
+
+    def counted(*args, **kwargs):
+        calls.append(args[0] if args else kwargs.get("key"))
+        return get(*args, **kwargs)
+
+    Variable.get = counted
+    start = time.perf_counter()
+    dagbag = DagBag(dag_folder=dag_folder, include_examples=False, safe_mode=True)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"seconds": elapsed, "variable_gets": len(calls), "dags": len(dagbag.dags),
+                      "import_errors": len(dagbag.import_errors)}))
+
+
+def checkout(rev: str, target: Path) -> Path:
+    """
+    dags and config of a revision in target, return the dags folder
+    """
+    if rev == "WORKTREE":
+        return ROOT / "dags"
+    archive = subprocess.run(["git", "-C", str(ROOT), "archive", rev, "dags", "config"],
+                             check=True, capture_output=True).stdout
+    with tarfile.open(fileobj=BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return target / "dags"
+
+
+def seed_variables(dag_folder: Path) -> None:
+    """
+    store a dummy value for the variables read by the dag files that are missing
+    """
+    from airflow.models import Variable  # pylint: disable=import-outside-toplevel
+    names = set()
+    for path in dag_folder.rglob("*.py"):
+        names.update(VARIABLE_NAME.findall(path.read_text(encoding="utf-8")))
+    for name in sorted(names):
+        if Variable.get(name, default_var=None) is None:
+            Variable.set(name, "bench")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--revs", nargs="+", default=["WORKTREE"])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed-variables", action="store_true")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker)
+        return
+    print(f"{'rev':<16}{'median s':>10}{'min s':>10}{'Variable.get':>14}{'dags':>6}{'errors':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for index, rev in enumerate(args.revs):
+            dag_folder = checkout(rev, Path(tmp) / str(index))
+            if args.seed_variables:
+                seed_variables(dag_folder)
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.run([sys.executable, __file__, "--worker", str(dag_folder)],
+                                        check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+            seconds = [run["seconds"] for run in runs]
+            print(f"{rev:<16}{statistics.median(seconds):>10.3f}{min(seconds):>10.3f}"
+                  f"{runs[-1]['variable_gets']:>14}{runs[-1]['dags']:>6}{runs[-1]['import_errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
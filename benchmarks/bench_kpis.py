@@ -0,0 +1,98 @@
+""" Micro-benchmarks of gps.common.kpis
+
+usage: python benchmarks/bench_kpis.py [--sites 1000 10000 100000] [--repeat 5]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "dags"))
+from gps.common import kpis  # noqa: E402
+
+
+def make_frame(sites: int, months: int = 1, seed: int = 0) -> pd.DataFrame:
+    """
+    synthetic kpi inputs, a few missing and zero values per column
+    """
+    rng = np.random.default_rng(seed)
+    rows = sites * months
+    data = {"mois": np.repeat([f"2023-{str(m + 1).zfill(2)}" for m in range(months)], sites),
+            "region": rng.choice(["ABIDJAN", "CENTRE", "NORD", "SUD"], rows)}
+    for techno in kpis.TECHNOS:
+        data[f"cellules_{techno}"] = rng.integers(0, 12, rows).astype(float)
+        data[f"cellules_{techno}_congestionnees"] = rng.integers(0, 3, rows).astype(float)
+        data[f"nbrecellule_{techno}"] = rng.integers(0, 12, rows).astype(float)
+        data[f"delaycellule_{techno}"] = rng.random(rows) * 3600
+        data[f"trafic_voix_{techno}"] = rng.random(rows) * 1e4
+        data[f"avg_cssr_cs_{techno}"] = 90 + rng.random(rows) * 10
+    data["ca_voix"] = rng.random(rows) * 1e7
+    data["ca_total"] = data["ca_voix"] + rng.random(rows) * 1e7
+    data["parc_global"] = rng.integers(0, 5000, rows).astype(float)
+    data["opex_itn"] = rng.random(rows) * 5e6
+    frame = pd.DataFrame(data)
+    frame.loc[frame.sample(frac=0.01, random_state=seed).index, "trafic_voix_2g"] = np.nan
+    return frame
+
+
+def cases(frame: pd.DataFrame) -> dict:
+    """
+    name -> callable, one per kpi (and the inline formula it replaces when relevant)
+    """
+    congested = kpis.block(frame, [f"cellules_{t}_congestionnees" for t in kpis.TECHNOS])
+    cells = kpis.block(frame, [f"cellules_{t}" for t in kpis.TECHNOS])
+    nbre = kpis.block(frame, [f"nbrecellule_{t}" for t in kpis.TECHNOS])
+    delay = kpis.block(frame, [f"delaycellule_{t}" for t in kpis.TECHNOS])
+    trafic = kpis.block(frame, ["trafic_voix_2g", "trafic_voix_3g"])
+    cssr = kpis.block(frame, ["avg_cssr_cs_2g", "avg_cssr_cs_3g"])
+    days = kpis.days_in_month(frame["mois"])
+    month_cells = kpis.grain_totals(frame, [f"cellules_{t}" for t in kpis.TECHNOS], ["mois"])
+    month_trafic = kpis.grain_totals(frame, ["trafic_voix_2g", "trafic_voix_3g"], ["mois"], strict=True)
+    ca_voix, ca_total, opex_itn = (frame[c].to_numpy() for c in ["ca_voix", "ca_total", "opex_itn"])
+    parc = frame["parc_global"].to_numpy()
+
+    def legacy_days():
+        def get_number_days(mois):
+            year, month = map(int, mois.split("-"))
+            return pd.Period(year=year, month=month, freq="M").days_in_month
+        return frame["mois"].apply(get_number_days)
+
+    return {
+        "block": lambda: kpis.block(frame, [f"cellules_{t}" for t in kpis.TECHNOS]),
+        "taux_congestion": lambda: kpis.taux_congestion(congested, cells),
+        "row_total": lambda: kpis.row_total(cells),
+        "arpu": lambda: kpis.arpu(ca_total, parc),
+        "days_in_month": lambda: kpis.days_in_month(frame["mois"]),
+        "days_in_month (legacy apply)": legacy_days,
+        "grain_totals mois": lambda: kpis.grain_totals(frame, [f"cellules_{t}" for t in kpis.TECHNOS], ["mois"]),
+        "grain_totals mois x region": lambda: kpis.grain_totals(
+            frame, [f"cellules_{t}" for t in kpis.TECHNOS], ["mois", "region"]),
+        "grain_totals strict": lambda: kpis.grain_totals(
+            frame, ["trafic_voix_2g", "trafic_voix_3g"], ["mois"], strict=True),
+        "cssr_pondere": lambda: kpis.cssr_pondere(cssr, trafic, month_trafic),
+        "cssr_pondere (legacy builtin sum)": lambda: (
+            (frame["avg_cssr_cs_2g"] * frame["trafic_voix_2g"]) / sum(frame["trafic_voix_2g"])) / 100,
+        "nur": lambda: kpis.nur(nbre, delay, days, month_cells),
+        "financials": lambda: kpis.financials(ca_voix, ca_total, opex_itn, 0.139, 0.116, 0.09),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'kpi':<36}{'sites':>10}{'best ms':>12}{'rows/s':>16}")
+    for sites in args.sites:
+        frame = make_frame(sites, args.months)
+        for name, func in cases(frame).items():
+            number = 3
+            best = min(timeit.repeat(func, number=number, repeat=args.repeat)) / number
+            print(f"{name:<36}{sites:>10}{best * 1000:>12.3f}{len(frame) / best:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
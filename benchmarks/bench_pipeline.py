@@ -0,0 +1,226 @@
+""" Benchmark of the monthly pipeline (cleanings, readers, oneforall stages, write_pg) on synthetic data
+
+usage: python benchmarks/bench_pipeline.py [--sites 1000 10000] [--date 2023-01-06] [--days 31]
+       [--engines pandas duckdb spark] [--host localhost --database gps --user gps]
+raw files are generated in an in-process s3 stand-in (moto) and the params api is served locally,
+so no minio nor api is needed; write_pg runs on a scratch table (created and dropped) when --host is given.
+the outputs of the other engines are checked against pandas (<step>.equal steps, failed when they differ),
+spark runs in local[*] mode (java required).
+results are saved in <output>/<commit>.json to compare runs between commits (see compare.py)
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "dags"))
+from gps.common import cleaning, enrich, metrics  # noqa: E402
+from gps.common.rwpg import write_pg  # noqa: E402
+from gps.testing.api import ApiStandIn  # noqa: E402
+from gps.testing.s3 import S3StandIn  # noqa: E402
+from gps.testing.synthetic import generate  # noqa: E402
+
+# in dependency order, esco and ihs before oneforall reads them
+CLEANINGS = ["clean_base_sites", "cleaning_esco", "cleaning_ihs", "cleaning_ca_parc", "cleaning_alarm",
+             "cleaning_traffic", "cleaning_trafic_v2", "cleaning_cssr", "cleaning_congestion"]
+# cleanings with an engine argument
+ENGINES = {"cleaning_ca_parc", "cleaning_traffic", "cleaning_cssr"}
+# scratch table of write_pg
+TABLE = "bench_pipeline_oneforall"
+
+
+def commit() -> str:
+    """
+    short hash of HEAD, suffixed with -dirty on local changes
+    """
+    root = Path(__file__).parents[1]
+    head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                          capture_output=True, text=True, check=False).stdout.strip() or "unknown"
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                           capture_output=True, text=True, check=False).stdout.strip()
+    return f"{head}-dirty" if dirty else head
+
+
+def run(step: str, func, repeat: int, memory: bool = True) -> tuple:
+    """
+    best of repeat calls of func, returns (result, record of the fastest call).
+    A failed call stops the step: its record has status "failed" and the result is None.
+    With memory, peak_alloc_bytes is the tracemalloc peak of one more call, the memory allocated by the
+    step alone (peak_rss_bytes only grows over the process, it hides the steps after the largest one).
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        try:
+            with metrics.measure(step) as record:
+                result = func()
+                rows = metrics._rows(result)  # pylint: disable=protected-access
+                record["rows_out"] = rows if rows is not None else (len(result) if isinstance(result, dict)
+                                                                    else None)
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"{step} failed: {error!r}", file=sys.stderr)
+            return None, {**record, "rows_out": None, "peak_alloc_bytes": None}
+        if best is None or record["wall_seconds"] < best["wall_seconds"]:
+            best = record
+    best["peak_alloc_bytes"] = None
+    if memory:
+        # traced apart from the timed calls, tracemalloc slows the allocations down
+        tracemalloc.start()
+        try:
+            func()
+            best["peak_alloc_bytes"] = tracemalloc.get_traced_memory()[1]
+        except Exception as error:  # pylint: disable=broad-except
+            print(f"{step} failed: {error!r}", file=sys.stderr)
+            return None, {**best, "status": "failed"}
+        finally:
+            tracemalloc.stop()
+    return result, best
+
+
+def assert_same(frame: pd.DataFrame, reference: pd.DataFrame) -> int:
+    """
+    AssertionError when frame differs from the pandas reference: rows in any order,
+    dtypes and float rounding (relative 1e-9) ignored. Return the rows compared.
+    """
+    if frame is None:
+        raise AssertionError("no output to compare, the step failed")
+    if sorted(frame.columns) != sorted(reference.columns):
+        raise AssertionError(f"columns differ: {sorted(set(frame.columns) ^ set(reference.columns))}")
+    columns = list(reference.columns)
+    keys = [column for column in columns if not pd.api.types.is_float_dtype(reference[column])]
+
+    def ordered(data: pd.DataFrame) -> pd.DataFrame:
+        order = data[keys].astype(str).sort_values(keys).index if keys else data.index
+        return data.loc[order, columns].reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(ordered(frame), ordered(reference), check_dtype=False, rtol=1e-9)
+    return len(reference)
+
+
+def bench(sites: int, settings: dict, dsn: dict = None, table: str = TABLE) -> list:
+    """
+    generate the raw files of sites and time each step of the pipeline: the cleanings,
+    the readers of the cleaned inputs, the oneforall stages, oneforall and write_pg (with dsn).
+    The outputs of the other engines are compared to pandas (<step>.equal)
+    """
+    results = []
+    date, repeat = settings["date"], settings["repeat"]
+
+    def add(step: str, engine: str, record: dict):
+        results.append({"step": step, "sites": sites, "engine": engine,
+                        **{key: record[key] for key in ["status", "wall_seconds", "cpu_seconds", "peak_rss_bytes",
+                                                        "peak_rss_growth_bytes", "peak_alloc_bytes",
+                                                        "rows_out"]}})
+        print(f"{step:<24}{engine:>8}{sites:>10}{record['wall_seconds']:>10.2f}{record['cpu_seconds']:>10.2f}"
+              f"{(record['peak_alloc_bytes'] or 0) / 2 ** 20:>12.0f}{record['rows_out'] or 0:>10}"
+              f"{'' if record['status'] == 'ok' else '  ' + record['status']}")
+
+    def compare(step: str, outputs: dict):
+        for engine, output in outputs.items():
+            if engine not in ("pandas", "-") and outputs.get("pandas") is not None:
+                _, record = run(f"{step}.equal", lambda: assert_same(output, outputs["pandas"]), 1, memory=False)
+                add(f"{step}.equal", engine, record)
+
+    with S3StandIn() as s3, ApiStandIn():
+        client = s3.client()
+        options = (client, s3.endpoint, s3.accesskey, s3.secretkey, date)
+        _, record = run("generate", lambda: generate(client, date, sites=sites, days=settings["days"],
+                                                     seed=settings["seed"]), 1, memory=False)
+        add("generate", "-", record)
+        for name in CLEANINGS:
+            func = getattr(cleaning, name)
+            # the last engine writes the cleaned object oneforall reads, pandas as the reference
+            outputs = {}
+            for engine in (sorted(settings["engines"], key=lambda e: e == "pandas") if name in ENGINES else ["-"]):
+                kwargs = {"engine": engine} if engine != "-" else {}
+                outputs[engine], record = run(name, lambda: func(*options, **kwargs), repeat)
+                add(name, engine, record)
+            compare(name, outputs)
+        for key, value in enrich.input_objects(client, date).items():
+            _, record = run(f"read.{key}", lambda: enrich.read_inputs(*options[1:4], {key: value})[key], repeat)
+            add(f"read.{key}", "-", record)
+        data = None
+        for stage, params, func in enrich.oneforall_stages(*options, start_date=date):
+            values = params()
+            # each call of a stage gets a copy of its input, the stages may change it (copy included in the time)
+            data, record = run(f"oneforall.{stage}", lambda: func(copy.deepcopy(data), values), repeat)
+            add(f"oneforall.{stage}", "-", record)
+        oneforall, record = run("oneforall", lambda: enrich.oneforall(*options, start_date=date), repeat)
+        add("oneforall", "-", record)
+        # the other engines read and join the cleaned inputs
+        outputs = {"pandas": oneforall}
+        for engine in settings["engines"]:
+            if engine != "pandas":
+                outputs[engine], record = run("oneforall", lambda: enrich.oneforall(*options, start_date=date,
+                                                                                    engine=engine), repeat)
+                add("oneforall", engine, record)
+        compare("oneforall", outputs)
+    if dsn is not None:
+        try:
+            _, record = run("write_pg", lambda: write_pg(data=oneforall, table=table, **dsn), repeat)
+            record["rows_out"] = len(oneforall) if record["status"] == "ok" else None
+            add("write_pg", "-", record)
+        finally:
+            with psycopg2.connect(**dsn) as conn, conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {table}, {table}_rollup;")
+            conn.close()
+    return results
+
+
+def benchmark(settings: dict, dsn: dict = None, table: str = TABLE) -> dict:
+    """
+    run the benchmarks of settings (sites, date, days, seed, repeat, engines), report of the results
+    """
+    print(f"{'step':<24}{'engine':>8}{'sites':>10}{'wall s':>10}{'cpu s':>10}{'alloc MiB':>12}{'rows':>10}")
+    return {
+        "commit": commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "settings": {**settings, "write_pg": dsn is not None},
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": {"platform": platform.platform(), "processor": platform.machine(), "cpus": os.cpu_count()},
+        "results": [result for sites in settings["sites"] for result in bench(sites, settings, dsn, table)],
+    }
+
+
+def save(report: dict, output: str) -> Path:
+    """
+    save a report in output/<commit>.json
+    """
+    path = Path(output) / f"{report['commit']}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sites", type=int, nargs="+", default=[1000])
+    parser.add_argument("--date", default="2023-01-06", help="execution date, the month benchmarked")
+    parser.add_argument("--days", type=int, default=None, help="days of daily files, the whole month by default")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--engines", nargs="+", default=["pandas"], choices=["pandas", "duckdb", "spark"])
+    parser.add_argument("--host", default=None, help="postgres of write_pg, skipped when not given")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--table", default=TABLE)
+    parser.add_argument("--output", default=str(Path(__file__).parent / "results"))
+    args = parser.parse_args()
+    dsn = None if args.host is None else {"host": args.host, "port": args.port, "database": args.database,
+                                           "user": args.user, "password": args.password}
+    settings = {key: getattr(args, key) for key in ["sites", "date", "days", "seed", "repeat", "engines"]}
+    print(f"saved {save(benchmark(settings, dsn, args.table), args.output)}")
+
+
+if __name__ == "__main__":
+    main()
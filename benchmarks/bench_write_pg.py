@@ -0,0 +1,77 @@
+""" Benchmark of gps.common.rwpg.write_pg, COPY FROM STDIN vs to_sql and parallel loads
+
+usage: python benchmarks/bench_write_pg.py --host localhost --database gps --user gps [--rows 10000 100000]
+       [--workers 1 2 4 8]
+the password is read from --password or PGPASSWORD, a scratch table is created and dropped
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "dags"))
+from gps.common.rwpg import ONEFORALL_SCHEMA, write_pg  # noqa: E402
+
+
+def make_oneforall(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    synthetic oneforall frame of one month, a few missing values per numeric column
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name, type_ in ONEFORALL_SCHEMA:
+        if type_ == "VARCHAR":
+            data[name] = rng.choice(["ABIDJAN", "CENTRE", "NORD", "SUD"], rows)
+        elif type_ == "BOOLEAN":
+            data[name] = rng.random(rows) > 0.5
+        elif type_ == "INTEGER":
+            data[name] = rng.integers(0, 5000, rows).astype(float)
+        else:
+            data[name] = rng.random(rows) * 1e6
+    data["mois"] = np.repeat("2023-01", rows)
+    data["code_oci"] = [f"OCI{i:07d}" for i in range(rows)]
+    frame = pd.DataFrame(data)
+    frame.loc[frame.sample(frac=0.01, random_state=seed).index, ["parc_2g", "trafic_voix_2g"]] = np.nan
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+    parser.add_argument("--table", default="bench_oneforall")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="parallel copy loads to compare (to_sql is single connection)")
+    args = parser.parse_args()
+    dsn = {"host": args.host, "port": args.port, "database": args.database,
+           "user": args.user, "password": args.password}
+    runs = [("copy", workers) for workers in args.workers] + [("to_sql", 1)]
+    print(f"{'method':<10}{'workers':>8}{'rows':>10}{'best s':>10}{'rows/s':>14}")
+    try:
+        for rows in args.rows:
+            frame = make_oneforall(rows)
+            for method, workers in runs:
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    write_pg(data=frame, table=args.table, method=method, workers=workers, **dsn)
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                print(f"{method:<10}{workers:>8}{rows:>10}{best:>10.2f}{rows / best:>14,.0f}")
+    finally:
+        with psycopg2.connect(**dsn) as conn, conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {args.table}, {args.table}_rollup;")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+""" Performance regression gate of the pipeline benchmarks (see bench_pipeline.py)
+
+usage: python benchmarks/compare.py [--baseline benchmarks/results/baseline.json] [--results FILE]
+       [--report report.json] [--host localhost --database gps --user gps]
+the benchmarks are run with the settings of the baseline (sites, date, days, seed, repeat, engines)
+unless --results gives a saved run; wall time and peak memory of each step are compared to the baseline
+within a tolerance (relative, with an absolute floor against the noise of short steps).
+the memory of a step is its tracemalloc peak (peak_alloc_bytes), the process peak rss only grows from step to step.
+the report is printed and saved as json with --report, the exit code is 1 on a regression.
+a baseline is saved with --save-baseline (run on the machine the gate runs on, the numbers are not portable):
+    python benchmarks/compare.py --save-baseline --sites 1000 --repeat 3
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+import bench_pipeline  # noqa: E402
+
+BASELINE = Path(__file__).parent / "results" / "baseline.json"
+# metric -> (relative tolerance, absolute floor)
+TOLERANCES = {"wall_seconds": (0.25, 0.05), "peak_alloc_bytes": (0.10, 16 * 2 ** 20)}
+# setup of the benchmark, timed once and not gated
+UNGATED = {"generate"}
+
+
+def _key(result: dict) -> tuple:
+    return result["step"], result["engine"], result["sites"]
+
+
+def check(metric: str, baseline: float, current: float, tolerance: tuple) -> str:
+    """
+    pass, regression or improvement of a metric, the allowed change is the larger of the
+    relative tolerance and the absolute floor
+    """
+    relative, floor = tolerance
+    allowed = max(baseline * relative, floor)
+    if current > baseline + allowed:
+        return "regression"
+    if current < baseline - allowed:
+        return "improvement"
+    return "pass"
+
+
+def compare(baseline: dict, results: dict, tolerances: dict = None) -> dict:
+    """
+    Compare the results of a benchmark run with a baseline.
+    A step is failed when it did not run ok, missing when it is in the baseline and not in the results
+    (a missing step fails the gate, a new step is reported and passes).
+    Return:
+        report: {baseline, results, tolerances, passed, checks: [{step, engine, sites, metric,
+        baseline, current, change, status}]}
+    """
+    tolerances = tolerances or TOLERANCES
+    current = {_key(result): result for result in results["results"] if result["step"] not in UNGATED}
+    reference = {_key(result): result for result in baseline["results"] if result["step"] not in UNGATED}
+    checks = []
+    for key, before in reference.items():
+        if before["status"] != "ok":
+            raise ValueError(f"{key} failed in the baseline, save a new one with --save-baseline")
+        step = dict(zip(["step", "engine", "sites"], key))
+        after = current.get(key)
+        if after is None or after["status"] != "ok":
+            checks.append({**step, "metric": None, "baseline": None, "current": None, "change": None,
+                           "status": "missing" if after is None else "failed"})
+            continue
+        for metric, tolerance in tolerances.items():
+            if before.get(metric) is None:
+                raise ValueError(f"no {metric} of {key} in the baseline, save a new one with --save-baseline")
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else None
+            checks.append({**step, "metric": metric, "baseline": before[metric], "current": after[metric],
+                           "change": round(change, 4) if change is not None else None,
+                           "status": check(metric, before[metric], after[metric], tolerance)})
+    for key in current.keys() - reference.keys():
+        checks.append({**dict(zip(["step", "engine", "sites"], key)), "metric": None, "baseline": None,
+                       "current": None, "change": None, "status": "new"})
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "baseline": {"commit": baseline["commit"], "created": baseline["created"]},
+        "results": {"commit": results["commit"], "created": results["created"]},
+        "settings": baseline.get("settings"),
+        "tolerances": {metric: {"relative": relative, "absolute": floor}
+                       for metric, (relative, floor) in tolerances.items()},
+        "passed": not any(item["status"] in {"regression", "missing", "failed"} for item in checks),
+        "checks": checks,
+    }
+
+
+def show(report: dict) -> None:
+    """
+    print the checks that did not pass, and the verdict
+    """
+    print(f"baseline {report['baseline']['commit']} -> {report['results']['commit']}")
+    print(f"{'step':<24}{'engine':>8}{'sites':>8}{'metric':>16}{'baseline':>14}{'current':>14}{'change':>9}"
+          f"  status")
+    for item in report["checks"]:
+        if item["status"] == "pass":
+            continue
+        scale = 2 ** 20 if item["metric"] == "peak_alloc_bytes" else 1
+        values = [f"{item[key] / scale:>14.2f}" if item[key] is not None else f"{'-':>14}"
+                  for key in ["baseline", "current"]]
+        change = f"{item['change']:>+9.1%}" if item["change"] is not None else f"{'-':>9}"
+        print(f"{item['step']:<24}{item['engine']:>8}{item['sites']:>8}{item['metric'] or '-':>16}"
+              f"{''.join(values)}{change}  {item['status']}")
+    passed = sum(item["status"] == "pass" for item in report["checks"])
+    print(f"{passed}/{len(report['checks'])} checks passed, gate {'passed' if report['passed'] else 'failed'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--results", default=None, help="saved run of bench_pipeline.py, the benchmarks run otherwise")
+    parser.add_argument("--report", default=None, help="json report of the comparison")
+    parser.add_argument("--save-baseline", action="store_true", help="run the benchmarks and save them as baseline")
+    parser.add_argument("--sites", type=int, nargs="+", default=[1000], help="with --save-baseline")
+    parser.add_argument("--date", default="2023-01-06", help="with --save-baseline")
+    parser.add_argument("--days", type=int, default=None, help="with --save-baseline")
+    parser.add_argument("--seed", type=int, default=0, help="with --save-baseline")
+    parser.add_argument("--repeat", type=int, default=3, help="with --save-baseline")
+    parser.add_argument("--engines", nargs="+", default=["pandas"], choices=["pandas", "duckdb", "spark"],
+                        help="with --save-baseline")
+    parser.add_argument("--wall-tolerance", type=float, default=TOLERANCES["wall_seconds"][0])
+    parser.add_argument("--memory-tolerance", type=float, default=TOLERANCES["peak_alloc_bytes"][0])
+    parser.add_argument("--host", default=None, help="postgres of write_pg, skipped when not given")
+    parser.add_argument("--port", default="5432")
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", ""))
+    args = parser.parse_args()
+    dsn = None if args.host is None else {"host": args.host, "port": args.port, "database": args.database,
+                                           "user": args.user, "password": args.password}
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        settings = {key: getattr(args, key) for key in ["sites", "date", "days", "seed", "repeat", "engines"]}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(bench_pipeline.benchmark(settings, dsn), indent=2))
+        print(f"baseline saved in {baseline_path}")
+        return
+    if not baseline_path.exists():
+        raise OSError(f"no baseline {baseline_path}, save one with --save-baseline")
+    baseline = json.loads(baseline_path.read_text())
+    if args.results:
+        results = json.loads(Path(args.results).read_text())
+    else:
+        settings = {key: value for key, value in baseline["settings"].items() if key != "write_pg"}
+        if baseline["settings"]["write_pg"] and dsn is None:
+            raise ValueError("the baseline has write_pg, give the postgres of the benchmark with --host")
+        results = bench_pipeline.benchmark(settings, dsn)
+    if results.get("settings") != baseline.get("settings"):
+        raise ValueError(f"results settings {results.get('settings')} differ from the baseline "
+                         f"{baseline.get('settings')}")
+    tolerances = {"wall_seconds": (args.wall_tolerance, TOLERANCES["wall_seconds"][1]),
+                  "peak_alloc_bytes": (args.memory_tolerance, TOLERANCES["peak_alloc_bytes"][1])}
+    report = compare(baseline, results, tolerances)
+    show(report)
+    if args.report:
+        Path(args.report).write_text(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
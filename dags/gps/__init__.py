@@ -1,11 +1,24 @@
+from functools import lru_cache
 from pathlib import Path
 import json
 
 
 
 config_file = Path(__file__).parents[2] / "config/configs.json"
-if config_file.exists():
+
+
+@lru_cache(maxsize=None)
+def load_config() -> dict:
+    """
+    project config, read once per process on first access of gps.CONFIG
+    """
+    if not config_file.exists():
+        raise RuntimeError("configs file don't exists")
     with config_file.open("r",) as f:
-        CONFIG = json.load(f)
-else:
-    raise RuntimeError("configs file don't exists")
\ No newline at end of file
+        return json.load(f)
+
+
+def __getattr__(name):
+    if name == "CONFIG":
+        return load_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
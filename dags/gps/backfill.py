@@ -0,0 +1,233 @@
+""" BACKFILL RUNNER
+
+Reprocess history outside of the scheduler, independent days and months run in a process pool.
+
+usage:
+    python -m gps.backfill --start 2023-01-06 --end 2023-06-06 --stages extract clean oneforall load --workers 4
+
+stages:
+    extract     daily pg/ftp extractions of every day of the range (tables with an "extract" config)
+                and the monthly trafic v2 extraction
+    clean       cleaning functions of every month
+    oneforall   oneforall of every month, a month waits for the previous one (previous_segment)
+    load        oneforall of every month to postgres
+Settings come from airflow variables (or AIRFLOW_VAR_* environment variables).
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+from gps import CONFIG
+from gps.common.datasets import DATASETS, dataset
+
+STAGES = ["extract", "clean", "oneforall", "load"]
+CLEANING = ["clean_base_sites", "cleaning_esco", "cleaning_ihs", "cleaning_ca_parc", "cleaning_traffic",
+            "cleaning_trafic_v2", "cleaning_cssr", "cleaning_congestion"]
+# cleanings reading the output of other cleanings of the month (cleaning_ihs reads the cleaned esco)
+CLEANING_DEPS = {"cleaning_ihs": ["cleaning_esco"]}
+TRAFIC_V2 = "ks_tdb_radio_drsi"
+
+
+def _init_worker(level: int) -> None:
+    """
+    worker setup, connections are cached per worker process (settings, extract, rwpg)
+    """
+    logging.basicConfig(level=level, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+
+def run_extract(table: str, date: str) -> int:
+    """
+    extract a table for a day (a month for the trafic v2 table) and save it in minio
+    """
+    from gps.common.extract import extract_ftp, extract_pg  # pylint: disable=import-outside-toplevel
+    from gps.common.rwminio import save_minio  # pylint: disable=import-outside-toplevel
+    from gps.common.settings import minio_client, variable  # pylint: disable=import-outside-toplevel
+    table_config = dataset(table)
+    if table == TRAFIC_V2:
+        data = extract_pg(variable("pg_host"), variable("pg_v2_db"), variable("pg_v2_user"),
+                          variable("pg_v2_password"), table=table, date=date, port=variable("pg_port", "5432"))
+    elif table_config.source == "ftp":
+        data = extract_ftp(variable("ftp_host"), variable("ftp_user"), variable("ftp_password"), date)
+    else:
+        pg_args = (variable("pg_host"), variable("pg_db"), variable("pg_user"), variable("pg_password"))
+        data = extract_pg(*pg_args, table=table, date=date, port=variable("pg_port", "5432"))
+        if table == "hourly_datas_radio_prod" and data.empty:
+            data = extract_pg(*pg_args, table="hourly_datas_radio_prod_archive", date=date,
+                              port=variable("pg_port", "5432"))
+    if data.empty:
+        raise RuntimeError(f"No data for {table} {date}")
+    save_minio(minio_client(), table_config.bucket, table_config.folder, date, data)
+    return len(data)
+
+
+def run_clean(name: str, date: str) -> int:
+    """
+    run a cleaning function for a month
+    """
+    from gps.common import cleaning  # pylint: disable=import-outside-toplevel
+    from gps.common.settings import with_minio  # pylint: disable=import-outside-toplevel
+    result = with_minio(getattr(cleaning, name))(date=date)
+    return len(result) if hasattr(result, "__len__") else 0
+
+
+def run_oneforall(date: str, start_date: str) -> int:
+    """
+    compute the oneforall of a month and save it in minio
+    """
+    from gps.common.enrich import oneforall_incremental  # pylint: disable=import-outside-toplevel
+    from gps.common.rwminio import save_minio  # pylint: disable=import-outside-toplevel
+    from gps.common.settings import minio_client, variable  # pylint: disable=import-outside-toplevel
+    data, _ = oneforall_incremental(minio_client(), variable("minio_host"), variable("minio_access_key"),
+                                    variable("minio_secret_key"), date, start_date, checkpoint=True)
+    if data.empty:
+        raise RuntimeError(f"No data for {date}")
+    save_minio(client=minio_client(), bucket="oneforall", folder=None, date=date, data=data)
+    return len(data)
+
+
+def run_load(date: str) -> int:
+    """
+    write the oneforall of a month in postgres, only the changed sites after an incremental run
+    """
+    from gps.common.enrich import get_emitted, get_last_ofa  # pylint: disable=import-outside-toplevel
+    from gps.common.rwpg import write_pg  # pylint: disable=import-outside-toplevel
+    from gps.common.settings import minio_client, variable  # pylint: disable=import-outside-toplevel
+    data = get_last_ofa(minio_client(), variable("minio_host"), variable("minio_access_key"),
+                        variable("minio_secret_key"), date)
+    if data.empty:
+        raise RuntimeError(f"No data for {date}")
+    emitted = get_emitted(minio_client(), date)
+    if emitted is not None:
+        # removed sites are in emitted but not in data, they are deleted even when the delta is empty
+        data = data.loc[data["code_oci"].isin(emitted)]
+    write_pg(variable("pg_save_host"), variable("pg_save_db"), variable("pg_save_user"),
+             variable("pg_save_password"), data=data, table="oneforall", codes=emitted,
+             port=variable("pg_save_port", "5432"), mode="replace" if emitted is None else "upsert",
+             months=[date[:7]])
+    return len(data)
+
+
+def plan(start: str, end: str, stages: list, start_date: str) -> dict:
+    """
+    Tasks of the backfill.
+    Return:
+        dict key -> (callable, args, dependency keys), keys are (stage, name, date)
+    """
+    from gps.common.enrich import month_dates  # pylint: disable=import-outside-toplevel
+    date_format = CONFIG["date_format"]
+    first, last = datetime.strptime(start, date_format), datetime.strptime(end, date_format)
+    days = [(first + timedelta(days=offset)).strftime(date_format) for offset in range((last - first).days + 1)]
+    months = month_dates(start, end)
+    tasks = {}
+    if "extract" in stages:
+        for table in DATASETS.values():
+            if table.source is not None:
+                for day in days:
+                    tasks[("extract", table.name, day)] = (run_extract, (table.name, day), [])
+        for month in months:
+            tasks[("extract", TRAFIC_V2, month)] = (run_extract, (TRAFIC_V2, month), [])
+    extracted = defaultdict(list)
+    for key in tasks:
+        extracted[key[2][:7]].append(key)
+    previous = None
+    for month in months:
+        cleaned = []
+        if "clean" in stages:
+            for name in CLEANING:
+                cleaned.append(("clean", name, month))
+                tasks[cleaned[-1]] = (run_clean, (name, month), extracted[month[:7]] + [
+                    ("clean", dep, month) for dep in CLEANING_DEPS.get(name, [])])
+        if "oneforall" in stages:
+            tasks[("oneforall", "oneforall", month)] = (
+                run_oneforall, (month, start_date), cleaned + ([previous] if previous else []))
+            previous = ("oneforall", "oneforall", month)
+        if "load" in stages:
+            tasks[("load", "oneforall", month)] = (
+                run_load, (month,), [previous] if "oneforall" in stages else [])
+    return tasks
+
+
+def run(tasks: dict, workers: int) -> dict:
+    """
+    Run tasks in a process pool as soon as their dependencies succeeded,
+    tasks depending on a failed task are skipped.
+    Return:
+        dict key -> (status, seconds, rows)
+    """
+    results = {}
+    pending = dict(tasks)
+    running = {}
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(logging.getLogger().level,)) as executor:
+        while pending or running:
+            for key, (func, args, deps) in list(pending.items()):
+                if any(results.get(dep, ("ok",))[0] != "ok" for dep in deps if dep in results):
+                    results[key] = ("skipped", 0.0, 0)
+                    del pending[key]
+                elif all(results.get(dep, ("",))[0] == "ok" for dep in deps):
+                    running[executor.submit(func, *args)] = (key, time.perf_counter())
+                    del pending[key]
+            if not running:
+                if pending:
+                    raise ValueError(f"unknown dependencies in {sorted(pending)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, submitted = running.pop(future)
+                try:
+                    results[key] = ("ok", time.perf_counter() - submitted, future.result())
+                except Exception as error:  # pylint: disable=broad-except
+                    logging.error("%s failed: %s", key, error)
+                    results[key] = ("failed", time.perf_counter() - submitted, 0)
+                status, seconds, rows = results[key]
+                print(f"[{len(results)}/{len(tasks)}] {' '.join(key)} {status} in {seconds:.1f}s "
+                      f"({rows} rows, {time.perf_counter() - started:.0f}s elapsed)", flush=True)
+    return results
+
+
+def summary(results: dict, elapsed: float) -> str:
+    """
+    per stage counts and throughput
+    """
+    lines = [f"{'stage':<12}{'ok':>6}{'failed':>8}{'skipped':>9}{'rows':>12}{'task s':>10}{'rows/s':>12}"]
+    for stage in STAGES:
+        stage_results = [result for key, result in results.items() if key[0] == stage]
+        if not stage_results:
+            continue
+        counts = {status: sum(1 for result in stage_results if result[0] == status)
+                  for status in ["ok", "failed", "skipped"]}
+        rows = sum(result[2] for result in stage_results)
+        seconds = sum(result[1] for result in stage_results)
+        lines.append(f"{stage:<12}{counts['ok']:>6}{counts['failed']:>8}{counts['skipped']:>9}{rows:>12}"
+                     f"{seconds:>10.1f}{rows / seconds if seconds else 0:>12,.0f}")
+    done = sum(1 for result in results.values() if result[0] == "ok")
+    lines.append(f"{done}/{len(results)} tasks in {elapsed:.1f}s, {done / elapsed * 60 if elapsed else 0:.1f} tasks/min")
+    return "\n".join(lines)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m gps.backfill", description="reprocess history")
+    parser.add_argument("--start", required=True, help="first day (YYYY-MM-DD), its day of month is used for months")
+    parser.add_argument("--end", required=True, help="last day (YYYY-MM-DD)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--start-date", default="2023-01-06", help="first month of oneforall history")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level)
+    tasks = plan(args.start, args.end, args.stages, args.start_date)
+    print(f"{len(tasks)} tasks on {args.workers} workers", flush=True)
+    started = time.perf_counter()
+    results = run(tasks, args.workers)
+    print(summary(results, time.perf_counter() - started))
+    return 0 if all(result[0] == "ok" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
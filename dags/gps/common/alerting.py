@@ -1,53 +1,265 @@
+import hashlib
+import json
+import time
 import traceback
 import smtplib
 import logging
+from email.message import EmailMessage
+from io import BytesIO
 import requests
 from gps import CONFIG
 
 
 
+_DIRECTORY = {"loaded": 0.0, "receivers": {}}
+
+
+def get_directory() -> dict:
+    """
+     receivers per file type from the mails api, cached for CONFIG["alerting"]["directory_ttl"] seconds.
+     The last known directory is kept when the api fails.
+    """
+    if time.monotonic() - _DIRECTORY["loaded"] > CONFIG["alerting"]["directory_ttl"] or not _DIRECTORY["loaded"]:
+        try:
+            objets = requests.get(CONFIG["api_mails"], timeout=CONFIG["alerting"]["api_timeout"]).json()
+            _DIRECTORY["receivers"] = {obj["typeFichier"]: obj.get("email", ['jean-louis.gbadi@orange.com'])
+                                       for obj in objets}
+            _DIRECTORY["loaded"] = time.monotonic()
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            logging.warning("mails api unavailable, keep the cached directory: %s", error)
+    return _DIRECTORY["receivers"]
+
+
 def get_receivers(code: str):
     """
      get receivers from api
     """
-    objets = requests.get(CONFIG["api_mails"], timeout=15).json()
-    objet =  next((obj for obj in objets if obj["typeFichier"] == code), None)
-    if not objet:
-        raise ValueError("thresold of type %s not available", code)
-    return objet.get("email", ['jean-louis.gbadi@orange.com'])
+    receivers = get_directory().get(code)
+    if not receivers:
+        raise ValueError(f"receivers of type {code} not available")
+    return receivers
+
+
+def alert_receivers(code: str = None) -> list:
+    """
+     receivers of a file type, CONFIG airflow_receivers when unknown or when the api is unavailable
+    """
+    try:
+        return get_receivers(code) if code else CONFIG["airflow_receivers"]
+    except ValueError:
+        return CONFIG["airflow_receivers"]
+
+
+def build_message(user, receivers, subject, content) -> EmailMessage:
+    """
+     one utf-8 message addressed to all receivers
+    """
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = user
+    message["To"] = ", ".join(receivers)
+    message.set_content(content)
+    return message
 
 
-def send_email(host, port, user, receivers, subject, content):
+def send_email(host, port, user, receivers, subject, content, timeout: float = None):
     """
-     function to send email
+     function to send email, one message to all receivers over a single smtp session
+     timeout: seconds of each blocking smtp operation, CONFIG["alerting"]["timeout"] by default
     """
-    logging.info(f"Sending mail ... ")
-    for receiver in receivers:
-        smtp_server = smtplib.SMTP(host, port)
-        smtp_server.sendmail(user, receiver, f"Subject: {subject}\n{content}") # sending the mail
-        logging.info(f"Email sent succefully :) to {receiver} ")
+    logging.info("Sending mail ... ")
+    timeout = CONFIG["alerting"]["timeout"] if timeout is None else timeout
+    with smtplib.SMTP(host, port, timeout=timeout) as smtp_server:
+        smtp_server.send_message(build_message(user, receivers, subject, content),
+                                 from_addr=user, to_addrs=list(receivers))
+    logging.info("Email sent succefully :) to %s", ", ".join(receivers))
+
+
+def deliver(host, port, user, receivers, subject, content, retries: int = None, backoff: float = None,
+            send=None, deadline: float = None) -> bool:
+    """
+     send an email in the calling process, retried a bounded number of times: airflow ends the task process
+     with os._exit after the failure callback, nothing sent in the background survives it.
+     The retries stop at CONFIG["alerting"]["deadline"] seconds, the smtp timeout of an attempt is cut to the
+     time left so a failure callback does not hold the worker much longer.
+     Return:
+        True when the email was sent
+    """
+    retries = CONFIG["alerting"]["retries"] if retries is None else retries
+    backoff = CONFIG["alerting"]["backoff"] if backoff is None else backoff
+    send = send_email if send is None else send
+    stop = time.monotonic() + (CONFIG["alerting"]["deadline"] if deadline is None else deadline)
+    for attempt in range(retries + 1):
+        try:
+            send(host, port, user, list(receivers), subject, content,
+                 timeout=max(min(CONFIG["alerting"]["timeout"], stop - time.monotonic()), 1))
+            return True
+        except (OSError, smtplib.SMTPException) as error:
+            logging.warning("send mail attempt %s failed: %s", attempt + 1, error)
+        pause = backoff * 2 ** attempt
+        if attempt == retries or time.monotonic() + pause >= stop:
+            break
+        time.sleep(pause)
+    logging.error("alert mail to %s not sent after %s attempts", ", ".join(receivers), attempt + 1)
+    return False
+
+
+_ALERT_STATE = {}
+
+
+def _state_path(key: str) -> str:
+    """
+     minio object of the coalescing state of an alert key
+    """
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f"{CONFIG['alerting']['state_prefix']}/{digest}.json"
+
+
+def _read_state(client, path: str):
+    response = client.get_object(CONFIG["alerting"]["state_bucket"], path)
+    try:
+        return json.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def _alert_state(key: str, client):
+    """
+     coalescing state of one alert key (one json object per key in minio, in process without client),
+     None when the alert was never sent
+    """
+    if client is None:
+        return _ALERT_STATE.get(key)
+    try:
+        return _read_state(client, _state_path(key))
+    except Exception as error:  # pylint: disable=broad-except
+        logging.info("no alert state of %s in minio (%s)", key, error)
+        return None
+
+
+def _save_alert_state(key: str, entry: dict, client) -> None:
+    """
+     Save the state of one alert key.
+     Each key has its own object so that failures of different tasks do not overwrite each other.
+     Concurrent failures of the same key are not locked (plain read-modify-write): the last write wins,
+     an occurrence can be missing from a digest or an alert sent twice.
+    """
+    if client is None:
+        _ALERT_STATE[key] = entry
+        return
+    bucket = CONFIG["alerting"]["state_bucket"]
+    payload = json.dumps(entry).encode("utf-8")
+    try:
+        if not client.bucket_exists(bucket):
+            client.make_bucket(bucket)
+        client.put_object(bucket, _state_path(key), data=BytesIO(payload), length=len(payload),
+                          content_type="application/json")
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning("alert state of %s not saved: %s", key, error)
+
+
+def _alert_states(client) -> list:
+    """
+     states of all the alert keys
+    """
+    if client is None:
+        return list(_ALERT_STATE.values())
+    states = []
+    try:
+        if not client.bucket_exists(CONFIG["alerting"]["state_bucket"]):
+            return states
+        for obj in client.list_objects(CONFIG["alerting"]["state_bucket"],
+                                       prefix=f"{CONFIG['alerting']['state_prefix']}/"):
+            states.append(_read_state(client, obj.object_name))
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning("alert states not read: %s", error)
+    return states
+
+
+def coalesce_alert(key: str, exec_date: str, client=None, now: float = None, details: dict = None):
+    """
+     Register an occurrence of an alert.
+     The first occurrence is sent, the next ones within CONFIG["alerting"]["coalesce_window"]
+     seconds are counted and sent in a digest by the first occurrence after the window
+     or by send_pending_alerts once the window expired.
+     details (dag_id, task_id, message, type_fichier) are kept for the digest.
+    Return:
+        None when the alert is suppressed, else the occurrences to report (count, exec dates)
+    """
+    now = time.time() if now is None else now
+    entry = _alert_state(key, client)
+    if entry is not None and now - entry["last_sent"] < CONFIG["alerting"]["coalesce_window"]:
+        entry.update(details or {})
+        entry["count"] += 1
+        entry["exec_dates"] = (entry["exec_dates"] + [exec_date])[-CONFIG["alerting"]["max_dates"]:]
+        _save_alert_state(key, entry, client)
+        return None
+    report = (1, [exec_date]) if entry is None else (entry["count"] + 1, entry["exec_dates"] + [exec_date])
+    _save_alert_state(key, {**(details or {}), "key": key, "last_sent": now, "count": 0, "exec_dates": []},
+                      client)
+    return report
+
+
+def send_pending_alerts(host, port, user, client=None, now: float = None) -> int:
+    """
+     send the digest of the alerts suppressed during a window that expired without a new failure
+     Return:
+        number of digests sent
+    """
+    now = time.time() if now is None else now
+    sent = 0
+    for entry in _alert_states(client):
+        if not entry["count"] or now - entry["last_sent"] < CONFIG["alerting"]["coalesce_window"]:
+            continue
+        task_id, dag_id = entry.get("task_id"), entry.get("dag_id")
+        email_content = f"""
+            Des erreurs sont survenues sur la tache {task_id} de OMER.
+            *Erreur survenue*: {entry.get("message")}
+            *Occurrences*: {entry["count"]} echecs depuis la derniere alerte ({', '.join(entry["exec_dates"])})
+            -----------------------------------------------------------------------------
+
+            *Message pour les developpeurs*: 
+            *Task id*: {task_id}
+            *dag id* : {dag_id}
+
+            """
+        subject = f"Rapport d'erreur sur GPS ({entry['count']} echecs)"
+        if deliver(host, port, user, alert_receivers(entry.get("type_fichier")), subject, email_content):
+            _save_alert_state(entry["key"], {**entry, "last_sent": now, "count": 0, "exec_dates": []}, client)
+            sent += 1
+    return sent
 
 
 def alert_failure(**kwargs):
     """
         send mail on failure
-    
+        same dag, task and exception type alerts are coalesced in one digest (see coalesce_alert)
+        kwargs: host, port, user, task_id, dag_id, exec_date, exception,
+                type_fichier (optional, receivers), client (optional, minio shared state)
     """
-    # log_url = context.get("task_instance").log_url
-    #task_id = context['task'].task_id
     task_id = kwargs["task_id"]
     dag_id = kwargs["dag_id"]
-    #dag_id = context['task'].dag_id
 
     exec_date = kwargs["exec_date"]
     exception = kwargs["exception"]
+    # the message is left out of the key, it often carries ids or dates that differ at each failure
+    report = coalesce_alert(f"{dag_id}|{task_id}|{type(exception).__name__}", exec_date, kwargs.get("client"),
+                            details={"dag_id": dag_id, "task_id": task_id, "message": str(exception),
+                                     "type_fichier": kwargs.get("type_fichier")})
+    if report is None:
+        logging.info("alert of %s.%s already sent, coalesced", dag_id, task_id)
+        return
+    count, exec_dates = report
     formatted_exception = ''.join(
                 traceback.format_exception(type(exception),
                                             value=exception,
                                             tb=exception.__traceback__)).strip()
+    occurrences = "" if count == 1 else f"""
+            *Occurrences*: {count} echecs depuis la derniere alerte ({', '.join(exec_dates)})"""
     email_content = f"""
             Une erreur est survenue sur la tache {task_id} de OMER.
-            *Erreur survenue*: {exception}
+            *Erreur survenue*: {exception}{occurrences}
             -----------------------------------------------------------------------------
 
             *Message pour les developpeurs*: 
@@ -59,10 +271,7 @@ def alert_failure(**kwargs):
             {formatted_exception}
 
             """
-    # send email for alerting
-    reponse = requests.get(CONFIG["api_mails"], timeout=500).content
-    #validation_receivers  = [rec["email"] for rec in reponse if rec["typeFichier"] == kwargs["type_fichier"]]
-    validation_receivers = CONFIG['airflow_receivers']
+    validation_receivers = alert_receivers(kwargs.get("type_fichier"))
     logging.info(f"send alert mail to {', '.join(validation_receivers)}")
-    subject = "Rapport d'erreur sur GPS"
-    send_email(kwargs["host"],kwargs["port"], kwargs["user"], validation_receivers, subject, email_content)
+    subject = "Rapport d'erreur sur GPS" if count == 1 else f"Rapport d'erreur sur GPS ({count} echecs)"
+    deliver(kwargs["host"], kwargs["port"], kwargs["user"], validation_receivers, subject, email_content)
@@ -0,0 +1,151 @@
+""" STAGE CHECKPOINTING
+
+Stage outputs are pickled in CONFIG["checkpoints"]["bucket"] (or local_dir) as <name>/<stage>-<key>.pkl.
+Retention: CONFIG["checkpoints"]["keep"] keys are kept per stage and name (month), the older ones
+are deleted by run_stages.
+"""
+import hashlib
+import json
+import logging
+import pickle
+from io import BytesIO
+from pathlib import Path
+from gps import CONFIG
+
+
+def stage_key(previous_key: str, stage: str, params) -> str:
+    """
+    hash of the previous stage key, the stage name and its parameters
+    """
+    payload = json.dumps([previous_key, stage, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _local_dir():
+    """
+    local checkpoint directory, None to use minio
+    """
+    local_dir = CONFIG["checkpoints"].get("local_dir")
+    return Path(local_dir) if local_dir else None
+
+
+def checkpoint_exists(client, path: str) -> bool:
+    """
+    check if a checkpoint exists
+    """
+    local_dir = _local_dir()
+    if local_dir is not None:
+        return (local_dir / path).exists()
+    bucket = CONFIG["checkpoints"]["bucket"]
+    if not client.bucket_exists(bucket):
+        return False
+    return any(obj.object_name == path for obj in client.list_objects(bucket, prefix=path))
+
+
+def save_checkpoint(client, path: str, data) -> None:
+    """
+    save a stage output (any picklable object)
+    """
+    payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    local_dir = _local_dir()
+    if local_dir is not None:
+        (local_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (local_dir / path).write_bytes(payload)
+        return
+    bucket = CONFIG["checkpoints"]["bucket"]
+    if not client.bucket_exists(bucket):
+        client.make_bucket(bucket)
+    client.put_object(bucket, path, data=BytesIO(payload), length=len(payload),
+                      content_type="application/octet-stream")
+
+
+def load_checkpoint(client, path: str):
+    """
+    load a stage output
+    """
+    local_dir = _local_dir()
+    if local_dir is not None:
+        return pickle.loads((local_dir / path).read_bytes())
+    response = client.get_object(CONFIG["checkpoints"]["bucket"], path)
+    try:
+        return pickle.loads(response.read())
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def remove_checkpoint(client, path: str) -> None:
+    """
+    delete a checkpoint, nothing when it does not exist
+    """
+    local_dir = _local_dir()
+    if local_dir is not None:
+        (local_dir / path).unlink(missing_ok=True)
+        return
+    bucket = CONFIG["checkpoints"]["bucket"]
+    if client.bucket_exists(bucket):
+        client.remove_object(bucket, path)
+
+
+def prune_checkpoints(client, name: str, stage: str, current: str) -> list:
+    """
+    Delete the older checkpoints of a stage: every params change (new input hash) writes a new key,
+    only current and the most recent others up to CONFIG["checkpoints"]["keep"] keys are kept.
+    Return:
+        paths deleted
+    """
+    prefix = f"{name}/{stage}-"
+    local_dir = _local_dir()
+    if local_dir is not None:
+        found = [(path.stat().st_mtime, str(path.relative_to(local_dir)))
+                 for path in (local_dir / name).glob(f"{stage}-*.pkl")]
+    else:
+        found = [(obj.last_modified.timestamp(), obj.object_name)
+                 for obj in client.list_objects(CONFIG["checkpoints"]["bucket"], prefix=prefix)]
+    others = [path for _, path in sorted(found, reverse=True) if path != current]
+    deleted = others[max(CONFIG["checkpoints"]["keep"] - 1, 0):]
+    for path in deleted:
+        remove_checkpoint(client, path)
+    if deleted:
+        logging.info("%s old checkpoints of %s deleted", len(deleted), prefix)
+    return deleted
+
+
+def run_stages(client, name: str, stages: list):
+    """
+    Run stages, checkpointing every output.
+    Keys are chained: a stage key depends on the previous key and on the stage params,
+    so a rerun resumes from the first stage whose key has no checkpoint.
+    The checkpoints of older keys of each stage are deleted (see prune_checkpoints).
+    Args:
+        client: Minio client
+        name: checkpoint folder (e.g. oneforall/2023/01/06)
+        stages: list of (stage name, params callable, func(previous output, params))
+    Return:
+        output of the last stage
+    """
+    key = ""
+    resumed_from = None
+    resuming = True
+    data = None
+    for stage, params_fn, func in stages:
+        params = params_fn()
+        key = stage_key(key, stage, params)
+        path = f"{name}/{stage}-{key}.pkl"
+        if resuming and checkpoint_exists(client, path):
+            resumed_from = path
+            prune_checkpoints(client, name, stage, path)
+            continue
+        if resuming:
+            resuming = False
+            if resumed_from is not None:
+                logging.info("resume from checkpoint %s", resumed_from)
+                data = load_checkpoint(client, resumed_from)
+        logging.info("run stage %s", stage)
+        data = func(data, params)
+        save_checkpoint(client, path, data)
+        prune_checkpoints(client, name, stage, path)
+    if resuming:
+        logging.info("every stage is checkpointed, load %s", resumed_from)
+        data = load_checkpoint(client, resumed_from)
+    return data
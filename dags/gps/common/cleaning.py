@@ -5,8 +5,9 @@ import pandas as pd
 from copy import deepcopy
 import calendar
 from unidecode import unidecode
-from gps import CONFIG
+from gps.common.datasets import dataset
 from gps.common.rwminio import save_minio, get_latest_file, get_files
+from gps.common.metrics import instrument
 
 def clean_dataframe(df_, cols_to_trim, subset_unique, subset_na)-> pd.DataFrame:
     """
@@ -28,7 +29,20 @@ def process_code_oci_annexe(col):
     else:
         return col
 
-def clean_base_sites(client, endpoint: str, accesskey: str, secretkey: str, date: str) -> None:
+def backend(engine: str, endpoint: str, accesskey: str, secretkey: str):
+    """
+    (module, session) of a non pandas engine for the monthly aggregations
+    """
+    if engine == "spark":
+        from gps.common import spark  # pylint: disable=import-outside-toplevel
+        return spark, spark.get_spark(endpoint, accesskey, secretkey)
+    if engine == "duckdb":
+        from gps.common import duck  # pylint: disable=import-outside-toplevel
+        return duck, duck.get_duck(endpoint, accesskey, secretkey)
+    raise ValueError(f"unknown engine {engine}")
+
+@instrument
+def clean_base_sites(client, endpoint: str, accesskey: str, secretkey: str, date: str, save=save_minio) -> pd.DataFrame:
     """
        clean  base sites file:
        Args:
@@ -37,23 +51,22 @@ def clean_base_sites(client, endpoint: str, accesskey: str, secretkey: str, date
         - accesskey: Minio accesskey
         - secretkey: Minio secretkey
         - date: execution date (provide by airflow)
+        - save: saving function of the cleaned data (default save_minio)
       Return:
-        None
+        cleaned dataframe
     """
     # Get the table object
-    table_obj = next((table for table in CONFIG["tables"] if table["name"] == "BASE_SITES"), None)
-    if not table_obj:
-        raise ValueError("Table BASE_SITES not found.")
+    table_obj = dataset("BASE_SITES")
      # Check if bucket exists
-    if not client.bucket_exists(table_obj["bucket"]):
-        raise ValueError(f"Bucket {table_obj['bucket']} does not exist.")
+    if not client.bucket_exists(table_obj.bucket):
+        raise ValueError(f"Bucket {table_obj.bucket} does not exist.")
      # Get filename
     date_parts = date.split("-")
-    filename = get_latest_file(client=client, bucket=table_obj["bucket"], prefix=f"{table_obj['folder']}/{table_obj['folder']}_{date_parts[0]}{date_parts[1]}")
+    filename = get_latest_file(client=client, bucket=table_obj.bucket, prefix=table_obj.monthly_prefix(date))
     logging.info("Reading %s", filename)
      # Read file from minio
     try:
-        df_ = pd.read_excel(f"s3://{table_obj['bucket']}/{filename}",
+        df_ = pd.read_excel(f"s3://{table_obj.bucket}/{filename}",
                            storage_options={
                                "key": accesskey,
                                "secret": secretkey,
@@ -65,7 +78,7 @@ def clean_base_sites(client, endpoint: str, accesskey: str, secretkey: str, date
     logging.info("Checking columns")
     df_.columns = df_.columns.str.lower().map(unidecode)
     df_.columns = df_.columns.str.strip()
-    missing_cols = set(table_obj["columns"]) - set(df_.columns)
+    missing_cols = set(table_obj.columns) - set(df_.columns)
     if missing_cols:
         raise ValueError(f"Missing columns: {', '.join(missing_cols)}")
      # Clean data
@@ -76,13 +89,15 @@ def clean_base_sites(client, endpoint: str, accesskey: str, secretkey: str, date
     subset_na = subset_unique = ["code oci"]
     df_ = clean_dataframe(df_, cols_to_trim, subset_unique, subset_na)
     df_["code oci id"] = df_["code oci"].str.replace("OCI", "").astype("float64")
-    df_ = df_.loc[(df_["statut"].str.lower() == "service") & (df_["position site"].str.lower().isin(["localité", "localié"])), table_obj["columns"] + ["code oci id", "mois"]]
+    df_ = df_.loc[(df_["statut"].str.lower() == "service") & (df_["position site"].str.lower().isin(["localité", "localié"])), list(table_obj.columns) + ["code oci id", "mois"]]
      # Save cleaned data to minio
     logging.info("Saving data to minio")
-    save_minio(client, table_obj["bucket"], f"{table_obj['folder']}-cleaned", date, df_)
+    save(client, table_obj.bucket, table_obj.cleaned, date, df_)
+    return df_
 
 
-def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str)-> None:
+@instrument
+def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str, save=save_minio) -> pd.DataFrame:
     """
     Clean opex esco file
        Args:
@@ -91,20 +106,19 @@ def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str
         - accesskey: Minio accesskey
         - secretkey: Minio secretkey
         - date: execution date (provide by airflow)
+        - save: saving function of the cleaned data (default save_minio)
       Return:
-        None
+        cleaned dataframe
     """
-    objet = next((d for d in CONFIG["tables"] if d["name"] == "OPEX_ESCO"), None)
-    if objet is None:
-        raise ValueError("Table OPEX_ESCO not found in CONFIG.")
-    if not client.bucket_exists(objet["bucket"]):
-        raise OSError(f"Bucket {objet['bucket']} does not exist.")
+    objet = dataset("OPEX_ESCO")
+    if not client.bucket_exists(objet.bucket):
+        raise OSError(f"Bucket {objet.bucket} does not exist.")
     date_parts = date.split("-")
-    prefix = f"{objet['folder']}/{objet['folder']}_{date_parts[0]}{date_parts[1]}"
-    filename = get_latest_file(client, objet["bucket"], prefix=prefix)
+    prefix = objet.monthly_prefix(date)
+    filename = get_latest_file(client, objet.bucket, prefix=prefix)
     try:
         logging.info("Reading %s", filename)
-        df_ = pd.read_excel(f"s3://{objet['bucket']}/{filename}",
+        df_ = pd.read_excel(f"s3://{objet.bucket}/{filename}",
                                 header = 3, sheet_name="Fichier_de_calcul",
                                 storage_options={
                                 "key": accesskey,
@@ -123,19 +137,17 @@ def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str
     ## get annexe if exists
 
     
-    objet = next((d for d in CONFIG["tables"] if d["name"] == "ANNEXE_OPEX_ESCO"), None)
-    if objet is None:
-        raise ValueError("Table ANNEXE_OPEX_ESCO not found in CONFIG.")
-    if not client.bucket_exists(objet["bucket"]):
-        raise OSError(f"Bucket {objet['bucket']} does not exist.")
-    prefix = f"{objet['folder']}/{objet['folder']}_{date_parts[0]}{date_parts[1]}"
-    filename = get_latest_file(client, objet["bucket"], prefix=prefix)
+    objet = dataset("ANNEXE_OPEX_ESCO")
+    if not client.bucket_exists(objet.bucket):
+        raise OSError(f"Bucket {objet.bucket} does not exist.")
+    prefix = objet.monthly_prefix(date)
+    filename = get_latest_file(client, objet.bucket, prefix=prefix)
     data = deepcopy(df_)
     if filename!=None:
         logging.info("add annexe")
         try:
             logging.info("Reading %s", filename)
-            annexe = pd.read_excel(f"s3://{objet['bucket']}/{filename}",
+            annexe = pd.read_excel(f"s3://{objet.bucket}/{filename}",
                                     header = 3, sheet_name="Fichier_de_calcul",
                                     storage_options={
                                     "key": accesskey,
@@ -153,7 +165,7 @@ def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str
     ## concat df_ and annexe
         data = pd.concat([data, annexe])
     logging.info("check columns")
-    missing_columns = set(objet["columns"]) - (set(data.columns))
+    missing_columns = set(objet.columns) - (set(data.columns))
     if missing_columns:
         raise ValueError(f"missing columns {', '.join(missing_columns)}")
     logging.info("columns validation OK")
@@ -165,38 +177,41 @@ def cleaning_esco(client, endpoint:str, accesskey:str, secretkey:str,  date: str
     data["mois"] = date_parts[0]+"-"+date_parts[1]
     data = clean_dataframe(data, cols_to_trim, subset_unique, subset_na)
     logging.info("Saving to minio")
-    save_minio(client, objet["bucket"], f'OPEX_ESCO-cleaned', date, data)
+    save(client, objet.bucket, dataset("OPEX_ESCO").cleaned, date, data)
+    return data
 
 
 
 
-def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str)-> None:
+@instrument
+def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str, esco: pd.DataFrame = None,
+                 save=save_minio):
     """
-    Clean opex esco file
+    Clean opex ihs file
        Args:
         - client: Minio client
         - endpoint: Minio endpoint
         - accesskey: Minio accesskey
         - secretkey: Minio secretkey
         - date: execution date (provide by airflow)
+        - esco: cleaned opex esco of the month, read from minio if not given
+        - save: saving function of the cleaned data (default save_minio)
       Return:
-        None
+        cleaned dataframe, None outside of the first month of a quarter
     """
     date_parts = date.split("-")
     acceptable_months = ["01", "04", "07", "10"]
     if date_parts[1] not in acceptable_months:
         return
-    # Retrieving object from CONFIG
-    objet = next((d for d in CONFIG["tables"] if d["name"] == "OPEX_IHS"), None)
-    if objet is None:
-        raise ValueError("Table OPEX_IHS not found in CONFIG.")
-    if not client.bucket_exists(objet["bucket"]):
-        raise OSError(f"Bucket {objet['bucket']} does not exist.")
+    # Retrieving the dataset of the table
+    objet = dataset("OPEX_IHS")
+    if not client.bucket_exists(objet.bucket):
+        raise OSError(f"Bucket {objet.bucket} does not exist.")
      # Retrieving the latest file and reading it
-    prefix = f"{objet['folder']}/{objet['folder']}_{date_parts[0]}{date_parts[1]}"
-    filename = get_latest_file(client, objet["bucket"], prefix=prefix)
+    prefix = objet.monthly_prefix(date)
+    filename = get_latest_file(client, objet.bucket, prefix=prefix)
     logging.info("read file %s",filename)
-    excel = pd.read_excel(f"s3://{objet['bucket']}/{filename}",
+    excel = pd.read_excel(f"s3://{objet.bucket}/{filename}",
                           sheet_name=None,
                           storage_options={
                               "key": accesskey,
@@ -205,7 +220,7 @@ def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str)
                           })
      # Concatenating data from different sheets
     data = pd.DataFrame()
-    for sheet in objet["sheets"]:
+    for sheet in objet.sheets:
         matching_sheets = [s for s in excel.keys() if s.find(sheet) != -1]
         for sh_ in matching_sheets:
             logging.info("read %s sheet %s", filename, sh_)
@@ -215,11 +230,11 @@ def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str)
             df_ = df_.iloc[header:]
             df_.columns = df_.columns.str.lower()
             is_bpci_22 = sh_.find("OCI-MLL BPCI 22") == -1
-            columns_to_check = ['site id ihs', 'site name', 'category', 'trimestre ht'] if is_bpci_22 else objet["columns"]
+            columns_to_check = ['site id ihs', 'site name', 'category', 'trimestre ht'] if is_bpci_22 else objet.columns
             missing_columns = set(columns_to_check) - (set(df_.columns))
             if missing_columns:
                 raise ValueError(f"missing columns {', '.join(missing_columns)} in sheet {sh_} of file {filename}")
-            df_ = df_.loc[:, ['site id ihs', 'site name', 'category', 'trimestre ht']] if is_bpci_22 else df_.loc[:, objet['columns']]
+            df_ = df_.loc[:, ['site id ihs', 'site name', 'category', 'trimestre ht']] if is_bpci_22 else df_.loc[:, list(objet.columns)]
             if is_bpci_22:
                 df_['trimestre ht'] = df_['trimestre ht'].astype("float")
             else:
@@ -238,20 +253,23 @@ def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str)
     data_final = data_final.reset_index(drop=True)
     logging.info("Add breakout data")    
     #download esco to make ratio
-    esco_objet =  next((d for d in CONFIG["tables"] if d["name"] == "OPEX_ESCO"), None)
-    prefix = f"{esco_objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}"
-    filename = get_latest_file(client, esco_objet["bucket"], prefix=prefix)
-    try:
-        logging.info("read %s", filename)
-        esco = pd.read_csv(f"s3://{esco_objet['bucket']}/{filename}",
-                                 storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
+    if esco is None:
+        esco_objet = dataset("OPEX_ESCO")
+        prefix = esco_objet.cleaned_prefix(date)
+        filename = get_latest_file(client, esco_objet.bucket, prefix=prefix)
+        try:
+            logging.info("read %s", filename)
+            esco = pd.read_csv(f"s3://{esco_objet.bucket}/{filename}",
+                                     storage_options={
+                                    "key": accesskey,
+                                    "secret": secretkey,
+                                    "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
+                    }
+                        )
+        except Exception as error:
+            raise OSError(f"{filename} don't exists in bucket") from error
+    else:
+        esco = esco.copy()
     esco.loc[esco["discount"].isnull(), "discount"] = 0
     esco.loc[esco["volume discount"].isnull(), "volume discount" ]= 0
     esco["opex_without_discount"] = esco["total redevances ht"] + esco["discount"] + esco["volume discount"]
@@ -266,32 +284,38 @@ def cleaning_ihs(client, endpoint:str, accesskey:str, secretkey:str,  date: str)
     data_final["maintenance passive preventive"] = ratio["maintenance passive preventive"].values * data_final["month_total"]
     data_final["gardes de securite"] = ratio["gardes de securite"].values * data_final["month_total"]
     logging.info("save to minio")
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, data_final)
+    save(client, objet.bucket, objet.cleaned, date, data_final)
+    return data_final
 
 
 
 
-def cleaning_ca_parc(client, endpoint:str, accesskey:str, secretkey:str,  date: str)-> None:
+@instrument
+def cleaning_ca_parc(client, endpoint:str, accesskey:str, secretkey:str,  date: str, save=save_minio,
+                     engine: str = "pandas") -> pd.DataFrame:
     """
      cleaning CA & Parc
+     engine: "pandas" or a backend of the monthly aggregation (see backend)
     """
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "caparc"), None)
-    if not objet:
-        raise ValueError("Table caparc not found.")
+    objet = dataset("caparc")
      # Check if the bucket for the alarm table exists
-    if not client.bucket_exists(objet["bucket"]):
-        raise ValueError(f"Bucket {objet['bucket']} does not exist.") 
-    date_parts = date.split("-")
-    filenames = get_files(client, objet["bucket"], prefix=f"{objet['folder']}/{date_parts[0]}/{date_parts[1]}")
+    if not client.bucket_exists(objet.bucket):
+        raise ValueError(f"Bucket {objet.bucket} does not exist.") 
+    filenames = get_files(client, objet.bucket, prefix=objet.daily_prefix(date))
     
     number_days = calendar.monthrange(int(date.split("-")[0]), int(date.split("-")[1]))[1]
     if len(filenames) != number_days:
         raise RuntimeError(f"We need {number_days} files for {date} but we have {len(filenames)}")
+    if engine != "pandas":
+        module, session = backend(engine, endpoint, accesskey, secretkey)
+        data = module.ca_parc(session, objet.bucket, filenames)
+        save(client, objet.bucket, objet.cleaned, date, data)
+        return data
     data = pd.DataFrame()
     for filename in filenames:
         try:
                     
-            df_ = pd.read_csv(f"s3://{objet['bucket']}/{filename}", sep=",",
+            df_ = pd.read_csv(f"s3://{objet.bucket}/{filename}", sep=",",
                         storage_options={
                             "key": accesskey,
                             "secret": secretkey,
@@ -312,11 +336,13 @@ def cleaning_ca_parc(client, endpoint:str, accesskey:str, secretkey:str,  date:
           "parc_other": 'last'})
     data.reset_index(drop=False, inplace=True)
     logging.info("Start to save data")
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, data)
+    save(client, objet.bucket, objet.cleaned, date, data)
+    return data
 
 
 
-def cleaning_alarm(client, endpoint: str, accesskey: str, secretkey: str, date: str) -> None:
+@instrument
+def cleaning_alarm(client, endpoint: str, accesskey: str, secretkey: str, date: str, save=save_minio) -> pd.DataFrame:
     """
     Clean  alarm files
     Args:
@@ -325,25 +351,24 @@ def cleaning_alarm(client, endpoint: str, accesskey: str, secretkey: str, date:
         - accesskey: Minio accesskey
         - secretkey: Minio secretkey
         - date: execution date (provided by airflow)
+        - save: saving function of the cleaned data (default save_minio)
     Return:
-        None
+        cleaned dataframe
     """
     # Get the object for the alarm table from the config
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "faitalarme"), None)
-    if not objet:
-        raise ValueError("Table faitalarme not found.")
+    objet = dataset("faitalarme")
      # Check if the bucket for the alarm table exists
-    if not client.bucket_exists(objet["bucket"]):
-        raise ValueError(f"Bucket {objet['bucket']} does not exist.")
+    if not client.bucket_exists(objet.bucket):
+        raise ValueError(f"Bucket {objet.bucket} does not exist.")
      # Split the date into year and month
     date_parts = date.split("-")
-    filenames = get_files(client, objet["bucket"], prefix=f"{objet['folder']}/{date_parts[0]}/{date_parts[1]}")
+    filenames = get_files(client, objet.bucket, prefix=objet.daily_prefix(date))
      # Read the data from the files and concatenate them into a single dataframe
     data = pd.DataFrame()
     for filename in filenames:
         try:
                     
-            df_ = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
+            df_ = pd.read_csv(f"s3://{objet.bucket}/{filename}",
                         storage_options={
                             "key": accesskey,
                             "secret": secretkey,
@@ -373,11 +398,14 @@ def cleaning_alarm(client, endpoint: str, accesskey: str, secretkey: str, date:
     data_final.reset_index(drop=False, inplace= True)
     data_final = data_final.fillna(0)
      # Save the cleaned data to a new file in the same bucket
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, data_final)
+    save(client, objet.bucket, objet.cleaned, date, data_final)
+    return data_final
 
 
 
-def cleaning_traffic(client, endpoint: str, accesskey: str, secretkey: str, date: str):
+@instrument
+def cleaning_traffic(client, endpoint: str, accesskey: str, secretkey: str, date: str, save=save_minio,
+                     engine: str = "pandas"):
     """
     Cleans traffic files
     Args:
@@ -386,26 +414,29 @@ def cleaning_traffic(client, endpoint: str, accesskey: str, secretkey: str, date
         - accesskey: Minio access key
         - secretkey: Minio secret key
         - date: execution date (provided by airflow)
+        - save: saving function of the cleaned data (default save_minio)
+        - engine: "pandas" or a backend of the monthly aggregation (see backend)
     Return:
-        None
+        cleaned dataframe
     """
-     # Find the required object in the CONFIG dictionary
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "hourly_datas_radio_prod"), None)
-    if not objet:
-        raise ValueError("Table hourly_datas_radio_prod not found.")
+     # Find the dataset of the table
+    objet = dataset("hourly_datas_radio_prod")
      # Check if bucket exists
-    if not client.bucket_exists(objet["bucket"]):
-        raise ValueError(f"Bucket {objet['bucket']} does not exist.")
-     # Split the date into parts
-    date_parts = date.split("-")
+    if not client.bucket_exists(objet.bucket):
+        raise ValueError(f"Bucket {objet.bucket} does not exist.")
      # Get all files for the given date
-    filenames = get_files(client, objet["bucket"], f"{objet['folder']}/{date_parts[0]}/{date_parts[1]}")
+    filenames = get_files(client, objet.bucket, objet.daily_prefix(date))
+    if engine != "pandas":
+        module, session = backend(engine, endpoint, accesskey, secretkey)
+        data = module.traffic(session, objet.bucket, filenames)
+        save(client, objet.bucket, objet.cleaned, date, data)
+        return data
      # Read and concatenate all files into a single DataFrame
     data = pd.DataFrame()
     for filename in filenames:
         try:
                     
-            df_ = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
+            df_ = pd.read_csv(f"s3://{objet.bucket}/{filename}",
                               storage_options={
                                   "key": accesskey,
                                   "secret": secretkey,
@@ -428,9 +459,11 @@ def cleaning_traffic(client, endpoint: str, accesskey: str, secretkey: str, date
     data.columns = ["_".join(d) for d in data.columns]
     data.reset_index(drop=False, inplace=True)
      # Save the cleaned DataFrame to Minio
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, data)
+    save(client, objet.bucket, objet.cleaned, date, data)
+    return data
 
-def cleaning_trafic_v2(client, endpoint: str, accesskey: str, secretkey: str, date: str):
+@instrument
+def cleaning_trafic_v2(client, endpoint: str, accesskey: str, secretkey: str, date: str, save=save_minio):
     """
     Cleans traffic files
     Args:
@@ -439,22 +472,19 @@ def cleaning_trafic_v2(client, endpoint: str, accesskey: str, secretkey: str, da
         - accesskey: Minio access key
         - secretkey: Minio secret key
         - date: execution date (provided by airflow)
+        - save: saving function of the cleaned data (default save_minio)
     Return:
-        None
+        cleaned dataframe
     """
-     # Find the required object in the CONFIG dictionary
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "ks_tdb_radio_drsi"), None)
-    if not objet:
-        raise ValueError("Table ks_tdb_radio_drsi not found.")
+     # Find the dataset of the table
+    objet = dataset("ks_tdb_radio_drsi")
      # Check if bucket exists
-    if not client.bucket_exists(objet["bucket"]):
-        raise ValueError(f"Bucket {objet['bucket']} does not exist.")
-     # Split the date into parts
-    date_parts = date.split("-")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
+    if not client.bucket_exists(objet.bucket):
+        raise ValueError(f"Bucket {objet.bucket} does not exist.")
+    filename = get_latest_file(client, objet.bucket, prefix = objet.daily_prefix(date, day=True))
     try:
         logging.info("read %s", filename)
-        trafic = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
+        trafic = pd.read_csv(f"s3://{objet.bucket}/{filename}",
                                 storage_options={
                                 "key": accesskey,
                                 "secret": secretkey,
@@ -478,7 +508,8 @@ def cleaning_trafic_v2(client, endpoint: str, accesskey: str, secretkey: str, da
     trafic.columns = ["_".join(d) for d in trafic.columns]
     trafic.reset_index(drop=False, inplace=True)
      # Save the cleaned dataFrame to Minio
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, trafic)
+    save(client, objet.bucket, objet.cleaned, date, trafic)
+    return trafic
 
 # def cleaning_call_drop(endpoint:str, accesskey:str, secretkey:str,  date: str):
 #     """
@@ -525,7 +556,9 @@ def cleaning_trafic_v2(client, endpoint: str, accesskey: str, secretkey: str, da
 
 
 
-def cleaning_cssr(client, endpoint:str, accesskey:str, secretkey:str,  date: str):
+@instrument
+def cleaning_cssr(client, endpoint:str, accesskey:str, secretkey:str,  date: str, save=save_minio,
+                  engine: str = "pandas"):
     """
     Cleans cssr files
     Args:
@@ -534,30 +567,32 @@ def cleaning_cssr(client, endpoint:str, accesskey:str, secretkey:str,  date: str
         - accesskey: Minio access key
         - secretkey: Minio secret key
         - date: execution date (provided by airflow)
+        - save: saving function of the cleaned data (default save_minio)
+        - engine: "pandas" or a backend of the monthly aggregation (see backend)
     Return:
-        None
+        cleaned dataframe
     """
-    objet_2g = next((table for table in CONFIG["tables"] if table["name"] == "Taux_succes_2g"), None)
-    if not objet_2g:
-        raise ValueError("Table Taux_succes_2 not found.")
+    objet_2g = dataset("Taux_succes_2g")
         # Check if bucket exists
-    if not client.bucket_exists(objet_2g["bucket"]):
-        raise ValueError(f"Bucket {objet_2g['bucket']} does not exist.") 
+    if not client.bucket_exists(objet_2g.bucket):
+        raise ValueError(f"Bucket {objet_2g.bucket} does not exist.") 
     
-    objet_3g = next((table for table in CONFIG["tables"] if table["name"] == "Taux_succes_3g"), None)
-    if not objet_3g:
-        raise ValueError("Table Taux_succes_3 not found.")
+    objet_3g = dataset("Taux_succes_3g")
         # Check if bucket exists
-    if not client.bucket_exists(objet_3g["bucket"]):
-        raise ValueError(f"Bucket {objet_3g['bucket']} does not exist.")
+    if not client.bucket_exists(objet_3g.bucket):
+        raise ValueError(f"Bucket {objet_3g.bucket} does not exist.")
     
-    date_parts = date.split("-")
-    filenames = get_files(client, objet_2g["bucket"], prefix = f"{objet_2g['folder']}/{date_parts[0]}/{date_parts[1]}") + get_files(client, objet_3g["bucket"], prefix = f"{objet_3g['folder']}/{date_parts[0]}/{date_parts[1]}")
+    filenames = get_files(client, objet_2g.bucket, prefix = objet_2g.daily_prefix(date)) + get_files(client, objet_3g.bucket, prefix = objet_3g.daily_prefix(date))
+    if engine != "pandas":
+        module, session = backend(engine, endpoint, accesskey, secretkey)
+        cssr = module.cssr(session, objet_2g.bucket, filenames)
+        save(client, objet_2g.bucket, objet_2g.cleaned, date, cssr)
+        return cssr
     cssr = pd.DataFrame()
     for filename in filenames:
         try:
                     
-            df_ = pd.read_csv(f"s3://{objet_2g['bucket']}/{filename}",
+            df_ = pd.read_csv(f"s3://{objet_2g.bucket}/{filename}",
                         storage_options={
                             "key": accesskey,
                             "secret": secretkey,
@@ -579,12 +614,14 @@ def cleaning_cssr(client, endpoint:str, accesskey:str, secretkey:str,  date: str
     cssr = cssr.groupby(["MOIS", "code_site"]).mean()
     cssr = cssr.reset_index(drop=False)
     logging.info("start to save data")
-    save_minio(client, objet_2g["bucket"], f'{objet_2g["bucket"]}-cleaned', date, cssr)
+    save(client, objet_2g.bucket, objet_2g.cleaned, date, cssr)
+    return cssr
 
 
 # clean congestion
 
-def cleaning_congestion(client, endpoint:str, accesskey:str, secretkey:str,  date: str): 
+@instrument
+def cleaning_congestion(client, endpoint:str, accesskey:str, secretkey:str,  date: str, save=save_minio): 
     """
     Cleans congestion files
     Args:
@@ -593,22 +630,21 @@ def cleaning_congestion(client, endpoint:str, accesskey:str, secretkey:str,  dat
         - accesskey: Minio access key
         - secretkey: Minio secret key
         - date: execution date (provided by airflow)
+        - save: saving function of the cleaned data (default save_minio)
     Return:
-        None
+        cleaned dataframe
     """
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "CONGESTION"), None)
-    if not objet:
-        raise ValueError("Table CONGESTION not found.")
+    objet = dataset("CONGESTION")
         # Check if bucket exists
-    if not client.bucket_exists(objet["bucket"]):
-        raise ValueError(f"Bucket {objet['bucket']} does not exist.")      
+    if not client.bucket_exists(objet.bucket):
+        raise ValueError(f"Bucket {objet.bucket} does not exist.")      
     
     date_parts = date.split("-")
-    filename = get_latest_file(client=client, bucket=objet["bucket"], prefix=f"{objet['folder']}/{objet['folder']}_{date_parts[0]}{date_parts[1]}")
+    filename = get_latest_file(client=client, bucket=objet.bucket, prefix=objet.monthly_prefix(date))
     logging.info("Reading %s", filename)
      # Read file from minio
     try:
-        df_ = pd.read_excel(f"s3://{objet['bucket']}/{filename}",
+        df_ = pd.read_excel(f"s3://{objet.bucket}/{filename}",
                            storage_options={
                                "key": accesskey,
                                "secret": secretkey,
@@ -619,7 +655,7 @@ def cleaning_congestion(client, endpoint:str, accesskey:str, secretkey:str,  dat
     # Check columns
     logging.info("Checking columns")
     df_.columns = df_.columns.str.lower().map(unidecode)
-    missing_cols = set(objet["columns"]) - set(df_.columns)
+    missing_cols = set(objet.columns) - set(df_.columns)
     if missing_cols:
         raise ValueError(f"Missing columns: {', '.join(missing_cols)}")
      # Clean data
@@ -631,7 +667,8 @@ def cleaning_congestion(client, endpoint:str, accesskey:str, secretkey:str,  dat
     df_.dropna(subset=["code_site"], inplace=True)
     df_.drop_duplicates(subset=["code_site"], keep="first", inplace=True)
 
-    df_ = df_.groupby(["mois", "code_site"])["cellules_2g","cellules_2g_congestionnees","cellules_3g", "cellules_3g_congestionnees", "cellules_4g", "cellules_4g_congestionnees"].sum()
+    df_ = df_.groupby(["mois", "code_site"])[["cellules_2g","cellules_2g_congestionnees","cellules_3g", "cellules_3g_congestionnees", "cellules_4g", "cellules_4g_congestionnees"]].sum()
     df_[["cellules_4g_congestionnees", "cellules_2g_congestionnees", "cellules_3g_congestionnees"]] = df_[["cellules_4g_congestionnees", "cellules_2g_congestionnees", "cellules_3g_congestionnees"]].fillna(value=0)
     df_ = df_.reset_index(drop=False)
-    save_minio(client, objet["bucket"], f'{objet["folder"]}-cleaned', date, df_)
+    save(client, objet.bucket, objet.cleaned, date, df_)
+    return df_
@@ -0,0 +1,141 @@
+""" DATASET REGISTRY
+
+The tables of CONFIG["tables"] as typed datasets, validated and indexed by name once at import.
+The prefixes of the minio objects are built from templates computed with the dataset:
+    dataset("OPEX_ESCO").monthly_prefix("2023-01-06")   OPEX_ESCO/OPEX_ESCO_202301   monthly workbooks
+    dataset("faitalarme").daily_prefix("2023-01-06")    indisponibilite/2023/01      extracted files of the month
+    dataset("OPEX_ESCO").cleaned_prefix("2023-01-06")   OPEX_ESCO-cleaned/2023/01/06
+"""
+import re
+from dataclasses import dataclass, field
+from gps import CONFIG
+
+# minio (s3) bucket names
+BUCKET = re.compile(r"^[a-z0-9][a-z0-9.-]{1,61}[a-z0-9]$")
+SOURCES = {"pg", "ftp"}
+
+
+def _names(name: str, key: str, values) -> tuple:
+    """
+    validated list of column or sheet names
+    """
+    if not isinstance(values, (list, tuple)) or not all(isinstance(value, str) and value for value in values):
+        raise ValueError(f"{key} of {name} must be a list of names")
+    duplicated = {value for value in values if values.count(value) > 1}
+    if duplicated:
+        raise ValueError(f"duplicated {key} of {name}: {', '.join(sorted(duplicated))}")
+    return tuple(values)
+
+
+def _folder(name: str, key: str, value) -> str:
+    """
+    validated folder of a bucket
+    """
+    if not isinstance(value, str) or not value or value != value.strip("/ ") or "//" in value:
+        raise ValueError(f"invalid {key} {value!r} of {name}")
+    return value
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """
+    A table of CONFIG["tables"]
+    Args:
+        name: name of the table (source table of the extractions, type of file of the workbooks)
+        bucket: minio bucket of the raw and cleaned files
+        folder: folder of the raw files in the bucket
+        table: name of the table in the warehouse
+        columns: columns expected in the raw files
+        sheets: sheets of the workbooks read
+        source, cost: extraction (pg or ftp) and its cost class, None when the table is not extracted daily
+        cleaned: folder of the cleaned files, <folder>-cleaned by default
+    """
+    name: str
+    bucket: str
+    folder: str
+    table: str
+    columns: tuple = ()
+    sheets: tuple = ()
+    source: str = None
+    cost: str = None
+    cleaned: str = None
+    monthly_template: str = field(init=False, repr=False)
+    daily_template: str = field(init=False, repr=False)
+    cleaned_template: str = field(init=False, repr=False)
+
+    def __post_init__(self):
+        for key in ["name", "table"]:
+            if not isinstance(getattr(self, key), str) or not getattr(self, key):
+                raise ValueError(f"missing {key} of table {self.name!r}")
+        if not isinstance(self.bucket, str) or not BUCKET.match(self.bucket):
+            raise ValueError(f"invalid bucket {self.bucket!r} of {self.name}")
+        folder = _folder(self.name, "folder", self.folder)
+        cleaned = _folder(self.name, "cleaned", self.cleaned or f"{folder}-cleaned")
+        values = {"folder": folder, "cleaned": cleaned,
+                  "columns": _names(self.name, "columns", self.columns),
+                  "sheets": _names(self.name, "sheets", self.sheets),
+                  "monthly_template": f"{self.folder}/{self.folder}_{{year}}{{month}}",
+                  "daily_template": f"{self.folder}/{{year}}/{{month}}",
+                  "cleaned_template": f"{cleaned}/{{year}}/{{month}}/{{day}}"}
+        if self.source is not None and self.source not in SOURCES:
+            raise ValueError(f"unknown extraction source {self.source!r} of {self.name}")
+        if (self.source is None) != (self.cost is None) or (self.cost is not None
+                                                             and self.cost not in CONFIG["cost_classes"]):
+            raise ValueError(f"invalid extraction cost {self.cost!r} of {self.name}")
+        for key, value in values.items():
+            object.__setattr__(self, key, value)
+
+    def monthly_prefix(self, date: str) -> str:
+        """
+        prefix of the workbooks of the month of date
+        """
+        year, month, _ = date.split("-")
+        return self.monthly_template.format(year=year, month=month)
+
+    def daily_prefix(self, date: str, day: bool = False) -> str:
+        """
+        prefix of the extracted files of the month of date (of the day with day)
+        """
+        year, month, day_ = date.split("-")
+        prefix = self.daily_template.format(year=year, month=month)
+        return f"{prefix}/{day_}" if day else prefix
+
+    def cleaned_prefix(self, date: str, month: str = None) -> str:
+        """
+        prefix of the cleaned file of date (another month of the same year with month)
+        """
+        year, month_, day = date.split("-")
+        return self.cleaned_template.format(year=year, month=month or month_, day=day)
+
+
+def load_datasets(tables: list) -> dict:
+    """
+    datasets of the tables of the config by name
+    """
+    datasets = {}
+    for table in tables:
+        extract = table.get("extract") or {}
+        unknown = set(table) - {"name", "bucket", "folder", "table", "columns", "sheets", "extract", "cleaned"}
+        if unknown:
+            raise ValueError(f"unknown keys {', '.join(sorted(unknown))} of table {table.get('name')!r}")
+        dataset_ = Dataset(name=table.get("name"), bucket=table.get("bucket"), folder=table.get("folder"),
+                           table=table.get("table"), columns=table.get("columns", ()),
+                           sheets=table.get("sheets", ()), source=extract.get("source"),
+                           cost=extract.get("cost"), cleaned=table.get("cleaned"))
+        if dataset_.name in datasets:
+            raise ValueError(f"duplicated table {dataset_.name}")
+        datasets[dataset_.name] = dataset_
+    return datasets
+
+
+DATASETS = load_datasets(CONFIG["tables"])
+
+
+def dataset(name: str) -> Dataset:
+    """
+    dataset of a table of the config
+    """
+    try:
+        return DATASETS[name]
+    except KeyError:
+        raise ValueError(f"Table {name} not found in CONFIG.") from None
@@ -0,0 +1,174 @@
+""" DUCKDB BACKEND
+
+DuckDB versions of the monthly aggregations of the cleaning functions: the csv files
+of a month are scanned by one multi-threaded read_csv, grouped and pivoted in SQL,
+only the aggregated result is fetched to pandas. Results follow the pandas functions
+(same columns and values) as in spark.py.
+Files are read from minio through httpfs (CONFIG["duckdb"]["source"] = "httpfs") or from
+a local copy of the objects (source "cache", refreshed when the object changed).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import duckdb
+import pandas as pd
+from minio import Minio
+from gps import CONFIG
+
+
+def _quote(value: str) -> str:
+    """
+    sql string literal
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class DuckSession:
+    """
+    duckdb database of a process and the location of the minio objects
+    """
+
+    def __init__(self, endpoint: str, accesskey: str, secretkey: str):
+        settings = CONFIG["duckdb"]
+        self.source = settings["source"]
+        self.database = duckdb.connect(config={"threads": settings["threads"],
+                                               "memory_limit": settings["memory_limit"]})
+        if self.source == "httpfs":
+            # installed in the image (docker/Dockerfile), never downloaded by a task
+            try:
+                self.database.execute("LOAD httpfs")
+            except duckdb.Error as error:
+                raise RuntimeError("duckdb httpfs extension not installed, run INSTALL httpfs "
+                                   "once on the worker (see docker/Dockerfile)") from error
+            for name, value in [("s3_endpoint", endpoint), ("s3_access_key_id", accesskey),
+                                ("s3_secret_access_key", secretkey), ("s3_url_style", "path")]:
+                self.database.execute(f"SET {name} = {_quote(value)}")
+            self.database.execute("SET s3_use_ssl = false")
+        elif self.source == "cache":
+            self.client = Minio(endpoint, access_key=accesskey, secret_key=secretkey, secure=False)
+            self.cache_dir = settings["cache_dir"]
+        else:
+            raise ValueError(f"unknown duckdb source {self.source}")
+
+    def _download(self, bucket: str, filename: str) -> str:
+        """
+        local copy of an object, downloaded again when the object is newer
+        """
+        path = os.path.join(self.cache_dir, bucket, filename)
+        stat = self.client.stat_object(bucket, filename)
+        if (not os.path.exists(path) or os.path.getsize(path) != stat.size
+                or os.path.getmtime(path) < stat.last_modified.timestamp()):
+            self.client.fget_object(bucket, filename, path)
+        return path
+
+    def paths(self, bucket: str, filenames: list) -> list:
+        """
+        paths duckdb reads the objects of a bucket from
+        """
+        if self.source == "httpfs":
+            return [f"s3://{bucket}/{filename}" for filename in filenames]
+        with ThreadPoolExecutor(max_workers=CONFIG["duckdb"]["threads"]) as executor:
+            return list(executor.map(lambda filename: self._download(bucket, filename), filenames))
+
+    def scan(self, bucket: str, filenames: list) -> str:
+        """
+        sql source of the csv files with a _file (position in filenames) column to keep the file order
+        """
+        paths = "[" + ", ".join(_quote(path) for path in self.paths(bucket, filenames)) + "]"
+        return (f"(SELECT *, list_position({paths}, filename) AS _file "
+                f"FROM read_csv({paths}, header = true, union_by_name = true, filename = true))")
+
+    def query(self, sql: str) -> pd.DataFrame:
+        """
+        run a script on its own cursor (the database can be shared by threads), last result to pandas
+        """
+        cursor = self.database.cursor()
+        try:
+            statements = [statement for statement in sql.split(";") if statement.strip()]
+            for statement in statements[:-1]:
+                cursor.execute(statement)
+            return cursor.execute(statements[-1]).df()
+        finally:
+            cursor.close()
+
+
+@lru_cache(maxsize=None)
+def get_duck(endpoint: str, accesskey: str, secretkey: str) -> DuckSession:
+    """
+    duckdb session, one per process
+    """
+    return DuckSession(endpoint, accesskey, secretkey)
+
+
+def _unstack(data: pd.DataFrame, keys: list, values: list) -> pd.DataFrame:
+    """
+    pandas names (value_techno, values first, technos sorted) of the columns of a PIVOT ON techno
+    """
+    technos = sorted({column.split("_", 1)[0] for column in data.columns if column not in keys})
+    columns = {f"{techno}_{value}": f"{value}_{techno}" for value in values for techno in technos}
+    return data.rename(columns=columns)[keys + list(columns.values())]
+
+
+def _month(column: str) -> str:
+    """
+    YYYY-MM of a YYYYMMDD day
+    """
+    return f"substr({column}, 1, 4) || '-' || substr({column}, 5, 2)"
+
+
+def traffic(session: DuckSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    monthly voice and data traffic per site and techno (see cleaning.cleaning_traffic)
+    """
+    data = session.query(f"""
+        CREATE TEMP TABLE grouped AS
+        SELECT {_month("CAST(date_jour AS VARCHAR)")} AS mois,
+               coalesce(trim(CAST(code_site AS VARCHAR)), 'nan') AS code_site, techno,
+               sum(coalesce(CAST(trafic_voix AS DOUBLE), 0)) AS trafic_voix,
+               sum(coalesce(CAST(trafic_data AS DOUBLE), 0)) AS trafic_data
+        FROM {session.scan(bucket, filenames)}
+        WHERE techno IS NOT NULL
+        GROUP BY ALL;
+        SELECT * FROM (PIVOT grouped ON techno
+                       USING first(trafic_voix) AS trafic_voix, first(trafic_data) AS trafic_data
+                       GROUP BY mois, code_site)
+        ORDER BY mois, code_site""")
+    return _unstack(data, ["mois", "code_site"], ["trafic_voix", "trafic_data"])
+
+
+def cssr(session: DuckSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    call setup success rate per site, summed per day and techno then averaged over the month
+    (see cleaning.cleaning_cssr, without its averaged date_jour column)
+    """
+    data = session.query(f"""
+        CREATE TEMP TABLE daily AS
+        SELECT * FROM (
+            -- first row of a day, site and techno in file order, missing value included (drop_duplicates)
+            SELECT CAST(date_jour AS VARCHAR) AS date_jour, code_site, techno,
+                   arg_min({{'value': avg_cssr_cs}}, {{'file': _file, 'row': _row}}).value AS avg_cssr_cs
+            FROM (SELECT *, row_number() OVER () AS _row FROM {session.scan(bucket, filenames)})
+            GROUP BY ALL)
+        WHERE code_site IS NOT NULL AND avg_cssr_cs IS NOT NULL AND techno IS NOT NULL;
+        SELECT {_month("date_jour")} AS MOIS, code_site, avg(COLUMNS('_avg_cssr_cs$'))
+        FROM (PIVOT daily ON techno USING sum(avg_cssr_cs) AS avg_cssr_cs GROUP BY date_jour, code_site)
+        GROUP BY ALL
+        ORDER BY MOIS, code_site""")
+    return _unstack(data, ["MOIS", "code_site"], ["avg_cssr_cs"])
+
+
+def ca_parc(session: DuckSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    monthly revenues (sum) and last subscriber counts per site (see cleaning.cleaning_ca_parc)
+    """
+    lasts = ["parc", "parc_data", "parc_2g", "parc_3g", "parc_4g", "parc_5g", "parc_other"]
+    # last non missing value in day order
+    last = ", ".join(f"last(CAST({column} AS DOUBLE) ORDER BY day_id, _file, _row) "
+                     f"FILTER (WHERE {column} IS NOT NULL) AS {column}" for column in lasts)
+    return session.query(f"""
+        SELECT coalesce(trim(CAST(id_site AS VARCHAR)), 'nan') AS id_site,
+               sum(coalesce(CAST(ca_voix AS DOUBLE), 0)) AS ca_voix,
+               sum(coalesce(CAST(ca_data AS DOUBLE), 0)) AS ca_data, {last}
+        FROM (SELECT *, row_number() OVER () AS _row FROM {session.scan(bucket, filenames)})
+        GROUP BY 1
+        ORDER BY 1""")
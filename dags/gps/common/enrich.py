@@ -1,67 +1,56 @@
 """ enrich data"""
 
+import hashlib
+import numpy as np
 import pandas as pd
 import requests
-import calendar
 from datetime import datetime, timedelta
 from minio import Minio
 from copy import deepcopy
 from gps import CONFIG
+from gps.common.datasets import dataset
 from gps.common.rwminio import  get_latest_file
+from gps.common.rules import evaluate_rules
+from gps.common import kpis
+from gps.common.cleaning import backend
+from gps.common.metrics import instrument
+from gps.common.checkpoint import run_stages, checkpoint_exists, load_checkpoint, save_checkpoint, remove_checkpoint
 import logging
 
-################################## joindre les tables
-def get_number_days(mois: str):
-    """
-       get number of days in month
-    """
-    try:
-        year, month = map(int, mois.split("-"))
-    except ValueError:
-        return "Invalid input format. Please use format 'YYYY-MM'."
-    return calendar.monthrange(year, month)[1]
-
-def get_number_cellule(dataframe, cellule: str):
-    """
-        get number of cellule 
-    """
-    # Get the sum of values in the specified cell for the given month
-    cellule_total = dataframe[cellule].sum()
-    return cellule_total
-
-
-
-def pareto(dataframe):
-  """
-    add pareto
-  """
-  total = dataframe.ca_total.sum()
-  dataframe = dataframe.sort_values(by="ca_total", ascending = False)
-  dataframe["sommecum"] = dataframe.ca_total.cumsum()
-  dataframe.loc[dataframe.sommecum<total*0.8 ,"pareto"] = 1
-  dataframe.loc[dataframe.sommecum>total*0.8 ,"pareto"] = 0
-  dataframe["pareto"] = dataframe["pareto"].astype(bool)
-  return dataframe.drop(columns = ["sommecum"])
-
-
-
-def prev_segment(dataframe):
-    """
-        get previous segment
-    """
-    
-    past_site = None
-    past_segment = None
-    for idx, row in dataframe.iterrows():
-        if past_site == row["CODE_OCI"]:
-            dataframe.loc[idx, "PREVIOUS_SEGMENT"] = past_segment
-            past_segment = row["SEGMENT"]
-        else: 
-            past_site = row["CODE_OCI"]
-            past_segment = row["SEGMENT"]
-            dataframe.loc[idx,"PREVIOUS_SEGMENT"] = None
-    return dataframe
+ONEFORALL_COLUMNS = ['mois', 'code_oci', 'site', 'autre_code', 'longitude', 'latitude', 'type_du_site',
+                     'statut', 'localisation', 'commune', 'departement', 'region', 'partenaires',
+                     'proprietaire', 'gestionnaire', 'type_geolocalite', 'projet', 'clutter',
+                     'position_site', 'ca_voix', 'ca_data', 'parc_global', 'parc_data', 'parc_2g',
+                     'parc_3g', 'parc_4g', 'parc_5g', 'autre_parc', 'o_m', 'energie', 'infra',
+                     'maintenance_passive_preventive', 'garde_de_securite', 'discount', 'volume_discount',
+                     'tva', 'opex_itn', 'delay_2g', 'delay_3g', 'delay_4g', 'delaycellule_2g',
+                     'delaycellule_3g', 'delaycellule_4g', 'nbrecellule_2g', 'nbrecellule_3g',
+                     'nbrecellule_4g', 'trafic_voix_2g', 'trafic_voix_3g', 'trafic_voix_4g',
+                     'trafic_data_2g', 'trafic_data_3g', 'trafic_data_4g', 'trafic_data_v2_2g',
+                     'trafic_data_v2_3g', 'trafic_data_v2_4g', 'trafic_voix_v2_2g', 'trafic_voix_v2_3g',
+                     'trafic_voix_v2_4g', 'cellules_2g_congestionnees', 'cellules_2g',
+                     'cellules_3g_congestionnees', 'cellules_3g', 'cellules_4g_congestionnees', 'cellules_4g',
+                     'cellules_v2_2g', 'cellules_congestionne_v2_2g', 'cellules_v2_3g',
+                     'cellules_congestionne_v2_3g', 'cellules_v2_4g', 'cellules_congestionne_v2_4g',
+                     'avg_cssr_cs_2g', 'avg_cssr_cs_3g', 'trafic_voix_total', 'trafic_data_total', 'ca_total',
+                     'segment', 'pareto', 'cellules_congestionnees_total', 'cellules_congestionnees_total_v2',
+                     'cellules_total', 'cellules_total_v2', 'taux_congestion_2g', 'taux_congestion_3g',
+                     'taux_congestion_4g', 'taux_congestion_total', 'taux_congestion_2g_v2',
+                     'taux_congestion_3g_v2', 'taux_congestion_4g_v2', 'taux_congestion_total_v2',
+                     'recommandation', 'recommandation_v2', 'arpu', 'segmentation_rentabilite',
+                     'segmentation_rentabilite_v2', 'cssr_pondere_trafic_2g', 'cssr_pondere_trafic_3g',
+                     'cssr_pondere_trafic_2g_v2', 'cssr_pondere_trafic_3g_v2', 'interco', 'impot',
+                     'frais_dist', 'opex', 'autre_opex', 'ebitda', 'marge_ca', 'rentable',
+                     'niveau_rentabilite', 'days', 'nur_2g', 'nur_3g', 'nur_4g', 'nur_2g_v2', 'nur_3g_v2',
+                     'nur_4g_v2', 'nur_total', 'nur_total_v2', 'previous_segment']
+# columns produced by join_inputs
+JOIN_COLUMNS = ONEFORALL_COLUMNS[:ONEFORALL_COLUMNS.index("ca_total") + 1]
+# global aggregates maintained per mois (pareto, cssr and NUR denominators)
+TRAFIC_TOTAL_COLUMNS = ["trafic_voix_2g", "trafic_voix_3g", "trafic_voix_v2_2g", "trafic_voix_v2_3g"]
+TOTAL_COLUMNS = ["ca_total"] + TRAFIC_TOTAL_COLUMNS + ["cellules_2g", "cellules_3g", "cellules_4g",
+                                                       "cellules_v2_2g", "cellules_v2_3g", "cellules_v2_4g"]
 
+################################## joindre les tables
 def get_thresold(code: str):
     """
      get thresold from api
@@ -72,60 +61,14 @@ def get_thresold(code: str):
         raise ValueError("thresold of type %s not available", code)
     return objet.get("value", CONFIG[code]).replace(",",".")
 
-def oneforall(client, endpoint:str, accesskey:str, secretkey:str,  date: str, start_date):
+def read_cleaned(client, endpoint: str, accesskey: str, secretkey: str, bucket: str, prefix: str) -> pd.DataFrame:
     """
-       merge all data and generate oneforall
+       read the latest cleaned file matching prefix
     """
-    date_parts = date.split("-")
-    #get bdd site
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "BASE_SITES"), None)
-    if objet is None:
-        raise ValueError("Table 'BASE_SITES' not found in configuration")
-    # Parse the date string into datetime object
-    
-    filename = get_latest_file(client= client, bucket= objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
-    try:
-        logging.info("read %s", filename)
-        bdd = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                storage_options={
-                "key": accesskey,
-                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
-    
-    #get CA
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "caparc"), None)
-    if objet is None:
-        raise ValueError("Table 'caparc' not found in configuration")
-        
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
-
-    try:        
-        logging.info("read %s", filename)
-        caparc = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                storage_options={
-                            "key": accesskey,
-                            "secret": secretkey,
-                            "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                                    }
-                            )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
-    
-    # get opex esco
-
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "OPEX_ESCO"), None) 
-    if objet is None:
-        raise ValueError("Table 'BASE_SITES' not found in configuration")
-    
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
+    filename = get_latest_file(client, bucket, prefix=prefix)
     try:
         logging.info("read %s", filename)
-        esco = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                
+        return pd.read_csv(f"s3://{bucket}/{filename}",
                                 storage_options={
                                 "key": accesskey,
                                 "secret": secretkey,
@@ -134,127 +77,97 @@ def oneforall(client, endpoint:str, accesskey:str, secretkey:str,  date: str, st
                     )
     except Exception as error:
         raise OSError(f"{filename} don't exists in bucket") from error
-    
-    # get opex ihs
-    if date.split('-')[1] in ["01","02", "03"]:
-        pre = "01"
-    elif date.split('-')[1] in ["04","05", "06"]:
-        pre = "04"
-    elif date.split('-')[1] in ["07","08", "09"]:
-        pre = "07"
-    else:
-        pre = "10"
-    
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "OPEX_IHS"), None)
-    if objet is None:
-        raise ValueError("Table 'OPEX_IHS' not found in configuration")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{pre}/{date_parts[2]}")
 
-    try:
-        logging.info("read %s", filename)
-        ihs = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
-    
-    # get  indisponibilité
-    # objet = next((table for table in CONFIG["tables"] if table["name"] == "faitalarme"), None)
-    # if objet is None:
-    #     raise ValueError("Table 'faitalarme' not found in configuration")
-  
-    # filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
-
-    # try:
-    #     logging.info("read %s", filename)
-    #     indisponibilite = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-    #                             storage_options={
-    #                             "key": accesskey,
-    #                             "secret": secretkey,
-    #             "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-    #             }
-    #                 )
-    # except Exception as error:
-    #     raise OSError(f"{filename} don't exists in bucket") from error
-
-    # get trafic
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "hourly_datas_radio_prod"), None)
-    if objet is None:
-        raise ValueError("Table 'hourly_datas_radio_prod' not found in configuration")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
 
-    try:
-        logging.info("read %s", filename)
-        trafic = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
-    
-    # get trafic_v2
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "ks_tdb_radio_drsi"), None)
-    if objet is None:
-        raise ValueError("Table 'ks_tdb_radio_drsi' not found in configuration")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
-    try:
-        logging.info("read %s", filename)
-        trafic2 = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
+# cleaned inputs of oneforall: key -> table name (see gps.common.datasets)
+INPUT_SOURCES = {
+    "bdd": "BASE_SITES",
+    "caparc": "caparc",
+    "esco": "OPEX_ESCO",
+    "ihs": "OPEX_IHS",
+    "trafic": "hourly_datas_radio_prod",
+    "trafic2": "ks_tdb_radio_drsi",
+    "cssr": "Taux_succes_2g",
+    "cong": "CONGESTION",
+}
 
-    # get CSSR
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "Taux_succes_2g"), None)
-    if objet is None:
-        raise ValueError("Table 'Taux_succes_2g' not found in configuration")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['bucket']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
 
-    try:
-        logging.info("read %s", filename)
-        cssr = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
+def input_object(client, key: str, date: str) -> tuple:
+    """
+       locate the cleaned input key of the month
+       Return:
+        (bucket, filename)
+    """
+    objet = dataset(INPUT_SOURCES[key])
+    month = None
+    if key == "ihs":
+        # opex ihs is only provided on the first month of each quarter
+        month = str((int(date.split("-")[1]) - 1) // 3 * 3 + 1).zfill(2)
+    return objet.bucket, get_latest_file(client, objet.bucket, prefix=objet.cleaned_prefix(date, month=month))
 
-    # get congestion
-    objet = next((table for table in CONFIG["tables"] if table["name"] == "CONGESTION"), None)
-    if objet is None:
-        raise ValueError("Table 'CONGESTION' not found in configuration")
-    filename = get_latest_file(client, objet["bucket"], prefix = f"{objet['folder']}-cleaned/{date_parts[0]}/{date_parts[1]}/{date_parts[2]}")
-    try:
-        logging.info("read %s", filename)
-        cong = pd.read_csv(f"s3://{objet['bucket']}/{filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-    except Exception as error:
-        raise OSError(f"{filename} don't exists in bucket") from error
+
+def input_objects(client, date: str) -> dict:
+    """
+       locate every cleaned input of the month
+       Return:
+        dict with keys bdd, caparc, esco, ihs, trafic, trafic2, cssr, cong and (bucket, filename) values
+    """
+    return {key: input_object(client, key, date) for key in INPUT_SOURCES}
 
 
+def inputs_digest(inputs: dict) -> dict:
+    """
+       content hash of in-memory inputs, used as checkpoint parameters
+    """
+    return {key: hashlib.sha256(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()).hexdigest()[:16]
+            for key, frame in inputs.items()}
+
+
+def read_inputs(endpoint: str, accesskey: str, secretkey: str, objects: dict) -> dict:
+    """
+       read the cleaned inputs located by input_objects
+    """
+    inputs = {}
+    for key, (bucket, filename) in objects.items():
+        try:
+            logging.info("read %s", filename)
+            inputs[key] = pd.read_csv(f"s3://{bucket}/{filename}",
+                                    storage_options={
+                                    "key": accesskey,
+                                    "secret": secretkey,
+                    "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
+                    }
+                        )
+        except Exception as error:
+            raise OSError(f"{filename} don't exists in bucket") from error
+    return inputs
+
+
+def load_inputs(client, endpoint: str, accesskey: str, secretkey: str, date: str) -> dict:
+    """
+       read every cleaned input of the month
+    """
+    return read_inputs(endpoint, accesskey, secretkey, input_objects(client, date))
+
+
+def join_objects(endpoint: str, accesskey: str, secretkey: str, objects: dict, engine: str) -> pd.DataFrame:
+    """
+       join_inputs of the cleaned inputs located by input_objects, read and merged by a non pandas engine
+    """
+    module, session = backend(engine, endpoint, accesskey, secretkey)
+    return module.join_inputs(module.read_inputs(session, objects))
+
+
+def join_inputs(inputs: dict) -> pd.DataFrame:
+    """
+       merge the cleaned inputs of one month on the base sites
+    """
+    bdd, caparc, esco, ihs = inputs["bdd"], inputs["caparc"], inputs["esco"], inputs["ihs"]
+    trafic, trafic2, cssr, cong = inputs["trafic"], inputs["trafic2"], inputs["cssr"], inputs["cong"]
+    # the month of a row is the base sites one, a second mois_x column fails the merges on pandas 2
+    trafic, trafic2, cong = (frame.drop(columns="mois", errors="ignore") for frame in (trafic, trafic2, cong))
     # merging
 
-    
     logging.info("merge bdd and CA")
     bdd_ca = bdd.merge(caparc, left_on=["code oci id"], right_on = ["id_site" ], how="left")
     
@@ -386,184 +299,426 @@ def oneforall(client, endpoint:str, accesskey:str, secretkey:str,  date: str, st
     df_final["trafic_data_total"] = df_final["trafic_data_2g"]+df_final["trafic_data_3g"] + df_final["trafic_data_4g"]
 
     df_final["ca_total"] = df_final["ca_data"] + df_final["ca_voix"]
-    df_final.loc[((df_final.localisation.str.lower()=="abidjan") & (df_final.ca_total>=20000000)) | ((df_final.localisation.str.lower()=="intérieur") & (df_final.ca_total>=10000000)),["segment"]] = "PREMIUM"
-    df_final.loc[((df_final.localisation.str.lower()=="abidjan") & ((df_final.ca_total>=10000000) & (df_final.ca_total<20000000) )) | ((df_final.localisation.str.lower()=="intérieur") & ((df_final.ca_total>=4000000) & (df_final.ca_total<10000000))),["segment"]] = "NORMAL"
-    df_final.loc[((df_final.localisation.str.lower()=="abidjan") & (df_final.ca_total<10000000)) | ((df_final.localisation.str.lower()=="intérieur") & (df_final.ca_total<4000000)),["segment"]] = "A DEVELOPPER"
+    return df_final.loc[:, JOIN_COLUMNS]
 
 
-    df_final = df_final.loc[:, ['mois',
-                                'code_oci',
-                                'site',
-                                'autre_code',
-                                'longitude',
-                                'latitude',
-                                'type_du_site',
-                                'statut',
-                                'localisation',
-                                'commune',
-                                'departement',
-                                'region',
-                                'partenaires',
-                                'proprietaire',
-                                'gestionnaire',
-                                'type_geolocalite',
-                                'projet',
-                                'clutter',
-                                'position_site',
-                                'ca_voix',
-                                'ca_data',
-                                'parc_global',
-                                'parc_data',
-                                "parc_2g",
-                                "parc_3g",
-                                "parc_4g",
-                                "parc_5g",
-                                "autre_parc",
-                                'o_m',
-                                'energie',
-                                'infra',
-                                'maintenance_passive_preventive',
-                                'garde_de_securite',
-                                'discount',
-                                'volume_discount',
-                                'tva',
-                                'opex_itn',
-                                'delay_2g',
-                                'delay_3g',
-                                'delay_4g', 'delaycellule_2g', 'delaycellule_3g',"delaycellule_4g",
-                                'nbrecellule_2g',
-                                'nbrecellule_3g',
-                                'nbrecellule_4g',
-                                'trafic_voix_2g',
-                                'trafic_voix_3g',
-                                'trafic_voix_4g',
-                                'trafic_data_2g',
-                                'trafic_data_3g',
-                                'trafic_data_4g',
-                                "trafic_data_v2_2g", "trafic_data_v2_3g", "trafic_data_v2_4g", "trafic_voix_v2_2g", "trafic_voix_v2_3g", "trafic_voix_v2_4g",
-                                'cellules_2g_congestionnees',
-                                'cellules_2g',
-                                'cellules_3g_congestionnees',
-                                'cellules_3g',
-                                'cellules_4g_congestionnees',
-                                'cellules_4g',
-                                "cellules_v2_2g", "cellules_congestionne_v2_2g","cellules_v2_3g", "cellules_congestionne_v2_3g", "cellules_v2_4g", "cellules_congestionne_v2_4g",
-                                'avg_cssr_cs_2g',
-                                'avg_cssr_cs_3g',
-                                'trafic_voix_total',
-                                'trafic_data_total',
-                                'ca_total',
-                                'segment']]
-    
-    
-    
-    # pareto
-    oneforall = pareto(df_final)
+def get_thresholds() -> dict:
+    """
+       get financial thresholds (ratios) from api
+    """
+    return {code: float(get_thresold(code)) / 100
+            for code in ["intercos", "impot_taxe", "frais_distribution", "seuil_rentabilite"]}
 
-    oneforall["cellules_congestionnees_total"] = oneforall['cellules_2g_congestionnees'] +  oneforall['cellules_3g_congestionnees'] + oneforall['cellules_4g_congestionnees']
-    oneforall["cellules_congestionnees_total_v2"] = oneforall['cellules_congestionne_v2_2g'] +  oneforall['cellules_congestionne_v2_3g'] + oneforall['cellules_congestionne_v2_4g'] ###
 
-    oneforall["cellules_total"] = oneforall['cellules_2g'] + oneforall['cellules_3g'] + oneforall['cellules_4g']
-    oneforall["cellules_total_v2"] = oneforall['cellules_v2_2g'] + oneforall['cellules_v2_3g'] + oneforall['cellules_v2_4g'] ###
+def run_thresholds(client, name: str) -> dict:
+    """
+       thresholds of a checkpointed run, saved with the checkpoints of name.
+       The saved thresholds are used when the api is unavailable, a resume does not depend on it.
+    """
+    path = f"{name}/thresholds.pkl"
+    try:
+        thresholds = get_thresholds()
+    except (requests.RequestException, ValueError) as error:
+        if not checkpoint_exists(client, path):
+            raise
+        logging.warning("thresholds api unavailable (%s), use the thresholds saved in %s", error, path)
+        return load_checkpoint(client, path)
+    save_checkpoint(client, path, thresholds)
+    return thresholds
 
-    oneforall["taux_congestion_2g"] = oneforall['cellules_2g_congestionnees'] / oneforall['cellules_2g']
-    oneforall["taux_congestion_3g"] = oneforall['cellules_3g_congestionnees'] / oneforall['cellules_3g']
-    oneforall["taux_congestion_4g"] = oneforall['cellules_4g_congestionnees'] / oneforall['cellules_4g']
-    oneforall["taux_congestion_total"] =  oneforall["taux_congestion_2g"] + oneforall["taux_congestion_3g"] + oneforall["taux_congestion_4g"]
 
+def month_totals(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+       global aggregates per mois: sums of TOTAL_COLUMNS and count of missing
+       traffic (the cssr denominators are NaN as soon as one site has no traffic)
+    """
+    by_month = dataframe.groupby("mois")
+    totals = by_month[TOTAL_COLUMNS].sum()
+    for trafic in TRAFIC_TOTAL_COLUMNS:
+        totals[f"nan_{trafic}"] = dataframe[trafic].isna().groupby(dataframe["mois"]).sum()
+    return totals
 
-    oneforall["taux_congestion_2g_v2"] = oneforall['cellules_congestionne_v2_2g'] / oneforall['cellules_v2_2g']
-    oneforall["taux_congestion_3g_v2"] = oneforall['cellules_congestionne_v2_3g'] / oneforall['cellules_v2_3g']
-    oneforall["taux_congestion_4g_v2"] = oneforall['cellules_congestionne_v2_4g'] / oneforall['cellules_v2_4g']
-    oneforall["taux_congestion_total_v2"] =  oneforall["taux_congestion_2g_v2"] + oneforall["taux_congestion_3g_v2"] + oneforall["taux_congestion_4g_v2"]
 
+def add_pareto(oneforall: pd.DataFrame) -> pd.DataFrame:
+    """
+       add pareto per mois, rows are sorted by ca_total
+    """
+    total = oneforall.groupby("mois")["ca_total"].transform("sum")
+    oneforall = oneforall.assign(total_ca_mois=total).sort_values(by="ca_total", ascending = False)
+    sommecum = oneforall.groupby("mois")["ca_total"].cumsum()
+    oneforall["pareto"] = np.nan
+    oneforall.loc[sommecum<oneforall.total_ca_mois*0.8 ,"pareto"] = 1
+    oneforall.loc[sommecum>oneforall.total_ca_mois*0.8 ,"pareto"] = 0
+    oneforall["pareto"] = oneforall["pareto"].astype(bool)
+    return oneforall.drop(columns = ["total_ca_mois"])
 
-    oneforall["recommandation"] = "Surveillance technique"
-    oneforall.loc[(oneforall["taux_congestion_total"]<=0.5), "recommandation"] =  "Surveillance commerciale"
 
-    oneforall["recommandation_v2"] = "Surveillance technique"
-    oneforall.loc[(oneforall["taux_congestion_total_v2"]<=0.5), "recommandation_v2"] =  "Surveillance commerciale"
-    
-    oneforall["arpu"] = oneforall["ca_total"] / oneforall["parc_global"]
-    oneforall["segmentation_rentabilite"] = 'Unknown'
-    oneforall.loc[((oneforall["arpu"]<3000) & (oneforall["taux_congestion_4g"] < 0.15)),"segmentation_rentabilite"] = 'Seg 1'
-    oneforall.loc[((oneforall["arpu"]>=3000) & (oneforall["taux_congestion_4g"] < 0.15)),"segmentation_rentabilite"] = 'Seg 2'
-    oneforall.loc[((oneforall["arpu"]>=3000) & (oneforall["taux_congestion_4g"] >=0.15)),"segmentation_rentabilite"] = 'Seg 3'
-    oneforall.loc[((oneforall["arpu"]<3000 )& (oneforall["taux_congestion_4g"] >= 0.15)),"segmentation_rentabilite"] = 'Seg 4'
-
-    oneforall["segmentation_rentabilite_v2"] = 'Unknown'
-    oneforall.loc[((oneforall["arpu"]<3000) & (oneforall["taux_congestion_4g_v2"] < 0.15)),"segmentation_rentabilite_v2"] = 'Seg 1'
-    oneforall.loc[((oneforall["arpu"]>=3000) & (oneforall["taux_congestion_4g_v2"] < 0.15)),"segmentation_rentabilite_v2"] = 'Seg 2'
-    oneforall.loc[((oneforall["arpu"]>=3000) & (oneforall["taux_congestion_4g_v2"] >=0.15)),"segmentation_rentabilite_v2"] = 'Seg 3'
-    oneforall.loc[((oneforall["arpu"]<3000 )& (oneforall["taux_congestion_4g_v2"] >= 0.15)),"segmentation_rentabilite_v2"] = 'Seg 4'
-
-
-    oneforall["cssr_pondere_trafic_2g"] = ((oneforall['avg_cssr_cs_2g'] * oneforall['trafic_voix_2g']) / sum(oneforall["trafic_voix_2g"])) / 100
-    oneforall["cssr_pondere_trafic_3g"] = ((oneforall['avg_cssr_cs_3g'] * oneforall['trafic_voix_3g']) / sum(oneforall["trafic_voix_3g"])) / 100
-
-    oneforall["cssr_pondere_trafic_2g_v2"] = ((oneforall['avg_cssr_cs_2g'] * oneforall['trafic_voix_v2_2g']) / sum(oneforall["trafic_voix_v2_2g"])) / 100
-    oneforall["cssr_pondere_trafic_3g_v2"] = ((oneforall['avg_cssr_cs_3g'] * oneforall['trafic_voix_v2_3g']) / sum(oneforall["trafic_voix_v2_3g"])) / 100
-
-    # get thresold
-    interco = float(get_thresold("intercos")) /100 #CA-voix 
-    impot = float(get_thresold("impot_taxe"))/100 #CA
-    frais_dist = float( get_thresold("frais_distribution"))/100 #CA
-    seuil_renta = float(get_thresold("seuil_rentabilite"))/100
-
-
-    oneforall["interco"] = oneforall["ca_voix"]*interco
-    oneforall["impot"] = oneforall["ca_total"]*impot
-    oneforall["frais_dist"] = oneforall["ca_total"]*frais_dist
-    oneforall["opex"] = oneforall['opex_itn'] + oneforall["interco"] + oneforall["impot"] + oneforall["frais_dist"]
-    oneforall["autre_opex"] = oneforall["opex"] - oneforall["opex_itn"]
-    oneforall["ebitda"] = oneforall["ca_total"] - oneforall["opex"]
-    oneforall["marge_ca"] = oneforall["ebitda"]/oneforall["ca_total"]
-    oneforall["rentable"] = (oneforall["marge_ca"])>seuil_renta
-   
-    oneforall["niveau_rentabilite"] = "NEGATIF"
-    oneforall.loc[(oneforall["marge_ca"])>0, "niveau_rentabilite"] = "NON RENTABLE"
-    oneforall.loc[(oneforall["marge_ca"])>=seuil_renta, "niveau_rentabilite"] = "RENTABLE"
+def _month_totals(oneforall: pd.DataFrame, totals: pd.DataFrame, columns: list) -> np.ndarray:
+    """
+       (n, k) month totals of columns for each row
+    """
+    return np.column_stack([oneforall["mois"].map(totals[column]).to_numpy(dtype=np.float64, na_value=np.nan)
+                            for column in columns])
 
-    logging.info("add NUR") 
-    
 
-    oneforall["days"] = oneforall["mois"].apply(get_number_days)
+def add_cssr_pondere(oneforall: pd.DataFrame, totals: pd.DataFrame) -> pd.DataFrame:
+    """
+       add cssr weighted by the month traffic
+    """
+    strict_totals = pd.DataFrame({trafic: totals[trafic].where(totals[f"nan_{trafic}"] == 0)
+                                  for trafic in TRAFIC_TOTAL_COLUMNS})
+    avg_cssr = kpis.block(oneforall, ["avg_cssr_cs_2g", "avg_cssr_cs_3g"])
+    for suffix, trafic_columns in [("", ["trafic_voix_2g", "trafic_voix_3g"]),
+                                   ("_v2", ["trafic_voix_v2_2g", "trafic_voix_v2_3g"])]:
+        values = kpis.cssr_pondere(avg_cssr, kpis.block(oneforall, trafic_columns),
+                                   _month_totals(oneforall, strict_totals, trafic_columns))
+        oneforall[[f"cssr_pondere_trafic_2g{suffix}", f"cssr_pondere_trafic_3g{suffix}"]] = values
+    return oneforall
 
-    oneforall["nur_2g"] = (100000 * oneforall['nbrecellule_2g'] * oneforall['delaycellule_2g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_2g") )
-    oneforall["nur_3g"] = (100000 * oneforall['nbrecellule_3g'] * oneforall['delaycellule_3g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_3g") )
-    oneforall["nur_4g"] = (100000 * oneforall['nbrecellule_4g'] * oneforall['delaycellule_4g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_4g") )
 
+def enrich_kpis(df_final: pd.DataFrame, totals: pd.DataFrame = None) -> pd.DataFrame:
+    """
+       add pareto, congestion, arpu and cssr kpis.
+       Global aggregates (pareto, cssr denominators) are taken per mois
+       so several months can be stacked in the same dataframe.
+    """
+    totals = month_totals(df_final) if totals is None else totals
+    oneforall = add_pareto(df_final)
 
-    oneforall["nur_2g_v2"] = (100000 * oneforall['nbrecellule_2g'] * oneforall['delaycellule_2g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_v2_2g") )
-    oneforall["nur_3g_v2"] = (100000 * oneforall['nbrecellule_3g'] * oneforall['delaycellule_3g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_v2_3g") )
-    oneforall["nur_4g_v2"] = (100000 * oneforall['nbrecellule_4g'] * oneforall['delaycellule_4g'] )/ (3600*24*oneforall["days"]  * get_number_cellule(oneforall, "cellules_v2_4g") )
-    
-    oneforall["nur_total"] =  oneforall["nur_2g"] +  oneforall["nur_3g"] +  oneforall["nur_4g"]
+    for suffix, congested_columns, cells_columns in [
+            ("", [f"cellules_{techno}_congestionnees" for techno in kpis.TECHNOS],
+             [f"cellules_{techno}" for techno in kpis.TECHNOS]),
+            ("_v2", [f"cellules_congestionne_v2_{techno}" for techno in kpis.TECHNOS],
+             [f"cellules_v2_{techno}" for techno in kpis.TECHNOS])]:
+        congested = kpis.block(oneforall, congested_columns)
+        cells = kpis.block(oneforall, cells_columns)
+        taux = kpis.taux_congestion(congested, cells)
+        oneforall[f"cellules_congestionnees_total{suffix}"] = kpis.row_total(congested)
+        oneforall[f"cellules_total{suffix}"] = kpis.row_total(cells)
+        oneforall[[f"taux_congestion_{techno}{suffix}" for techno in kpis.TECHNOS]] = taux
+        oneforall[f"taux_congestion_total{suffix}"] = kpis.row_total(taux)
 
-    oneforall["nur_total_v2"] =  oneforall["nur_2g_v2"] +  oneforall["nur_3g_v2"] +  oneforall["nur_4g_v2"]
+    oneforall["arpu"] = kpis.arpu(kpis.block(oneforall, ["ca_total"])[:, 0], kpis.block(oneforall, ["parc_global"])[:, 0])
 
-    oneforall["previous_segment"] = None
-    oneforall.reset_index(drop=True,inplace=True)
-    if datetime.strptime(date, CONFIG["date_format"]) > datetime.strptime(start_date, CONFIG["date_format"]):
-        last = datetime.strptime(date, CONFIG["date_format"]) - timedelta(weeks=4)
-        last_filename = get_latest_file(client, "oneforall", prefix = f"{last.year}/{str(last.month).zfill(2)}")
-        logging.info(f"read {last_filename}")
-        lastoneforall = pd.read_csv(f"s3://oneforall/{last_filename}",
-                                storage_options={
-                                "key": accesskey,
-                                "secret": secretkey,
-                "client_kwargs": {"endpoint_url": f"http://{endpoint}"}
-                }
-                    )
-        
-        for idx, row in oneforall.iterrows():
-            previos_segment = lastoneforall.loc[lastoneforall.code_oci==row["code_oci"], "segment"].values
-            print(previos_segment)
-            oneforall.loc[idx, "previous_segment"] = previos_segment if len(previos_segment)>0 else None
-            print(oneforall.loc[idx, ["code_oci","previous_segment"]])
+    return add_cssr_pondere(oneforall, totals)
+
+
+def add_financials(oneforall: pd.DataFrame, thresholds: dict) -> pd.DataFrame:
+    """
+       add financials (interco, impot, ebitda, ...) and classifications
+    """
+    seuil_renta = thresholds["seuil_rentabilite"]
+    values = kpis.block(oneforall, ["ca_voix", "ca_total", "opex_itn"])
+    for column, value in kpis.financials(values[:, 0], values[:, 1], values[:, 2],
+                                         interco=thresholds["intercos"], #CA-voix
+                                         impot=thresholds["impot_taxe"], #CA
+                                         frais_dist=thresholds["frais_distribution"]).items(): #CA
+        oneforall[column] = value
+    oneforall["rentable"] = (oneforall["marge_ca"])>seuil_renta
+
+    # segment, recommandation, segmentation_rentabilite, niveau_rentabilite
+    oneforall = evaluate_rules(oneforall, params={"seuil_rentabilite": seuil_renta})
+
+    return oneforall
+
+
+def add_nur(oneforall: pd.DataFrame, totals: pd.DataFrame = None) -> pd.DataFrame:
+    """
+       add NUR, cellules totals are taken per mois
+    """
+    logging.info("add NUR")
+    totals = month_totals(oneforall) if totals is None else totals
+    days = kpis.days_in_month(oneforall["mois"])
+    oneforall["days"] = days.astype(np.int64)
+    nbrecellule = kpis.block(oneforall, [f"nbrecellule_{techno}" for techno in kpis.TECHNOS])
+    delaycellule = kpis.block(oneforall, [f"delaycellule_{techno}" for techno in kpis.TECHNOS])
+    for suffix, cells_columns in [("", [f"cellules_{techno}" for techno in kpis.TECHNOS]),
+                                  ("_v2", [f"cellules_v2_{techno}" for techno in kpis.TECHNOS])]:
+        values = kpis.nur(nbrecellule, delaycellule, days, _month_totals(oneforall, totals, cells_columns))
+        oneforall[[f"nur_{techno}{suffix}" for techno in kpis.TECHNOS]] = values
+        oneforall[f"nur_total{suffix}"] = kpis.row_total(values)
+    if "previous_segment" not in oneforall.columns:
+        oneforall["previous_segment"] = None
+    return oneforall.loc[:, ONEFORALL_COLUMNS]
+
+
+def compute_kpis(df_final: pd.DataFrame, thresholds: dict) -> pd.DataFrame:
+    """
+       compute kpis, financials, NUR and classifications
+    """
+    return add_nur(add_financials(enrich_kpis(df_final), thresholds))
+
+
+def add_previous_segment(oneforall: pd.DataFrame, lastoneforall: pd.DataFrame) -> pd.DataFrame:
+    """
+       set previous_segment from the previous month oneforall
+    """
+    last_segments = lastoneforall.drop_duplicates(subset=["code_oci"], keep="first").set_index("code_oci")["segment"]
+    oneforall["previous_segment"] = oneforall["code_oci"].map(last_segments)
     return oneforall
 
 
+def previous_ofa_object(client, date: str, start_date: str):
+    """
+       filename of the previous month oneforall, None for the first month
+    """
+    if datetime.strptime(date, CONFIG["date_format"]) <= datetime.strptime(start_date, CONFIG["date_format"]):
+        return None
+    last = datetime.strptime(date, CONFIG["date_format"]) - timedelta(weeks=4)
+    return get_latest_file(client, "oneforall", prefix=f"{last.year}/{str(last.month).zfill(2)}")
+
+
+def get_previous_ofa(client, endpoint: str, accesskey: str, secretkey: str, date: str, start_date: str):
+    """
+       read previous month oneforall, None for the first month
+    """
+    if datetime.strptime(date, CONFIG["date_format"]) <= datetime.strptime(start_date, CONFIG["date_format"]):
+        return None
+    return read_cleaned(client, endpoint, accesskey, secretkey, "oneforall",
+                        previous_ofa_object(client, date, start_date))
+
+
+def oneforall_stages(client, endpoint: str, accesskey: str, secretkey: str, date: str, start_date: str,
+                     inputs: dict = None, engine: str = "pandas", thresholds: dict = None) -> list:
+    """
+       named stages of the oneforall build: (name, params, func).
+       params() returns what the stage output depends on besides the previous stage,
+       func(previous_output, params) computes the stage output.
+       With inputs (cleaned dataframes in memory) the load stage does not read minio.
+       With an engine other than pandas the inputs are read and joined by that engine.
+       thresholds: financial thresholds of the run, read from the api when the financials params are needed
+    """
+    if inputs is not None and engine != "pandas":
+        raise ValueError(f"in-memory inputs are joined with pandas, not {engine}")
+
+    def load_params():
+        if inputs is not None:
+            return inputs_digest(inputs)
+        params = {key: [bucket, filename, client.stat_object(bucket, filename).etag]
+                  for key, (bucket, filename) in input_objects(client, date).items()}
+        if engine != "pandas":
+            params["engine"] = engine
+        return params
+
+    def load(_, params):
+        if inputs is not None:
+            return inputs
+        objects = {key: tuple(value[:2]) for key, value in params.items() if key in INPUT_SOURCES}
+        if engine != "pandas":
+            return objects
+        return read_inputs(endpoint, accesskey, secretkey, objects)
+
+    def join(data, _):
+        if engine != "pandas":
+            return join_objects(endpoint, accesskey, secretkey, data, engine)
+        return join_inputs(data)
+
+    def history_params():
+        filename = previous_ofa_object(client, date, start_date)
+        if filename is None:
+            return None
+        return [filename, client.stat_object("oneforall", filename).etag]
+
+    def history(data, params):
+        data = data.reset_index(drop=True)
+        if params is not None:
+            data = add_previous_segment(data, read_cleaned(client, endpoint, accesskey, secretkey,
+                                                           "oneforall", params[0]))
+        return data
+
+    return [
+        ("load", load_params, load),
+        ("join", lambda: None, join),
+        ("kpis", lambda: None, lambda data, _: enrich_kpis(data)),
+        ("financials", lambda: {"thresholds": get_thresholds() if thresholds is None else thresholds,
+                                "rules": CONFIG["rules"]},
+         lambda data, params: add_financials(data, params["thresholds"])),
+        ("nur", lambda: None, lambda data, _: add_nur(data)),
+        ("history", history_params, history),
+    ]
+
+
+@instrument
+def oneforall(client, endpoint:str, accesskey:str, secretkey:str,  date: str, start_date, checkpoint: bool = False,
+              inputs: dict = None, engine: str = "pandas", thresholds: dict = None):
+    """
+       merge all data and generate oneforall.
+       With checkpoint, every stage output is saved and a rerun resumes
+       from the first stage whose inputs or parameters changed (the thresholds are saved
+       with the checkpoints, see run_thresholds).
+       inputs: cleaned dataframes of the month (keys of INPUT_SOURCES), read from minio if not given
+       engine: "pandas" or the backend joining the inputs read from minio (see cleaning.backend)
+       thresholds: financial thresholds, read from the api if not given
+    """
+    name = f"oneforall/{date.replace('-', '/')}"
+    if checkpoint and thresholds is None:
+        thresholds = run_thresholds(client, name)
+    stages = oneforall_stages(client, endpoint, accesskey, secretkey, date, start_date, inputs, engine, thresholds)
+    if checkpoint:
+        return run_stages(client, name, stages)
+    data = None
+    for _, params, func in stages:
+        data = func(data, params())
+    return data
+
+
+def _row_hashes(dataframe: pd.DataFrame) -> set:
+    """
+       (code_oci, hash of the row) pairs
+    """
+    hashes = pd.util.hash_pandas_object(dataframe.loc[:, JOIN_COLUMNS], index=False)
+    return set(zip(dataframe["code_oci"], hashes))
+
+
+def changed_sites(previous: pd.DataFrame, joined: pd.DataFrame) -> set:
+    """
+       code_oci whose joined inputs differ (added, removed or modified sites)
+    """
+    return {code for code, _ in _row_hashes(previous) ^ _row_hashes(joined)}
+
+
+def _by_row(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+       rows indexed by (mois, code_oci, occurrence), the duplicated code_oci of a month are kept
+    """
+    occurrence = dataframe.groupby(["mois", "code_oci"], dropna=False).cumcount().rename("occurrence")
+    return dataframe.set_index([dataframe["mois"].rename("_mois"), dataframe["code_oci"].rename("_code_oci"),
+                                occurrence])
+
+
+def _differs(previous: pd.DataFrame, data: pd.DataFrame) -> set:
+    """
+       code_oci whose oneforall rows differ between previous and data (compared per (mois, code_oci) row,
+       a site with a different number of rows differs)
+    """
+    previous, data = _by_row(previous), _by_row(data)
+    common = data.index.intersection(previous.index)
+    differs = pd.Series(True, index=data.index.symmetric_difference(previous.index))
+    previous, data = previous.loc[common], data.loc[common]
+    same_rows = pd.Series(True, index=common)
+    for column in [column for column in ONEFORALL_COLUMNS if column != "code_oci"]:
+        old, new = previous[column], data[column]
+        if pd.api.types.is_float_dtype(old) and pd.api.types.is_float_dtype(new):
+            same = np.isclose(old.to_numpy(), new.to_numpy(), rtol=1e-9, equal_nan=True)
+        else:
+            same = ((old == new) | (old.isna() & new.isna())).to_numpy()
+        same_rows &= same
+    differs = pd.concat([differs, ~same_rows])
+    return set(differs.index[differs.to_numpy()].get_level_values("_code_oci"))
+
+
+def update_oneforall(previous: pd.DataFrame, totals: pd.DataFrame, joined: pd.DataFrame,
+                     thresholds: dict, lastoneforall: pd.DataFrame = None):
+    """
+       recompute only the sites whose inputs changed.
+       Global aggregates are updated from the maintained totals, then pareto,
+       cssr and NUR are refreshed for every row.
+       Return:
+        (oneforall, totals, emitted) where emitted is the set of code_oci to rewrite
+    """
+    changed = changed_sites(previous, joined)
+    logging.info("%s sites changed", len(changed))
+    if not changed:
+        return previous, totals, set()
+    old_rows = previous.loc[previous["code_oci"].isin(changed)]
+    new_rows = joined.loc[joined["code_oci"].isin(changed)].copy()
+    totals = totals.sub(month_totals(old_rows), fill_value=0).add(month_totals(new_rows), fill_value=0)
+    recomputed = add_nur(add_financials(enrich_kpis(new_rows, totals), thresholds), totals)
+    if lastoneforall is not None:
+        recomputed = add_previous_segment(recomputed, lastoneforall)
+    data = pd.concat([previous.loc[~previous["code_oci"].isin(changed)], recomputed], ignore_index=True)
+    data = add_nur(add_cssr_pondere(add_pareto(data), totals), totals)
+    data.reset_index(drop=True, inplace=True)
+    emitted = changed | _differs(previous, data)
+    return data, totals, emitted
+
+
+@instrument
+def oneforall_incremental(client, endpoint: str, accesskey: str, secretkey: str, date: str, start_date: str,
+                          checkpoint: bool = False, inputs: dict = None, engine: str = "pandas"):
+    """
+       generate oneforall, incrementally when the month was already computed.
+       The month state (oneforall, maintained totals, parameters and the code_oci
+       emitted by the last run) is saved with the checkpoints.
+       inputs: cleaned dataframes of the month, read from minio if not given
+       engine: "pandas" or the backend joining the inputs read from minio
+       Return:
+        (oneforall, emitted) where emitted is None after a full build
+    """
+    path = f"oneforall/{date.replace('-', '/')}/state.pkl"
+    thresholds = run_thresholds(client, f"oneforall/{date.replace('-', '/')}") if checkpoint else get_thresholds()
+    params = {"thresholds": thresholds, "rules": CONFIG["rules"]}
+    state = load_checkpoint(client, path) if checkpoint_exists(client, path) else None
+    if state is None or state["params"] != params:
+        data = oneforall(client, endpoint, accesskey, secretkey, date, start_date, checkpoint=checkpoint,
+                         inputs=inputs, engine=engine, thresholds=thresholds)
+        totals, emitted = month_totals(data), None
+    else:
+        if inputs is None and engine != "pandas":
+            joined = join_objects(endpoint, accesskey, secretkey, input_objects(client, date), engine)
+        else:
+            if inputs is None:
+                inputs = load_inputs(client, endpoint, accesskey, secretkey, date)
+            joined = join_inputs(inputs)
+        lastoneforall = get_previous_ofa(client, endpoint, accesskey, secretkey, date, start_date)
+        data, totals, emitted = update_oneforall(state["oneforall"], state["totals"], joined,
+                                                 params["thresholds"], lastoneforall)
+        emitted = sorted(emitted)
+    save_checkpoint(client, path, {"oneforall": data, "totals": totals, "params": params, "emitted": emitted})
+    return data, emitted
+
+
+def get_emitted(client, date: str):
+    """
+       code_oci emitted by the last oneforall_incremental run, None for a full build
+    """
+    path = f"oneforall/{date.replace('-', '/')}/state.pkl"
+    if not checkpoint_exists(client, path):
+        return None
+    return load_checkpoint(client, path)["emitted"]
+
+
+def reset_incremental(client, date: str) -> None:
+    """
+       forget the month state of oneforall_incremental after a full build,
+       the next incremental run of the month starts with a full build
+    """
+    remove_checkpoint(client, f"oneforall/{date.replace('-', '/')}/state.pkl")
+
+
+def month_dates(start: str, end: str) -> list:
+    """
+       execution dates (same day as start) of every month between start and end
+    """
+    start_date = datetime.strptime(start, CONFIG["date_format"])
+    months = pd.period_range(start[:7], end[:7], freq="M")
+    return [f"{month.year}-{str(month.month).zfill(2)}-{str(start_date.day).zfill(2)}" for month in months]
+
+
+def oneforall_batch(client, endpoint: str, accesskey: str, secretkey: str, dates: list, start_date: str) -> dict:
+    """
+       compute oneforall for several consecutive months in one process.
+       Inputs are loaded once per month, kpis are computed on the stacked months
+       and previous_segment comes from the in-memory previous month.
+       Return:
+        dict date -> oneforall dataframe
+    """
+    dates = sorted(dates)
+    logging.info("compute oneforall for %s months", len(dates))
+    stacked = pd.concat([join_inputs(load_inputs(client, endpoint, accesskey, secretkey, date)) for date in dates],
+                        ignore_index=True)
+    stacked = compute_kpis(stacked, get_thresholds())
+    results = {}
+    lastoneforall = get_previous_ofa(client, endpoint, accesskey, secretkey, dates[0], start_date)
+    for date in dates:
+        oneforall = stacked.loc[stacked["mois"] == date[:7]].reset_index(drop=True)
+        if lastoneforall is not None:
+            oneforall = add_previous_segment(oneforall, lastoneforall)
+        results[date] = oneforall
+        lastoneforall = oneforall
+    return results
+
+
 def get_last_ofa(client, endpoint: str, accesskey: str, secretkey: str, date: str):
     """ """
     # get files
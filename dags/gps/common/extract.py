@@ -7,6 +7,8 @@ from unidecode import unidecode
 import pandas as pd
 import psycopg2
 from gps import CONFIG
+from gps.common.datasets import dataset
+from gps.common.metrics import count, instrument
 
 # Define SQL queries for different tables
 
@@ -51,7 +53,7 @@ SQL_QUERIES = {
 
 
 @lru_cache(maxsize=None)
-def get_connection(host: str, database: str, user: str, password: str):
+def get_connection(host: str, database: str, user: str, password: str, port: str = "5432"):
     """
     Function to get a connection to the PostgreSQL server
     Args:
@@ -59,10 +61,11 @@ def get_connection(host: str, database: str, user: str, password: str):
         database [str]: database name
         user [str]: user name
         password [str]: password
+        port [str]: port
     Return:
         psycopg2 connection object
     """
-    return psycopg2.connect(host=host, database=database, user=user, password=password)
+    return psycopg2.connect(host=host, database=database, user=user, password=password, port=port)
 
 
 def execute_query(args):
@@ -79,18 +82,20 @@ def execute_query(args):
     return df_
 
 
+@instrument
 def extract_pg(host: str, database: str, user: str, password: str, table: str = None,
-               date: str = None, sql_query: str = None) -> pd.DataFrame:
+               date: str = None, sql_query: str = None, port: str = "5432") -> pd.DataFrame:
     """
     Function to get data from table and save in parquet file
     Args:
         table [str]: table name
         date [str]
+        port [str]: port of the server
     Return:
         pandas DataFrame
     """
     # get connection
-    conn = get_connection(host, database, user, password)
+    conn = get_connection(host, database, user, password, port)
     # Log the table and date information
     logging.info("Getting data of the table %s ", table)
     logging.info("where date is %s", date)
@@ -118,6 +123,7 @@ def list_ftp_file(hostname: str, user: str, password: str)-> list:
     file_list = server.nlst()
     return  file_list
 
+@instrument
 def extract_ftp(hostname: str, user: str, password: str, date: str) -> pd.DataFrame:
     """
     Connect to ftp server and get file
@@ -145,6 +151,7 @@ def extract_ftp(hostname: str, user: str, password: str, date: str) -> pd.DataFr
     downloaded = BytesIO()
     try:
         server.retrbinary(f'RETR {filename}', downloaded.write)
+        count(bytes_in=downloaded.getbuffer().nbytes)
         logging.info("Read data")
         #Read the downloaded file into a DataFrame
         downloaded.seek(0)
@@ -159,9 +166,7 @@ def extract_ftp(hostname: str, user: str, password: str, date: str) -> pd.DataFr
         raise RuntimeError(f"{filename} is empty")
     # Verify if the required columns are present
     df_.columns = df_.columns.str.lower().map(unidecode)
-    good_columns = [d["columns"]
-                    for d in CONFIG["tables"] if d["name"] == "caparc"][0]
-    missing_columns = set(good_columns).difference(set(df_.columns))
+    missing_columns = set(dataset("caparc").columns).difference(set(df_.columns))
     if missing_columns:
         raise ValueError(f"missing columns {', '.join(missing_columns)}")
     # Add "month_id" columns
@@ -0,0 +1,90 @@
+""" FUSED MONTHLY RUN
+
+Cleaning, oneforall and postgres load of one month in one process.
+Cleaned dataframes and oneforall are passed in memory, the csv files of minio
+are still written (in background threads) for audit and for the next month.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from gps import CONFIG
+from gps.common.cleaning import (
+    clean_base_sites,
+    cleaning_esco,
+    cleaning_ihs,
+    cleaning_traffic,
+    cleaning_cssr,
+    cleaning_congestion,
+    cleaning_ca_parc,
+    cleaning_trafic_v2
+)
+from gps.common.enrich import oneforall_incremental, input_object, read_inputs
+from gps.common.rwminio import save_minio, like_csv
+from gps.common.rwpg import write_pg
+
+# oneforall input key -> cleaning function (ihs is cleaned after esco)
+CLEANERS = {
+    "bdd": clean_base_sites,
+    "caparc": cleaning_ca_parc,
+    "esco": cleaning_esco,
+    "trafic": cleaning_traffic,
+    "trafic2": cleaning_trafic_v2,
+    "cssr": cleaning_cssr,
+    "cong": cleaning_congestion,
+}
+
+
+def clean_month(client, endpoint: str, accesskey: str, secretkey: str, date: str, save=save_minio) -> dict:
+    """
+    Run the cleaning functions of a month
+    Return:
+        dict input key -> cleaned dataframe, typed as if read from minio
+    """
+    inputs = {}
+    for key, cleaner in CLEANERS.items():
+        logging.info("clean %s", key)
+        inputs[key] = like_csv(cleaner(client, endpoint, accesskey, secretkey, date, save=save))
+    ihs = cleaning_ihs(client, endpoint, accesskey, secretkey, date, esco=inputs["esco"], save=save)
+    if ihs is None:
+        # opex ihs of the quarter, cleaned on its first month
+        inputs["ihs"] = read_inputs(endpoint, accesskey, secretkey,
+                                    {"ihs": input_object(client, "ihs", date)})["ihs"]
+    else:
+        inputs["ihs"] = like_csv(ihs)
+    return inputs
+
+
+def monthly_run(client, endpoint: str, accesskey: str, secretkey: str, date: str, start_date: str,
+                pg: dict, checkpoint: bool = True) -> dict:
+    """
+    Clean, generate oneforall and write it in postgres for a month, in memory.
+    Args:
+        client: Minio client
+        endpoint, accesskey, secretkey: Minio settings
+        date: execution date
+        start_date: first month of oneforall history
+        pg: write_pg connection kwargs (host, database, user, password, port)
+        checkpoint: checkpoint oneforall stages
+    Return:
+        write_pg counts (see upsert_table), None after a full build
+    """
+    with ThreadPoolExecutor(max_workers=CONFIG["fused"]["upload_workers"]) as uploads:
+        pending = []
+
+        def save(*args):
+            pending.append(uploads.submit(save_minio, *args))
+
+        inputs = clean_month(client, endpoint, accesskey, secretkey, date, save=save)
+        data, emitted = oneforall_incremental(client, endpoint, accesskey, secretkey, date, start_date,
+                                              checkpoint=checkpoint, inputs=inputs)
+        if data.empty:
+            raise RuntimeError(f"No data for {date}")
+        save(client, "oneforall", None, date, data)
+        # after an incremental run only the changed sites are upserted, the removed ones deleted
+        rows = data if emitted is None else data.loc[data["code_oci"].isin(emitted)]
+        counts = write_pg(**pg, data=rows, table="oneforall", codes=emitted,
+                          mode="replace" if emitted is None else "upsert", months=[date[:7]])
+        # the next month reads this oneforall from minio, wait for every side output
+        for future in pending:
+            future.result()
+    logging.info("fused run of %s done, %s files saved", date, len(pending))
+    return counts
@@ -0,0 +1,121 @@
+""" NETWORK AND FINANCIAL KPIS
+
+Vectorized kernels over float64 arrays. Per techno kpis take (n, k) blocks
+(one column per techno) and return blocks of the same shape.
+Denominators are passed in per row: enrich takes them from its month totals
+(enrich.month_totals), grain_totals computes them at any other grain
+(site, region, month).
+"""
+import numpy as np
+import pandas as pd
+
+TECHNOS = ["2g", "3g", "4g"]
+SECONDS_PER_DAY = 3600 * 24
+
+
+def block(dataframe: pd.DataFrame, columns: list) -> np.ndarray:
+    """
+    (n, k) float64 array of the given columns
+    """
+    return dataframe.loc[:, columns].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def safe_divide(numerator, denominator, fill: float = np.nan) -> np.ndarray:
+    """
+    element-wise division, fill where the denominator is 0 or missing
+    """
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.full(np.broadcast(numerator, denominator).shape, fill, dtype=np.float64)
+    np.divide(numerator, denominator, out=out, where=(denominator != 0) & ~np.isnan(denominator))
+    return out
+
+
+def divide(numerator, denominator) -> np.ndarray:
+    """
+    element-wise division with the semantics of the pandas operator (+/-inf on x / 0, NaN on 0 / 0),
+    kept for the inputs of the classifications (see gps.common.rules)
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.divide(np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64))
+
+
+def grain_totals(dataframe: pd.DataFrame, columns: list, by: list, strict: bool = False) -> np.ndarray:
+    """
+    (n, k) totals of columns over the grain of each row
+    Args:
+        dataframe: kpi dataframe
+        columns: columns to sum
+        by: grain, e.g. ["mois"] or ["mois", "region"]
+        strict: total is NaN as soon as one value of the group is missing
+    """
+    grouped = dataframe.groupby(by, sort=False, dropna=False)[columns]
+    totals = grouped.transform("sum").to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    if strict:
+        missing = dataframe[columns].isna().groupby([dataframe[col] for col in by], sort=False, dropna=False)
+        totals[missing.transform("any").to_numpy(dtype=bool)] = np.nan
+    return totals
+
+
+def days_in_month(mois: pd.Series) -> np.ndarray:
+    """
+    number of days of each "YYYY-MM" month
+    """
+    return pd.to_datetime(mois, format="%Y-%m").dt.days_in_month.to_numpy(dtype=np.float64)
+
+
+def row_total(values: np.ndarray) -> np.ndarray:
+    """
+    sum over technos, NaN as soon as one techno is missing
+    """
+    return values.sum(axis=1)
+
+
+def taux_congestion(congested: np.ndarray, cells: np.ndarray) -> np.ndarray:
+    """
+    congested cells / cells per techno
+    """
+    return divide(congested, cells)
+
+
+def arpu(ca_total: np.ndarray, parc: np.ndarray) -> np.ndarray:
+    """
+    revenue per user
+    """
+    return divide(ca_total, parc)
+
+
+def cssr_pondere(avg_cssr: np.ndarray, trafic: np.ndarray, trafic_total: np.ndarray) -> np.ndarray:
+    """
+    cssr weighted by the share of voice traffic of the grain, in ratio
+    """
+    return safe_divide(avg_cssr * trafic, trafic_total) / 100
+
+
+def nur(nbrecellule: np.ndarray, delaycellule: np.ndarray, days: np.ndarray, cells_total: np.ndarray) -> np.ndarray:
+    """
+    network unavailability rate per techno
+    Args:
+        nbrecellule, delaycellule: (n, k) blocks
+        days: (n,) days of the month
+        cells_total: (n, k) cells of the grain
+    """
+    unavailability = 100000 * nbrecellule * delaycellule
+    return safe_divide(unavailability, SECONDS_PER_DAY * days[:, None] * cells_total)
+
+
+def financials(ca_voix: np.ndarray, ca_total: np.ndarray, opex_itn: np.ndarray,
+               interco: float, impot: float, frais_dist: float) -> dict:
+    """
+    EBITDA chain, ratios are applied on CA voix (interco) or CA total (impot, frais_dist)
+    """
+    result = {
+        "interco": ca_voix * interco,
+        "impot": ca_total * impot,
+        "frais_dist": ca_total * frais_dist,
+    }
+    result["opex"] = opex_itn + result["interco"] + result["impot"] + result["frais_dist"]
+    result["autre_opex"] = result["opex"] - opex_itn
+    result["ebitda"] = ca_total - result["opex"]
+    result["marge_ca"] = divide(result["ebitda"], ca_total)
+    return result
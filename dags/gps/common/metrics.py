@@ -0,0 +1,178 @@
+""" PERFORMANCE METRICS
+
+Wall time, cpu time, peak memory, rows and bytes of the instrumented functions.
+Every measure is logged as a json line (logger gps.metrics) and, when configured
+in CONFIG["metrics"], sent to a statsd server and summed per function in a
+prometheus textfile of the task (node exporter textfile collector).
+Airflow labels (dag, task, run) come from the AIRFLOW_CTX_* variables of the task process.
+"""
+import inspect
+import json
+import logging
+import os
+import resource
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+import pandas as pd
+from gps import CONFIG
+
+LOGGER = logging.getLogger("gps.metrics")
+COUNTS = ["rows_in", "rows_out", "bytes_in", "bytes_out"]
+# measure the functions of the current context report their counts to
+_CURRENT = ContextVar("gps_metrics", default=None)
+_LOCK = threading.Lock()
+# function -> summed measures of this process, for the prometheus textfile
+_TOTALS = {}
+
+
+def labels() -> dict:
+    """
+    airflow dag, task and run of the process
+    """
+    return {"dag": os.environ.get("AIRFLOW_CTX_DAG_ID", ""),
+            "task": os.environ.get("AIRFLOW_CTX_TASK_ID", ""),
+            "run": os.environ.get("AIRFLOW_CTX_DAG_RUN_ID", "")}
+
+
+def _peak_rss() -> int:
+    """
+    peak resident memory of the process in bytes (ru_maxrss is in kilobytes on linux)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rows(value) -> int:
+    """
+    rows of a dataframe, of the first dataframe of a tuple, None otherwise
+    """
+    if isinstance(value, tuple):
+        value = next((item for item in value if isinstance(item, pd.DataFrame)), None)
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+
+def count(**values) -> None:
+    """
+    add rows_in, rows_out, bytes_in or bytes_out to the current measure (no measure: ignored)
+    """
+    record = _CURRENT.get()
+    if record is None:
+        return
+    with _LOCK:
+        for name, value in values.items():
+            record[name] = (record[name] or 0) + value
+
+
+def _statsd(record: dict) -> None:
+    """
+    send a measure to statsd over udp
+    """
+    host, port = CONFIG["metrics"]["statsd"].split(":")
+    name = f"{CONFIG['metrics']['prefix']}.{record['function']}"
+    lines = [f"{name}.wall:{record['wall_seconds'] * 1000:.3f}|ms",
+             f"{name}.cpu:{record['cpu_seconds'] * 1000:.3f}|ms",
+             f"{name}.peak_rss:{record['peak_rss_bytes']}|g",
+             f"{name}.calls:1|c"]
+    lines += [f"{name}.{key}:{record[key]}|c" for key in COUNTS if record[key] is not None]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto("\n".join(lines).encode(), (host, int(port)))
+
+
+def _textfile(record: dict) -> None:
+    """
+    rewrite the prometheus textfile of the task with the sums per function
+    """
+    with _LOCK:
+        total = _TOTALS.setdefault(record["function"], dict.fromkeys(
+            ["calls", "wall_seconds", "cpu_seconds", "peak_rss_bytes"] + COUNTS, 0))
+        total["calls"] += 1
+        for key in ["wall_seconds", "cpu_seconds"] + COUNTS:
+            total[key] += record[key] or 0
+        total["peak_rss_bytes"] = max(total["peak_rss_bytes"], record["peak_rss_bytes"])
+        totals = {function: dict(values) for function, values in _TOTALS.items()}
+    prefix = CONFIG["metrics"]["prefix"]
+    task = labels()
+    common = ",".join(f'{key}="{value}"' for key, value in task.items())
+    lines = []
+    for key in totals[record["function"]]:
+        kind = "gauge" if key == "peak_rss_bytes" else "counter"
+        metric = f"{prefix}_{key}" if kind == "gauge" else f"{prefix}_{key}_total"
+        lines += [f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{function="{function}",{common}}} {values[key]}' for function, values in totals.items()]
+    name = "_".join(value for value in [prefix, task["dag"], task["task"]] if value)
+    # outside of airflow (backfill workers) one file per process
+    path = os.path.join(CONFIG["metrics"]["textfile_dir"],
+                        f"{name}.prom" if task["task"] else f"{name}.{os.getpid()}.prom")
+    # the collector must never read a half written file
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def emit(record: dict) -> None:
+    """
+    log a measure and send it to the configured sinks, a failing sink only logs a warning
+    """
+    LOGGER.info("metrics %s", json.dumps(record, default=str))
+    settings = CONFIG["metrics"]
+    for enabled, sink in [(settings["statsd"], _statsd), (settings["textfile_dir"], _textfile)]:
+        if enabled:
+            try:
+                sink(record)
+            except OSError as error:
+                LOGGER.warning("metrics sink %s failed: %s", sink.__name__, error)
+
+
+@contextmanager
+def measure(name: str):
+    """
+    measure a block, yields the record the block can add counts to (see count)
+    """
+    record = {"function": name, **labels(), **dict.fromkeys(COUNTS)}
+    token = _CURRENT.set(record)
+    peak = _peak_rss()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+        record["status"] = "ok"
+    except BaseException:
+        record["status"] = "failed"
+        raise
+    finally:
+        record["wall_seconds"] = round(time.perf_counter() - wall, 6)
+        record["cpu_seconds"] = round(time.process_time() - cpu, 6)
+        record["peak_rss_bytes"] = _peak_rss()
+        # how much the block raised the peak memory of the process
+        record["peak_rss_growth_bytes"] = record["peak_rss_bytes"] - peak
+        _CURRENT.reset(token)
+        emit(record)
+
+
+def instrument(func):
+    """
+    decorator measuring each call of a function, rows_in are the rows of its dataframe
+    arguments, rows_out the rows of its returned dataframe
+    the call is profiled when GPS_PROFILE enables it (see gps.common.profiling)
+    """
+    from gps.common import profiling  # pylint: disable=import-outside-toplevel  (profiling imports metrics)
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profiled = nullcontext()
+        if profiling.enabled(func.__name__):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            profiled = profiling.profile(func.__name__, arguments.get("client"), arguments.get("date"))
+        with profiled, measure(func.__name__):
+            rows = [_rows(value) for value in list(args) + list(kwargs.values())]
+            if any(row is not None for row in rows):
+                count(rows_in=sum(row for row in rows if row is not None))
+            result = func(*args, **kwargs)
+            rows = _rows(result)
+            if rows is not None:
+                count(rows_out=rows)
+        return result
+    return wrapper
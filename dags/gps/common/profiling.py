@@ -0,0 +1,191 @@
+""" OPT-IN PROFILING
+
+cProfile, stack sampling and tracemalloc of a gps function, enabled by the GPS_PROFILE
+environment variable (function names separated by commas, or "all") for the instrumented
+functions (see gps.common.metrics.instrument), or by the profile parameter of a task callable
+(see gps.common.settings.with_minio).
+The profiles are saved in the CONFIG["profiling"]["bucket"] bucket under
+<function>/<date>/<time>-<pid>/ (a local directory without minio client):
+    cprofile.prof     pstats dump (python -m pstats, snakeviz)
+    cprofile.txt      functions sorted by cumulative time
+    samples.folded    sampled stacks in the folded format of flamegraph.pl and speedscope
+    tracemalloc.txt   top allocations of the call (net growth per gps line and per line) and the peak
+    profile.json      function, airflow labels, status, wall seconds
+"""
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from gps import CONFIG
+from gps.common.metrics import labels
+
+LOGGER = logging.getLogger("gps.profiling")
+# one profile at a time, the functions called by a profiled function are part of its profile
+_ACTIVE = threading.Lock()
+
+
+def enabled(name: str) -> bool:
+    """
+    whether GPS_PROFILE enables the profiling of a function
+    """
+    value = os.environ.get("GPS_PROFILE", "").strip()
+    if value.lower() in {"", "0", "false", "no"}:
+        return False
+    return value.lower() in {"1", "true", "yes", "all"} or name in {item.strip() for item in value.split(",")}
+
+
+class _Sampler:
+    """
+    Sample the stack of a thread at a fixed interval from a background thread,
+    counts of the stacks (root first, frames separated by ;)
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.counts = Counter()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="gps-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+    def folded(self) -> str:
+        """
+        stacks in the folded format, one "stack count" line per stack
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+
+def _allocations(start, end, peak: int, top: int) -> str:
+    """
+    report of the allocations between two tracemalloc snapshots (net growth): per gps line,
+    the innermost frame of the gps code of each allocation (the pandas call of a gps function),
+    then per line of any module
+    """
+    stats = end.compare_to(start, "traceback")
+    lines_of_gps = Counter()
+    for stat in stats:
+        frame = next((frame for frame in reversed(stat.traceback) if f"{os.sep}gps{os.sep}" in frame.filename),
+                     stat.traceback[-1])
+        lines_of_gps[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+    lines = [f"peak traced memory: {peak / 2 ** 20:.1f} MiB", "", f"top {top} gps lines:"]
+    lines += [f"{line}: {size / 2 ** 20:+.2f} MiB" for line, size in lines_of_gps.most_common(top)]
+    lines += ["", f"top {top} lines:"]
+    lines += [str(stat) for stat in end.compare_to(start, "lineno")[:top]]
+    return "\n".join(lines) + "\n"
+
+
+def _save(files: dict, name: str, client=None, date: str = None) -> str:
+    """
+    write the files of a profile in minio (local directory without client), returns their location
+    """
+    settings = CONFIG["profiling"]
+    prefix = f"{name}/{date or time.strftime('%Y-%m-%d')}/{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    if client is None:
+        folder = Path(settings["dir"]) / prefix
+        folder.mkdir(parents=True, exist_ok=True)
+        for filename, payload in files.items():
+            (folder / filename).write_bytes(payload)
+        return str(folder)
+    if not client.bucket_exists(settings["bucket"]):
+        client.make_bucket(settings["bucket"])
+    for filename, payload in files.items():
+        client.put_object(settings["bucket"], f"{prefix}/{filename}", io.BytesIO(payload), length=len(payload))
+    return f"{settings['bucket']}/{prefix}"
+
+
+def _files(record: dict, profiler, sampler, snapshot, top: int) -> dict:
+    """
+    files of a profile (see the module doc), tracemalloc is stopped
+    """
+    files = {}
+    if snapshot is not None:
+        end, peak = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # without the allocations of the profilers
+        own = [tracemalloc.Filter(False, __file__, all_frames=True)]
+        files["tracemalloc.txt"] = _allocations(snapshot.filter_traces(own), end.filter_traces(own), peak, top).encode()
+    if profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+        files["cprofile.txt"] = stream.getvalue().encode()
+        profiler.create_stats()
+        files["cprofile.prof"] = marshal.dumps(profiler.stats)
+    if sampler is not None:
+        files["samples.folded"] = sampler.folded().encode()
+    files["profile.json"] = json.dumps(record, indent=2).encode()
+    return files
+
+
+@contextmanager
+def profile(name: str, client=None, date: str = None):
+    """
+    Profile a block with the collectors of CONFIG["profiling"]["modes"] (cprofile, sampling, tracemalloc)
+    and save the profiles, also when the block fails. Nested profiles are ignored.
+    Args:
+        name: function profiled, first part of the object names
+        client: minio client the profiles are saved with, local directory when None
+        date: execution date of the function, second part of the object names
+    """
+    if not _ACTIVE.acquire(blocking=False):  # pylint: disable=consider-using-with
+        yield
+        return
+    settings = CONFIG["profiling"]
+    modes = set(settings["modes"])
+    profiler = cProfile.Profile() if "cprofile" in modes else None
+    sampler = _Sampler(settings["interval"]) if "sampling" in modes else None
+    snapshot = None
+    record = {"function": name, "date": date, "modes": sorted(modes), "status": "failed", **labels()}
+    try:
+        # an already running tracemalloc (PYTHONTRACEMALLOC) is left alone
+        if "tracemalloc" in modes and not tracemalloc.is_tracing():
+            tracemalloc.start(settings["frames"])
+            snapshot = tracemalloc.take_snapshot()
+        wall = time.perf_counter()
+        with sampler or nullcontext():
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+                record["status"] = "ok"
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                record["wall_seconds"] = round(time.perf_counter() - wall, 6)
+    finally:
+        try:
+            files = _files(record, profiler, sampler, snapshot, settings["top"])
+            LOGGER.info("profile of %s saved in %s", name, _save(files, name, client, date))
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("profile of %s not saved: %s", name, error)
+        finally:
+            if snapshot is not None and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _ACTIVE.release()
@@ -0,0 +1,106 @@
+""" RULE ENGINE FOR ONEFORALL CLASSIFICATIONS"""
+import operator
+import numpy as np
+import pandas as pd
+from gps import CONFIG
+
+OPERATORS = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "le": operator.le,
+    "gt": operator.gt,
+    "ge": operator.ge,
+    "ieq": operator.eq,
+    "isin": None,
+}
+
+
+def _resolve(value, params: dict):
+    """
+        replace {"param": name} references by their runtime value
+    """
+    if isinstance(value, dict):
+        if value.get("param") not in params:
+            raise ValueError(f"rule parameter {value.get('param')} not provided")
+        return params[value["param"]]
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def compile_rules(rules: dict = None, params: dict = None) -> list:
+    """
+    Compile rule tables into a list of (target, choices, default)
+    Args:
+        rules: rule tables (default CONFIG["rules"])
+        params: runtime values for {"param": ...} references
+    Return:
+        list of (target, [(value, [[(column, op, operand), ...], ...]), ...], default)
+    """
+    rules = CONFIG["rules"] if rules is None else rules
+    params = {} if params is None else params
+    compiled = []
+    for target, rule in rules.items():
+        choices = []
+        for choice in rule["choices"]:
+            groups = []
+            for group in choice["when"]:
+                conditions = []
+                for column, op_, operand in group:
+                    if op_ not in OPERATORS:
+                        raise ValueError(f"unknown operator {op_} in rule {target}")
+                    operand = _resolve(operand, params)
+                    if op_ == "ieq" and isinstance(operand, str):
+                        # the column is lowered when evaluated, the operand once here
+                        operand = operand.lower()
+                    conditions.append((column, op_, operand))
+                groups.append(conditions)
+            choices.append((choice["value"], groups))
+        compiled.append((target, choices, rule.get("default")))
+    return compiled
+
+
+def evaluate_rules(dataframe: pd.DataFrame, rules: dict = None, params: dict = None) -> pd.DataFrame:
+    """
+    Evaluate all classification rules in one pass over the dataframe.
+    Each condition (and each lowered string column) is computed once and shared
+    between rules. First matching choice wins, else the rule default.
+    Args:
+        dataframe: oneforall dataframe
+        rules: rule tables (default CONFIG["rules"])
+        params: runtime values for {"param": ...} references
+    Return:
+        dataframe with one column per rule target
+    """
+    lowered = {}
+    masks = {}
+
+    def condition(column, op_, operand):
+        key = (column, op_, operand)
+        if key not in masks:
+            if op_ == "ieq":
+                if column not in lowered:
+                    lowered[column] = dataframe[column].str.lower()
+                mask = lowered[column] == operand
+            elif op_ == "isin":
+                mask = dataframe[column].isin(operand)
+            else:
+                mask = OPERATORS[op_](dataframe[column], operand)
+            masks[key] = mask.to_numpy(dtype=bool, na_value=False)
+        return masks[key]
+
+    full = np.ones(len(dataframe), dtype=bool)
+    for target, choices, default in compile_rules(rules, params):
+        condlist = []
+        for _, groups in choices:
+            matched = np.zeros(len(dataframe), dtype=bool)
+            for group in groups:
+                group_mask = full
+                for column, op_, operand in group:
+                    group_mask = group_mask & condition(column, op_, operand)
+                matched = matched | group_mask
+            condlist.append(matched)
+        values = np.array([value for value, _ in choices], dtype=object)
+        dataframe[target] = np.select(condlist, values, default=default) if condlist else default
+    return dataframe
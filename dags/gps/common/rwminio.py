@@ -2,7 +2,15 @@
 from typing import List
 import logging
 from io import BytesIO
+import numpy as np
+import pandas as pd
+from gps.common.metrics import count, instrument
 
+# strings read_csv parses as missing values
+CSV_NA = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+          "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+
+@instrument
 def save_minio(client, bucket: str, folder: str, date: str, data) -> None:
     """
     save dataframe in minio
@@ -17,6 +25,7 @@ def save_minio(client, bucket: str, folder: str, date: str, data) -> None:
     if not client.bucket_exists(bucket):
         client.make_bucket(bucket)
     csv_bytes = data.to_csv(index=False).encode('utf-8')
+    count(bytes_out=len(csv_bytes))
     csv_buffer = BytesIO(csv_bytes)
     date_parts = date.split('-')
     if folder is not None:
@@ -34,6 +43,46 @@ def save_minio(client, bucket: str, folder: str, date: str, data) -> None:
                         content_type='application/csv')
         logging.info("data in minio ok")
 
+def like_csv(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    copy of a dataframe with the column names and dtypes pd.read_csv gives back
+    after save_minio, to use a cleaned dataframe in memory as if it was read from minio
+    """
+    data = data.reset_index(drop=True)
+    names, seen = [], {}
+    for position, name in enumerate(data.columns):
+        name = f"Unnamed: {position}" if not isinstance(name, str) and pd.isna(name) or name == "" else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    result = {}
+    for position, name in enumerate(names):
+        series = data.iloc[:, position]
+        if series.dtype == object:
+            missing = series.isna().to_numpy() | series.isin(CSV_NA).to_numpy()
+            present = series[~missing].astype(str)
+            numbers = pd.to_numeric(present, errors="coerce")
+            if present.empty:
+                series = pd.Series(np.nan, index=series.index)
+            elif numbers.notna().all():
+                series = pd.Series(np.nan, index=series.index)
+                series[~missing] = numbers.to_numpy()
+                if not missing.any() and pd.api.types.is_integer_dtype(numbers):
+                    series = series.astype(numbers.dtype)
+            elif not missing.any() and present.isin(["True", "False"]).all():
+                series = present == "True"
+            else:
+                series = series.where(~missing, np.nan).map(lambda value: value if pd.isna(value) else str(value))
+        elif pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_timedelta64_dtype(series):
+            series = series.astype(str).where(series.notna(), np.nan)
+        result[name] = series.to_numpy(copy=True)
+    return pd.DataFrame(result, columns=names)
+
+
+@instrument
 def get_latest_file(client, bucket: str, prefix: str = '', extensions: list = None):
     """
     Returns the name of the latest file in the S3 bucket with the specified prefix and extensions.
@@ -1,153 +1,554 @@
 """ postgres common"""
 
-import psycopg2
+import logging
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import lru_cache
+from io import BytesIO
+import numpy as np
+import pandas as pd
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from gps import CONFIG
+from gps.common.metrics import count, instrument
 
+# oneforall columns in table order (the serial id comes first)
+ONEFORALL_SCHEMA = [
+    ("mois", "VARCHAR"), ("code_oci", "VARCHAR"), ("site", "VARCHAR"), ("autre_code", "VARCHAR"),
+    ("longitude", "VARCHAR"), ("latitude", "VARCHAR"), ("type_du_site", "VARCHAR"), ("statut", "VARCHAR"),
+    ("localisation", "VARCHAR"), ("commune", "VARCHAR"), ("departement", "VARCHAR"), ("region", "VARCHAR"),
+    ("partenaires", "VARCHAR"), ("proprietaire", "VARCHAR"), ("gestionnaire", "VARCHAR"),
+    ("type_geolocalite", "VARCHAR"), ("projet", "VARCHAR"), ("clutter", "VARCHAR"), ("position_site", "VARCHAR"),
+    ("ca_voix", "FLOAT"), ("ca_data", "FLOAT"), ("parc_global", "INTEGER"), ("parc_data", "INTEGER"),
+    ("parc_2g", "INTEGER"), ("parc_3g", "INTEGER"), ("parc_4g", "INTEGER"), ("parc_5g", "INTEGER"),
+    ("autre_parc", "INTEGER"), ("o_m", "FLOAT"), ("energie", "FLOAT"), ("infra", "FLOAT"),
+    ("maintenance_passive_preventive", "FLOAT"), ("garde_de_securite", "FLOAT"), ("discount", "FLOAT"),
+    ("volume_discount", "FLOAT"), ("tva", "FLOAT"), ("opex_itn", "FLOAT"), ("delay_2g", "FLOAT"),
+    ("delay_3g", "FLOAT"), ("delay_4g", "FLOAT"), ("delaycellule_2g", "FLOAT"), ("delaycellule_3g", "FLOAT"),
+    ("delaycellule_4g", "FLOAT"), ("nbrecellule_2g", "INTEGER"), ("nbrecellule_3g", "INTEGER"),
+    ("nbrecellule_4g", "INTEGER"), ("trafic_voix_2g", "FLOAT"), ("trafic_voix_3g", "FLOAT"),
+    ("trafic_voix_4g", "FLOAT"), ("trafic_data_2g", "FLOAT"), ("trafic_data_3g", "FLOAT"),
+    ("trafic_data_4g", "FLOAT"), ("trafic_data_v2_2g", "FLOAT"), ("trafic_data_v2_3g", "FLOAT"),
+    ("trafic_data_v2_4g", "FLOAT"), ("trafic_voix_v2_2g", "FLOAT"), ("trafic_voix_v2_3g", "FLOAT"),
+    ("trafic_voix_v2_4g", "FLOAT"), ("cellules_2g_congestionnees", "INTEGER"), ("cellules_2g", "INTEGER"),
+    ("cellules_3g_congestionnees", "INTEGER"), ("cellules_3g", "INTEGER"),
+    ("cellules_4g_congestionnees", "INTEGER"), ("cellules_4g", "INTEGER"), ("cellules_v2_2g", "INTEGER"),
+    ("cellules_congestionne_v2_2g", "INTEGER"), ("cellules_v2_3g", "INTEGER"),
+    ("cellules_congestionne_v2_3g", "INTEGER"), ("cellules_v2_4g", "INTEGER"),
+    ("cellules_congestionne_v2_4g", "INTEGER"), ("avg_cssr_cs_2g", "FLOAT"), ("avg_cssr_cs_3g", "FLOAT"),
+    ("trafic_voix_total", "FLOAT"), ("trafic_data_total", "FLOAT"), ("ca_total", "FLOAT"),
+    ("segment", "VARCHAR"), ("pareto", "BOOLEAN"), ("cellules_congestionnees_total", "INTEGER"),
+    ("cellules_congestionnees_total_v2", "INTEGER"), ("cellules_total", "INTEGER"),
+    ("cellules_total_v2", "INTEGER"), ("taux_congestion_2g", "FLOAT"), ("taux_congestion_3g", "FLOAT"),
+    ("taux_congestion_4g", "FLOAT"), ("taux_congestion_total", "FLOAT"), ("taux_congestion_2g_v2", "FLOAT"),
+    ("taux_congestion_3g_v2", "FLOAT"), ("taux_congestion_4g_v2", "FLOAT"),
+    ("taux_congestion_total_v2", "FLOAT"), ("recommandation", "VARCHAR"), ("recommandation_v2", "VARCHAR"),
+    ("arpu", "FLOAT"), ("cssr_pondere_trafic_2g", "FLOAT"), ("cssr_pondere_trafic_3g", "FLOAT"),
+    ("cssr_pondere_trafic_2g_v2", "FLOAT"), ("cssr_pondere_trafic_3g_v2", "FLOAT"),
+    ("segmentation_rentabilite", "VARCHAR"), ("segmentation_rentabilite_v2", "VARCHAR"),
+    ("interco", "FLOAT"), ("impot", "FLOAT"), ("frais_dist", "FLOAT"), ("opex", "FLOAT"),
+    ("autre_opex", "FLOAT"), ("ebitda", "FLOAT"), ("marge_ca", "FLOAT"), ("rentable", "BOOLEAN"),
+    ("niveau_rentabilite", "VARCHAR"), ("days", "INTEGER"), ("nur_2g", "FLOAT"), ("nur_3g", "FLOAT"),
+    ("nur_4g", "FLOAT"), ("nur_total", "FLOAT"), ("nur_2g_v2", "FLOAT"), ("nur_3g_v2", "FLOAT"),
+    ("nur_4g_v2", "FLOAT"), ("nur_total_v2", "FLOAT"), ("previous_segment", "VARCHAR"),
+]
+# signature, flags and header extension length of the COPY binary format
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + bytes(8)
+MOIS_PATTERN = re.compile(r"\d{4}-\d{2}")
+# indexes of the dashboards filters, name suffix -> columns
+SERVING_INDEXES = {
+    "mois_idx": ["mois"],
+    "code_oci_mois_idx": ["code_oci", "mois"],
+    "mois_region_segment_idx": ["mois", "region", "segment"],
+}
+# <table>_rollup: sums per month x region x segment x niveau_rentabilite
+ROLLUP_KEYS = ["mois", "region", "segment", "niveau_rentabilite"]
+ROLLUP_SUMS = ["ca_voix", "ca_data", "ca_total", "opex", "ebitda", "trafic_voix_total", "trafic_data_total",
+               "cellules_total", "cellules_congestionnees_total", "cellules_total_v2",
+               "cellules_congestionnees_total_v2"]
+
+
+def create_query(table: str) -> str:
+    """
+    oneforall DDL, LIST partitioned by mois (one partition per month)
+    """
+    columns = ",\n    ".join(f"{name} {type_}" for name, type_ in ONEFORALL_SCHEMA)
+    return (f"CREATE TABLE {table} (\n    id SERIAL,\n    {columns},\n    PRIMARY KEY (id, mois)\n)"
+            " PARTITION BY LIST (mois);")
+
+
+def partition_name(table: str, mois: str) -> str:
+    """
+    partition of a month, e.g. oneforall_2023_01
+    """
+    if not MOIS_PATTERN.fullmatch(str(mois)):
+        raise ValueError(f"invalid mois {mois}, expected YYYY-MM")
+    return f"{table}_{str(mois).replace('-', '_')}"
+
+
+def rollup_query(table: str) -> str:
+    """
+    DDL of the rollup table of table
+    """
+    types = dict(ONEFORALL_SCHEMA)
+    keys = ", ".join(f"{name} {types[name]}" for name in ROLLUP_KEYS)
+    sums = ", ".join(f"{name} {'BIGINT' if types[name] == 'INTEGER' else 'FLOAT'}" for name in ROLLUP_SUMS)
+    return (f"CREATE TABLE IF NOT EXISTS {table}_rollup ({keys}, sites INTEGER, {sums});"
+            f" CREATE INDEX IF NOT EXISTS {table}_rollup_mois_idx ON {table}_rollup (mois);")
+
+
+def refresh_rollup(cur, table: str, months: list) -> None:
+    """
+    recompute the rollup rows of months from table
+    """
+    sums = ", ".join(f"SUM({name})" for name in ROLLUP_SUMS)
+    cur.execute(f"DELETE FROM {table}_rollup WHERE mois = ANY(%s);", (months,))
+    cur.execute(f"""INSERT INTO {table}_rollup ({', '.join(ROLLUP_KEYS)}, sites, {', '.join(ROLLUP_SUMS)})
+        SELECT {', '.join(ROLLUP_KEYS)}, COUNT(*), {sums} FROM {table}
+        WHERE mois = ANY(%s) GROUP BY {', '.join(ROLLUP_KEYS)};""", (months,))
+
+
+def copy_columns(data: pd.DataFrame) -> list:
+    """
+    columns of data in table order, error on columns unknown to the table
+    """
+    known = [name for name, _ in ONEFORALL_SCHEMA]
+    unknown = set(data.columns) - set(known)
+    if unknown:
+        raise ValueError(f"columns {sorted(unknown)} are not in the oneforall table")
+    return [name for name in known if name in data.columns]
+
+
+def _field(series: pd.Series, type_: str):
+    """
+    (null mask, (n, w) big-endian payload bytes, payload lengths) of a column in COPY binary format
+    """
+    null = series.isna().to_numpy()
+    if type_ == "VARCHAR":
+        text = series.where(~null, "").astype(str).to_numpy(dtype=str)
+        payload = np.char.encode(text, "utf-8") if text.size else text.astype("S1")
+        width = max(payload.dtype.itemsize, 1)
+        lengths = np.char.str_len(payload).astype(np.int32)
+        return null, payload.astype(f"S{width}").view(np.uint8).reshape(len(series), width), lengths
+    if type_ == "BOOLEAN":
+        values = series.where(~null, False).astype(bool).to_numpy().astype(">i1")
+    elif type_ == "INTEGER":
+        values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        null = null | ~np.isfinite(values)
+        values = np.round(np.where(null, 0, values))
+        if np.abs(values).max(initial=0) > np.iinfo(np.int32).max:
+            raise ValueError(f"column {series.name} does not fit in INTEGER")
+        values = values.astype(">i4")
+    else:
+        values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        values = values.astype(">f8")
+    width = values.dtype.itemsize
+    return null, values.view(np.uint8).reshape(len(series), width), np.full(len(series), width, np.int32)
+
+
+def copy_buffer(data: pd.DataFrame, columns: list) -> BytesIO:
+    """
+    COPY FROM STDIN buffer of data in binary format (no text formatting of floats).
+    Fields are scattered at precomputed offsets, one numpy pass per column.
+    INTEGER columns are rounded to whole numbers, NaN are written as NULL.
+    """
+    types = dict(ONEFORALL_SCHEMA)
+    rows = len(data)
+    if not rows:
+        # header and trailer only, an empty delta still deletes the removed codes
+        return BytesIO(COPY_HEADER + np.array(-1, ">i2").tobytes())
+    fields = [_field(data[column], types[column]) for column in columns]
+    # field size: 4 bytes length + payload (none when NULL)
+    sizes = np.stack([np.where(null, 0, lengths) + 4 for null, _, lengths in fields], axis=1) \
+        if fields else np.zeros((rows, 0), np.int64)
+    row_sizes = 2 + sizes.sum(axis=1, dtype=np.int64)
+    row_starts = len(COPY_HEADER) + np.concatenate([[0], np.cumsum(row_sizes)[:-1]]).astype(np.int64)
+    buffer = np.zeros(len(COPY_HEADER) + int(row_sizes.sum()) + 2, dtype=np.uint8)
+    buffer[:len(COPY_HEADER)] = np.frombuffer(COPY_HEADER, dtype=np.uint8)
+    buffer[-2:] = 255  # trailer -1
+    buffer[row_starts[:, None] + np.arange(2)] = np.frombuffer(np.array(len(columns), ">i2").tobytes(), np.uint8)
+    offsets = row_starts + 2
+    for (null, payload, lengths), size in zip(fields, sizes.T):
+        header = np.where(null, -1, lengths).astype(">i4").view(np.uint8).reshape(rows, 4)
+        buffer[offsets[:, None] + np.arange(4)] = header
+        mask = (np.arange(payload.shape[1]) < lengths[:, None]) & ~null[:, None]
+        positions = offsets[:, None] + 4 + np.arange(payload.shape[1])
+        buffer[positions[mask]] = payload[mask]
+        offsets = offsets + size
+    return BytesIO(buffer.tobytes())
+
+
+def table_kind(cur, table: str):
+    """
+    "p" for a partitioned table, "r" for a plain table, None when the table does not exist
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cur.fetchone()
+    return None if row is None else row[0]
+
+
+def swap_month(cur, table: str, mois: str, data: pd.DataFrame, load) -> None:
+    """
+    load a month in a staging table then swap it with the month partition.
+    The CHECK constraint on mois lets ATTACH skip the validation scan;
+    readers see either the old or the new month once the transaction commits.
+    """
+    partition = partition_name(table, mois)
+    staging = f"{partition}_staging"
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    cur.execute(f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS);")
+    cur.execute(f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_mois CHECK (mois IS NOT NULL AND mois = %s);",
+                (mois,))
+    load(staging, data)
+    if table_kind(cur, partition) is not None:
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {partition};")
+        cur.execute(f"DROP TABLE {partition};")
+    cur.execute(f"ALTER TABLE {staging} RENAME TO {partition};")
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES IN (%s);", (mois,))
+
+
+def write_table(cur, table: str, kind: str, data: pd.DataFrame, codes: list, load) -> None:
+    """
+    replace the months of data in table, only the rows of codes (code_oci) when given
+    Args:
+        cur: cursor of the transaction
+        kind: "p" for a partitioned table, "r" for a plain table
+        load: callable(target table, dataframe) appending a dataframe to a table
+    """
+    months = [str(mois) for mois in data.mois.unique()]
+    if kind != "p":
+        logging.warning("table %s is not partitioned, months are deleted row by row (see partition_table)", table)
+        if codes is None:
+            cur.execute("DELETE FROM "+table+ " WHERE mois = ANY(%s);", (months,))
+        else:
+            cur.execute("DELETE FROM "+table+ " WHERE mois = ANY(%s) AND code_oci = ANY(%s);", (months, list(codes)))
+        load(table, data)
+        return
+    if codes is None:
+        for mois in months:
+            swap_month(cur, table, mois, data.loc[data.mois.astype(str) == mois], load)
+        return
+    for mois in months:
+        partition = partition_name(table, mois)
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES IN (%s);", (mois,))
+        cur.execute(f"DELETE FROM {partition} WHERE code_oci = ANY(%s);", (list(codes),))
+    load(table, data)
+
+
+def upsert_table(cur, table: str, data: pd.DataFrame, columns: list, codes: list, load,
+                 months: list = None) -> dict:
+    """
+    delta write keyed by (mois, code_oci): data is loaded in a temp table then
+    upserted, rows are only updated when a value differs.
+    There is no unique index on (mois, code_oci), replace writes keep the duplicated code_oci
+    of a month: the writers of the table are serialized and every row of a key is updated.
+    Codes absent from data are deleted from months (the months of data by default),
+    data may be empty when every changed code was removed.
+    Return:
+        counts of inserted, updated, unchanged and deleted keys (rows for deleted)
+    """
+    if data.duplicated(["mois", "code_oci"]).any():
+        raise ValueError("duplicated (mois, code_oci) in data, cannot upsert")
+    delta = f"{table}_delta"
+    cur.execute(f"CREATE TEMP TABLE {delta} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    load(delta, data)
+    values = [column for column in columns if column not in ("mois", "code_oci")]
+    # the update and the insert of new keys see the same rows, readers are not blocked
+    cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE;")
+    cur.execute(f"""UPDATE {table} AS target SET {', '.join(f'{col} = delta.{col}' for col in values)}
+        FROM {delta} AS delta WHERE target.mois = delta.mois AND target.code_oci = delta.code_oci
+        AND ({', '.join(f'target.{col}' for col in values)})
+            IS DISTINCT FROM ({', '.join(f'delta.{col}' for col in values)})
+        RETURNING target.mois, target.code_oci;""")
+    updated = len(set(cur.fetchall()))
+    cur.execute(f"""INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {delta} AS delta
+        WHERE NOT EXISTS (SELECT FROM {table} AS target
+            WHERE target.mois = delta.mois AND target.code_oci = delta.code_oci);""")
+    inserted = cur.rowcount
+    counts = {"inserted": inserted, "updated": updated,
+              "unchanged": len(data) - inserted - updated, "deleted": 0}
+    removed = sorted(set(codes or []) - set(data["code_oci"]))
+    if removed:
+        months = [str(mois) for mois in data.mois.unique()] if months is None else list(months)
+        cur.execute("DELETE FROM "+table+ " WHERE mois = ANY(%s) AND code_oci = ANY(%s);", (months, removed))
+        counts["deleted"] = cur.rowcount
+    cur.execute(f"DROP TABLE {delta};")
+    return counts
+
+
+@lru_cache(maxsize=None)
+def get_engine(host: str, database: str, user: str, password: str, port: str = "5432"):
+    """
+    pooled SQLAlchemy engine, one per DSN and process, sized for the parallel loader
+    """
+    url = URL.create("postgresql", username=user, password=password, host=host, port=int(port),
+                     database=database)
+    return create_engine(url, pool_pre_ping=True, pool_size=max(5, CONFIG["pg_load"]["workers"]))
+
+
+class PgSink:
+    """
+    Writer of the oneforall table.
+    Engines are shared per DSN and the table kind (created, partitioned or plain)
+    is checked once per process, every write runs on one connection and one transaction.
+    The sink also manages the serving indexes and the rollup table, refreshed for the
+    months of every write.
+    """
+    # (engine url, table) -> table kind
+    _kinds = {}
+
+    def __init__(self, host: str, database: str, user: str, password: str, table: str, port: str = "5432"):
+        self.engine = get_engine(host, database, user, password, str(port))
+        self.table = table
+
+    def _kind(self, cur) -> str:
+        """
+        kind of the table, created (partitioned) if missing
+        """
+        key = (str(self.engine.url), self.table)
+        if key not in PgSink._kinds:
+            kind = table_kind(cur, self.table)
+            if kind is None:
+                cur.execute(create_query(self.table))
+                kind = "p"
+            for suffix, columns in SERVING_INDEXES.items():
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_{suffix} "
+                            f"ON {self.table} ({', '.join(columns)});")
+            cur.execute(rollup_query(self.table))
+            PgSink._kinds[key] = kind
+        return PgSink._kinds[key]
+
+    def forget(self) -> None:
+        """
+        drop the cached table kind
+        """
+        PgSink._kinds.pop((str(self.engine.url), self.table), None)
+
+    @staticmethod
+    def _loader(connection, cur, columns: list, method: str):
+        """
+        callable(target table, dataframe) appending a dataframe with COPY or to_sql
+        """
+        if method == "copy":
+            def copy(target, frame):
+                buffer = copy_buffer(frame, columns)
+                count(bytes_out=buffer.getbuffer().nbytes)
+                cur.copy_expert(f"COPY {target} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)", buffer)
+            return copy
+        if method == "to_sql":
+            return lambda target, frame: frame.to_sql(target, connection, index=False, if_exists='append')
+        raise ValueError(f"unknown write method {method}")
+
+    def write(self, data: pd.DataFrame, codes: list = None, method: str = "copy", mode: str = "replace",
+              workers: int = 1, chunk_rows: int = None, months: list = None):
+        """
+        write the months of data
+        Args:
+            codes: only the rows of these codes (code_oci) are rewritten
+            method: "copy" (COPY FROM STDIN) or "to_sql" (INSERT statements)
+            mode: "replace" the months (or the rows of codes) or "upsert" the rows of data
+            workers: connections loading chunks in parallel (full months replace only)
+            chunk_rows: max rows per chunk, each month is split in at least workers chunks
+            months: months of the upsert (the months of data by default), the removed codes
+                are deleted from them even when data is empty
+        Return:
+            upsert counts (see upsert_table), None when replacing
+        """
+        if mode not in ("replace", "upsert"):
+            raise ValueError(f"unknown write mode {mode}")
+        if workers > 1:
+            if mode != "replace" or codes is not None:
+                raise ValueError("parallel load only replaces full months")
+            return self._write_parallel(data, method, workers, chunk_rows)
+        columns = copy_columns(data)
+        try:
+            with self.engine.begin() as connection:
+                cur = connection.connection.cursor()
+                load = self._loader(connection, cur, columns, method)
+                kind = self._kind(cur)
+                counts = None
+                if months is None or mode != "upsert":
+                    months = [str(mois) for mois in data.mois.unique()]
+                if mode == "upsert":
+                    if kind == "p":
+                        for mois in months:
+                            cur.execute(f"CREATE TABLE IF NOT EXISTS {partition_name(self.table, mois)} "
+                                        f"PARTITION OF {self.table} FOR VALUES IN (%s);", (str(mois),))
+                    counts = upsert_table(cur, self.table, data, columns, codes, load, months)
+                    logging.info("upsert %s: %s", self.table, counts)
+                else:
+                    write_table(cur, self.table, kind, data, codes, load)
+                refresh_rollup(cur, self.table, [str(mois) for mois in months])
+                cur.close()
+        except Exception:
+            # the table may have been created in the rolled back transaction or changed outside
+            self.forget()
+            raise
+        return counts
+
+    def _drop(self, tables: list) -> None:
+        """
+        drop scratch tables on a new connection, a failure is logged and does not hide the error of the write
+        """
+        try:
+            with self.engine.begin() as connection:
+                cur = connection.connection.cursor()
+                for table in tables:
+                    cur.execute(f"DROP TABLE IF EXISTS {table};")
+                cur.close()
+        except Exception as error:  # pylint: disable=broad-except
+            logging.warning("scratch tables %s not dropped: %s", ", ".join(tables), error)
+
+    def _execute(self, statements: list) -> None:
+        """
+        run statements in their own transaction, on a pooled connection
+        """
+        with self.engine.begin() as connection:
+            cur = connection.connection.cursor()
+            for statement, params in statements:
+                cur.execute(statement, params)
+            cur.close()
+
+    def _load_chunk(self, target: str, data: pd.DataFrame, columns: list, method: str) -> None:
+        """
+        append a chunk to a staging table, on its own pooled connection
+        """
+        with self.engine.begin() as connection:
+            cur = connection.connection.cursor()
+            self._loader(connection, cur, columns, method)(target, data)
+            cur.close()
+
+    def _write_parallel(self, data: pd.DataFrame, method: str, workers: int, chunk_rows: int = None) -> None:
+        """
+        Load chunks of data in parallel straight into one staging table per month, index them
+        like the partitions, then swap them with the month partitions in one final transaction
+        that only changes the catalog (detach, rename, attach) and refreshes the rollup.
+        A plain table is written by one connection (see partition_table).
+        """
+        columns = copy_columns(data)
+        with self.engine.begin() as connection:
+            kind = self._kind(connection.connection.cursor())
+        if kind != "p":
+            logging.warning("table %s is not partitioned, parallel load skipped (see partition_table)", self.table)
+            return self.write(data, method=method)
+        run = uuid.uuid4().hex[:8]
+        staging = {}
+        jobs = []
+        for mois, frame in data.groupby(data.mois.astype(str), sort=False):
+            staging[mois] = f"{partition_name(self.table, mois)}_staging_{run}"
+            size = min(chunk_rows or len(frame), -(-len(frame) // workers))
+            jobs += [(staging[mois], frame.iloc[start:start + size]) for start in range(0, len(frame), size)]
+        try:
+            for mois, table in staging.items():
+                # the CHECK constraint on mois lets ATTACH skip the validation scan
+                self._execute([(f"CREATE TABLE {table} (LIKE {self.table} INCLUDING DEFAULTS);", None),
+                               (f"ALTER TABLE {table} ADD CONSTRAINT {table}_mois "
+                                "CHECK (mois IS NOT NULL AND mois = %s);", (mois,))])
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # chunks count their bytes in the measure of the caller (see metrics.count)
+                futures = [executor.submit(copy_context().run, self._load_chunk, table, frame, columns, method)
+                           for table, frame in jobs]
+                for future in futures:
+                    future.result()
+                # indexes matching those of the table are attached instead of built by ATTACH
+                indexes = [[(f"ALTER TABLE {table} ADD PRIMARY KEY (id, mois);", None)]
+                           + [(f"CREATE INDEX ON {table} ({', '.join(index)});", None)
+                              for index in SERVING_INDEXES.values()] for table in staging.values()]
+                for future in [executor.submit(self._execute, statements) for statements in indexes]:
+                    future.result()
+            with self.engine.begin() as connection:
+                cur = connection.connection.cursor()
+                for mois, table in staging.items():
+                    partition = partition_name(self.table, mois)
+                    if table_kind(cur, partition) is not None:
+                        cur.execute(f"ALTER TABLE {self.table} DETACH PARTITION {partition};")
+                        cur.execute(f"DROP TABLE {partition};")
+                    cur.execute(f"ALTER TABLE {table} RENAME TO {partition};")
+                    cur.execute(f"ALTER TABLE {self.table} ATTACH PARTITION {partition} FOR VALUES IN (%s);",
+                                (mois,))
+                refresh_rollup(cur, self.table, list(staging))
+                cur.close()
+        except Exception:
+            self.forget()
+            raise
+        finally:
+            # renamed when the swap committed, left over otherwise
+            self._drop(list(staging.values()))
+        return None
+
+    def write_staged(self, staging: str, months: list, columns: list) -> None:
+        """
+        replace months with the rows of a staging table loaded by another writer
+        (spark jdbc), in one transaction. The staging table is dropped.
+        """
+        try:
+            with self.engine.begin() as connection:
+                cur = connection.connection.cursor()
+                select = ", ".join(columns)
+
+                def load(target, frame):
+                    cur.execute(f"INSERT INTO {target} ({select}) SELECT {select} FROM {staging} "
+                                "WHERE mois = ANY(%s);", (list(frame.mois.unique()),))
+
+                write_table(cur, self.table, self._kind(cur), pd.DataFrame({"mois": months}), None, load)
+                refresh_rollup(cur, self.table, months)
+                cur.close()
+        except Exception:
+            self.forget()
+            raise
+        finally:
+            self._drop([staging])
+
+    def partition(self) -> None:
+        """
+        migrate a plain table to a partitioned one, one partition per month.
+        The plain table is kept as <table>_unpartitioned.
+        """
+        table = self.table
+        self.forget()
+        with self.engine.begin() as connection:
+            cur = connection.connection.cursor()
+            if table_kind(cur, table) != "r":
+                raise ValueError(f"{table} is not a plain table")
+            columns = ", ".join(["id"] + [name for name, _ in ONEFORALL_SCHEMA])
+            cur.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned;")
+            # the serving indexes keep their names, the partitioned table could not create its own
+            for suffix in SERVING_INDEXES:
+                cur.execute(f"ALTER INDEX IF EXISTS {table}_{suffix} RENAME TO {table}_unpartitioned_{suffix};")
+            cur.execute(create_query(table))
+            cur.execute(f"SELECT DISTINCT mois FROM {table}_unpartitioned;")
+            for (mois,) in cur.fetchall():
+                cur.execute(f"CREATE TABLE {partition_name(table, mois)} PARTITION OF {table} "
+                            "FOR VALUES IN (%s);", (mois,))
+            cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_unpartitioned;")
+            cur.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                        f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {table}), false);", (table,))
+            cur.close()
+
+
+def partition_table(host: str, database:str, user: str, password: str, table: str, port:str="5432"):
+    """
+    migrate a plain table to a partitioned one (see PgSink.partition)
+    """
+    PgSink(host, database, user, password, table, port).partition()
+
+
+@instrument
 def write_pg(host: str, database:str, user: str, password: str,
-            data, table: str = None, port:str="5432"):
+            data, table: str = None, port:str="5432", codes: list = None, method: str = "copy",
+            mode: str = "replace", workers: int = 1, months: list = None):
     """"
      write data in pg
+     the months of data are replaced, only the rows of codes (code_oci) when given
+     a full month is loaded in a staging table and swapped with its partition,
+     everything runs in a single transaction
+     method: "copy" (COPY FROM STDIN) or "to_sql" (INSERT statements)
+     mode: "replace" or "upsert" (delta write keyed by (mois, code_oci), returns counts)
+     workers: parallel connections for full months replace (chunk size from CONFIG["pg_load"])
+     months: months of an upsert, the removed codes are deleted from them even when data is empty
     """
-    conn = psycopg2.connect(
-        host=host,
-        database=database,
-        user=user,
-        password=password,
-        port = port
-        )
-    db_uri = f'postgresql://{user}:{password}@{host}:{port}/{database}'
-    engine = create_engine(db_uri)
-    cur = conn.cursor()
-    cur.execute(f"""SELECT EXISTS (SELECT FROM
-        information_schema.tables WHERE table_name = '{table}');""")
-    table_exists = cur.fetchone()[0]
-    if not table_exists:
-        create_query = f"""
-            CREATE TABLE {table} (
-            id SERIAL PRIMARY KEY,
-            mois VARCHAR,
-            code_oci varchar,
-            site VARCHAR,
-            autre_code VARCHAR,
-            longitude VARCHAR,
-            latitude VARCHAR,
-            type_du_site VARCHAR,
-            statut VARCHAR,
-            localisation VARCHAR,
-            commune VARCHAR,
-            departement VARCHAR,
-            region VARCHAR,
-            partenaires VARCHAR,
-            proprietaire VARCHAR,
-            gestionnaire VARCHAR,
-            type_geolocalite VARCHAR,
-            projet VARCHAR,
-            clutter VARCHAR,
-            position_site VARCHAR,
-            ca_voix FLOAT,
-            ca_data FLOAT,
-            parc_global INTEGER,
-            parc_data INTEGER,
-            parc_2g INTEGER,
-            parc_3g  INTEGER,
-            parc_4g INTEGER,
-            parc_5g INTEGER,
-            autre_parc INTEGER,
-            o_m FLOAT,
-            energie FLOAT,
-            infra FLOAT,
-            maintenance_passive_preventive FLOAT,
-            garde_de_securite FLOAT,
-            discount FLOAT,
-            volume_discount FLOAT,
-            tva FLOAT,
-            opex_itn FLOAT,
-            delay_2g FLOAT,
-            delay_3g FLOAT,
-            delay_4g FLOAT,
-            delaycellule_2g	FLOAT,
-            delaycellule_3g	FLOAT,
-            delaycellule_4g FLOAT,
-            nbrecellule_2g INTEGER,
-            nbrecellule_3g INTEGER,
-            nbrecellule_4g INTEGER,
-            trafic_voix_2g FLOAT,
-            trafic_voix_3g FLOAT,
-            trafic_voix_4g FLOAT,
-            trafic_data_2g FLOAT,
-            trafic_data_3g FLOAT,
-            trafic_data_4g FLOAT,
-            trafic_data_v2_2g  FLOAT, 
-            trafic_data_v2_3g  FLOAT, 
-            trafic_data_v2_4g  FLOAT, 
-            trafic_voix_v2_2g  FLOAT, 
-            trafic_voix_v2_3g  FLOAT, 
-            trafic_voix_v2_4g  FLOAT,
-            cellules_2g_congestionnees INTEGER,
-            cellules_2g INTEGER,
-            cellules_3g_congestionnees INTEGER,
-            cellules_3g INTEGER,
-            cellules_4g_congestionnees INTEGER,
-            cellules_4g INTEGER,
-            cellules_v2_2g  INTEGER, 
-            cellules_congestionne_v2_2g INTEGER,
-            cellules_v2_3g   INTEGER, 
-            cellules_congestionne_v2_3g  INTEGER, 
-            cellules_v2_4g   INTEGER, 
-            cellules_congestionne_v2_4g  INTEGER,
-            avg_cssr_cs_2g FLOAT,
-            avg_cssr_cs_3g FLOAT,
-            trafic_voix_total FLOAT,
-            trafic_data_total FLOAT,
-            ca_total FLOAT,
-            segment VARCHAR,
-            pareto BOOLEAN,
-            cellules_congestionnees_total INTEGER,
-            cellules_congestionnees_total_v2 INTEGER,
-            cellules_total INTEGER,
-            cellules_total_v2 INTEGER,
-            taux_congestion_2g FLOAT,
-            taux_congestion_3g FLOAT,
-            taux_congestion_4g FLOAT,
-            taux_congestion_total FLOAT,
-            taux_congestion_2g_v2 FLOAT,
-            taux_congestion_3g_v2 FLOAT,
-            taux_congestion_4g_v2 FLOAT,
-            taux_congestion_total_v2  FLOAT,
-            recommandation VARCHAR,
-            recommandation_v2  VARCHAR,
-            arpu FLOAT,
-            cssr_pondere_trafic_2g  FLOAT,
-            cssr_pondere_trafic_3g FLOAT,
-            cssr_pondere_trafic_2g_v2  FLOAT,
-            cssr_pondere_trafic_3g_v2  FLOAT, 
-            segmentation_rentabilite VARCHAR,
-            segmentation_rentabilite_v2  VARCHAR,
-            interco FLOAT,
-            impot FLOAT,
-            frais_dist FLOAT,
-            opex FLOAT,
-            autre_opex FLOAT,
-            ebitda FLOAT,
-            marge_ca FLOAT,
-            rentable BOOLEAN,
-            niveau_rentabilite VARCHAR,
-            days INTEGER,
-            nur_2g FLOAT,
-            nur_3g FLOAT,
-            nur_4g FLOAT,
-            nur_total FLOAT,
-            nur_2g_v2  FLOAT,
-            nur_3g_v2  FLOAT,
-            nur_4g_v2  FLOAT,
-            nur_total_v2  FLOAT,
-            previous_segment VARCHAR
-        );
-        """
-        cur.execute(create_query)
-    cur.execute("DELETE FROM "+table+ " WHERE mois = %s;", (data.mois.unique()[0],))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-    data.to_sql(table, engine, index=False, if_exists = 'append')
+    return PgSink(host, database, user, password, table, port).write(
+        data, codes=codes, method=method, mode=mode, workers=workers,
+        chunk_rows=CONFIG["pg_load"]["chunk_rows"] if workers > 1 else None, months=months)
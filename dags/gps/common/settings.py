@@ -0,0 +1,67 @@
+""" LAZY SETTINGS
+
+Airflow variables and clients are resolved inside task execution only,
+once per process, so parsing a DAG file does not hit the metadata database.
+"""
+import inspect
+from functools import lru_cache, wraps
+from minio import Minio
+
+
+@lru_cache(maxsize=None)
+def variable(name: str, default: str = None) -> str:
+    """
+    airflow variable (default when it is not set), one metadata database lookup per process
+    """
+    from airflow.models import Variable  # pylint: disable=import-outside-toplevel
+    return Variable.get(name) if default is None else Variable.get(name, default_var=default)
+
+
+@lru_cache(maxsize=None)
+def minio_client() -> Minio:
+    """
+    minio client of the minio_* variables
+    """
+    return Minio(variable("minio_host"),
+                 access_key=variable("minio_access_key"),
+                 secret_key=variable("minio_secret_key"),
+                 secure=False)
+
+
+# callable kwargs resolved at execution when not given
+MINIO_KWARGS = {
+    "client": minio_client,
+    "endpoint": lambda: variable("minio_host"),
+    "accesskey": lambda: variable("minio_access_key"),
+    "secretkey": lambda: variable("minio_secret_key"),
+}
+
+
+def with_minio(func):
+    """
+    Wrap a task callable: the minio kwargs it expects (client, endpoint, accesskey, secretkey)
+    are resolved at execution, kwargs not in its signature (airflow context) are dropped.
+    The call is profiled (see gps.common.profiling) when the profile kwarg of the task (op_kwargs)
+    or the profile param of the dag run is true.
+    """
+    parameters = inspect.signature(func).parameters
+    var_keyword = any(param.kind == inspect.Parameter.VAR_KEYWORD for param in parameters.values())
+
+    @wraps(func)
+    def wrapper(**kwargs):
+        profile = kwargs.pop("profile", None) or (kwargs.get("params") or {}).get("profile")
+        for name, resolve in MINIO_KWARGS.items():
+            if name not in kwargs and (var_keyword or name in parameters):
+                kwargs[name] = resolve()
+        client, date = kwargs.get("client"), kwargs.get("date", kwargs.get("ingest_date"))
+        if not var_keyword:
+            kwargs = {name: value for name, value in kwargs.items() if name in parameters}
+        if not profile:
+            return func(**kwargs)
+        from gps.common.profiling import profile as profiled  # pylint: disable=import-outside-toplevel
+        with profiled(func.__name__, client or minio_client(), date):
+            return func(**kwargs)
+    # @wraps exposes the signature of func, airflow would only pass the context keys func names (no profile
+    # nor params): the wrapper takes the whole context and filters it itself
+    wrapper.__signature__ = inspect.Signature([inspect.Parameter("kwargs", inspect.Parameter.VAR_KEYWORD)])
+    return wrapper
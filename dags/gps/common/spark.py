@@ -0,0 +1,240 @@
+""" SPARK BACKEND
+
+Spark versions of the heavy steps: monthly reads of the cleaning functions,
+the oneforall join chain and the JDBC write. Results follow the pandas functions
+(same columns and values), small aggregated results are collected to pandas.
+Runs in local[*] mode by default (CONFIG["spark"]["master"]).
+"""
+import uuid
+from functools import lru_cache, reduce
+import pandas as pd
+from pyspark.sql import DataFrame, SparkSession, Window, functions as F
+from pyspark.sql.types import BooleanType, DoubleType, StringType, StructField, StructType
+from gps import CONFIG
+from gps.common.enrich import JOIN_COLUMNS
+from gps.common.rwpg import ONEFORALL_SCHEMA, PgSink, copy_columns
+
+TECHNOS = ["2G", "3G", "4G"]
+SPARK_TYPES = {"FLOAT": DoubleType, "INTEGER": DoubleType, "VARCHAR": StringType, "BOOLEAN": BooleanType}
+# numbers are inferred as pd.read_csv does, dates stay strings (e.g. mois "2023-01")
+CSV_OPTIONS = {"header": "true", "inferSchema": "true", "prefersDate": "false",
+               "timestampFormat": "yyyy-MM-dd HH:mm:ss.SSSSSS", "enableDateTimeParsingFallback": "false"}
+
+
+@lru_cache(maxsize=None)
+def get_spark(endpoint: str, accesskey: str, secretkey: str) -> SparkSession:
+    """
+    spark session reading minio through s3a, one per process
+    """
+    settings = CONFIG["spark"]
+    return (SparkSession.builder.master(settings["master"]).appName("gps")
+            .config("spark.jars", settings["jars"])
+            .config("spark.sql.session.timeZone", "UTC")
+            .config("spark.sql.execution.arrow.pyspark.enabled", "true")
+            .config("spark.hadoop.fs.s3a.endpoint", f"http://{endpoint}")
+            .config("spark.hadoop.fs.s3a.access.key", accesskey)
+            .config("spark.hadoop.fs.s3a.secret.key", secretkey)
+            .config("spark.hadoop.fs.s3a.path.style.access", "true")
+            .config("spark.hadoop.fs.s3a.connection.ssl.enabled", "false")
+            .config("spark.hadoop.fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem")
+            .getOrCreate())
+
+
+def _path(bucket: str, filename: str) -> str:
+    """
+    s3a url of a minio object
+    """
+    return f"s3a://{bucket}/{filename}"
+
+
+def read_csv(spark: SparkSession, bucket: str, filenames: list, lower: bool = False) -> DataFrame:
+    """
+    csv files of a bucket, with a _file (position in filenames) and _row column to keep the file order
+    """
+    frames = []
+    for position, filename in enumerate(filenames):
+        frame = spark.read.options(**CSV_OPTIONS).csv(_path(bucket, filename))
+        if lower:
+            frame = frame.toDF(*[column.lower() for column in frame.columns])
+        frames.append(frame.withColumn("_file", F.lit(position)).withColumn("_row", F.monotonically_increasing_id()))
+    return reduce(lambda left, right: left.unionByName(right, allowMissingColumns=True), frames)
+
+
+def _key(column: str):
+    """
+    site key as pandas astype(str).str.strip(): a missing key is the string 'nan' (see duck.py)
+    """
+    return F.coalesce(F.trim(F.col(column).cast("string")), F.lit("nan"))
+
+
+def _sum(column: str):
+    """
+    pandas sum of a group: missing values count as 0
+    """
+    return F.sum(F.coalesce(F.col(column).cast("double"), F.lit(0.0)))
+
+
+def _unstack(data: DataFrame, keys: list, values: list, agg) -> DataFrame:
+    """
+    groupby(keys + techno).agg().unstack() with pandas column names (value_techno, values first)
+    """
+    technos = sorted(row[0] for row in data.select("techno").where(F.col("techno").isNotNull()).distinct().collect())
+    pivoted = (data.where(F.col("techno").isNotNull())
+               .groupBy(*keys).pivot("techno", technos)
+               .agg(*[agg(value).alias(value) for value in values]))
+    renamed = [F.col(f"`{techno}_{value}`" if len(values) > 1 else f"`{techno}`").alias(f"{value}_{techno}")
+               for value in values for techno in technos]
+    return pivoted.select(*keys, *renamed)
+
+
+def traffic(spark: SparkSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    monthly voice and data traffic per site and techno (see cleaning.cleaning_traffic)
+    """
+    data = read_csv(spark, bucket, filenames, lower=True)
+    data = (data.withColumn("code_site", _key("code_site"))
+            .withColumn("date_jour", F.col("date_jour").cast("string"))
+            .withColumn("mois", F.concat_ws("-", F.substring("date_jour", 1, 4), F.substring("date_jour", 5, 2))))
+    data = _unstack(data, ["mois", "code_site"], ["trafic_voix", "trafic_data"], _sum)
+    return data.orderBy("mois", "code_site").toPandas()
+
+
+def cssr(spark: SparkSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    call setup success rate per site, summed per day and techno then averaged over the month
+    (see cleaning.cleaning_cssr, without its averaged date_jour column)
+    """
+    data = read_csv(spark, bucket, filenames).withColumn("date_jour", F.col("date_jour").cast("string"))
+    first = Window.partitionBy("date_jour", "code_site", "techno").orderBy("_file", "_row")
+    data = (data.withColumn("_rank", F.row_number().over(first)).where(F.col("_rank") == 1)
+            .select("date_jour", "code_site", "avg_cssr_cs", "techno")
+            .dropna(subset=["code_site", "avg_cssr_cs", "techno"]))
+    data = _unstack(data, ["date_jour", "code_site"], ["avg_cssr_cs"], _sum)
+    values = [column for column in data.columns if column.startswith("avg_cssr_cs_")]
+    data = (data.withColumn("MOIS", F.concat_ws("-", F.substring("date_jour", 1, 4), F.substring("date_jour", 5, 2)))
+            .groupBy("MOIS", "code_site").agg(*[F.avg(value).alias(value) for value in values]))
+    return data.orderBy("MOIS", "code_site").toPandas()
+
+
+def ca_parc(spark: SparkSession, bucket: str, filenames: list) -> pd.DataFrame:
+    """
+    monthly revenues (sum) and last subscriber counts per site (see cleaning.cleaning_ca_parc)
+    """
+    data = read_csv(spark, bucket, filenames, lower=True)
+    data = data.withColumn("id_site", _key("id_site"))
+    lasts = ["parc", "parc_data", "parc_2g", "parc_3g", "parc_4g", "parc_5g", "parc_other"]
+    # last non missing value in day order
+    order = ["day_id", "_file", "_row"]
+    aggregations = [_sum("ca_voix").alias("ca_voix"), _sum("ca_data").alias("ca_data")] + [
+        F.max(F.when(F.col(column).isNotNull(), F.struct(*order, F.col(column).alias("value"))))["value"].alias(column)
+        for column in lasts]
+    return data.groupBy("id_site").agg(*aggregations).orderBy("id_site").toPandas()
+
+
+def read_inputs(spark: SparkSession, objects: dict) -> dict:
+    """
+    cleaned inputs located by enrich.input_objects
+    """
+    return {key: spark.read.options(**CSV_OPTIONS).csv(_path(bucket, filename))
+            for key, (bucket, filename) in objects.items()}
+
+
+def join_inputs(inputs: dict) -> pd.DataFrame:
+    """
+    merge the cleaned inputs of one month on the base sites (see enrich.join_inputs)
+    """
+    def side(frame: DataFrame, alias: str) -> DataFrame:
+        # _order keeps the file order of each input: rows are sorted as the pandas left merges return them
+        return frame.select(*[F.col(f"`{column}`").alias(f"{alias}.{column}") for column in frame.columns],
+                            F.monotonically_increasing_id().alias(f"{alias}._order"))
+
+    def col(alias: str, column: str):
+        return F.col(f"`{alias}.{column}`")
+
+    bdd = side(inputs["bdd"], "bdd")
+    data = (bdd.join(side(inputs["caparc"], "caparc"), col("bdd", "code oci id") == col("caparc", "id_site"), "left")
+            .join(side(inputs["ihs"], "ihs"), (col("bdd", "autre code") == col("ihs", "site id ihs"))
+                  & (col("bdd", "mois") == col("ihs", "mois")), "left")
+            .join(side(inputs["esco"], "esco"), col("bdd", "autre code") == col("esco", "code site"), "left")
+            .join(side(inputs["cong"], "cong"), col("bdd", "code oci") == col("cong", "code_site"), "left")
+            .join(side(inputs["trafic"], "trafic"), col("bdd", "code oci") == col("trafic", "code_site"), "left")
+            .join(side(inputs["trafic2"], "trafic2"), col("bdd", "code oci id") == col("trafic2", "id_site"), "left")
+            .join(side(inputs["cssr"], "cssr"), col("bdd", "code oci") == col("cssr", "code_site"), "left")
+            .orderBy(*[col(alias, "_order") for alias in ["bdd", "caparc", "ihs", "esco", "cong", "trafic",
+                                                          "trafic2", "cssr"]]))
+
+    def pick(alias: str, column: str):
+        # columns missing from an input (e.g. no 4G traffic this month) are NaN as in pandas
+        return col(alias, column) if f"{alias}.{column}" in data.columns else F.lit(None).cast("double")
+
+    def opex(column: str):
+        # ihs values, esco values for the sites without ihs opex
+        return F.coalesce(pick("ihs", column), pick("esco", column))
+
+    bdd_columns = ["code oci", "site", "autre code", "longitude", "latitude", "type du site", "statut",
+                   "localisation", "commune", "departement", "region", "partenaires", "proprietaire",
+                   "gestionnaire", "type geolocalite", "projet", "clutter", "position site"]
+    selected = ([col("bdd", "mois")] + [col("bdd", column) for column in bdd_columns]
+                + [pick("caparc", column) for column in ["ca_voix", "ca_data", "parc", "parc_data", "parc_2g",
+                                                          "parc_3g", "parc_4g", "parc_5g", "parc_other"]]
+                + [opex(column) for column in ["o&m", "energy", "infra", "maintenance passive preventive",
+                                                "gardes de securite", "discount", "volume discount"]]
+                + [pick("esco", "tva : 18%"),
+                   F.when(pick("esco", "total redevances ht").isNotNull(), pick("esco", "total redevances ht"))
+                   .otherwise(pick("ihs", "month_total"))]
+                + [F.lit(0)] * 9
+                + [pick("trafic", f"{value}_{techno}") for value in ["trafic_voix", "trafic_data"]
+                   for techno in TECHNOS]
+                + [pick("trafic2", f"{value}_{techno}") for value in ["trafic_data_go", "trafic_voix_erl"]
+                   for techno in TECHNOS]
+                + [pick("cong", column) for column in ["cellules_2g_congestionnees", "cellules_2g",
+                                                       "cellules_3g_congestionnees", "cellules_3g",
+                                                       "cellules_4g_congestionnees", "cellules_4g"]]
+                + [pick("trafic2", f"{value}_{techno}") for techno in TECHNOS
+                   for value in ["nbre_cellule", "nbre_cellule_congestionne"]]
+                + [pick("cssr", "avg_cssr_cs_2G"), pick("cssr", "avg_cssr_cs_3G")])
+    names = JOIN_COLUMNS[:JOIN_COLUMNS.index("trafic_voix_total")]
+    data = data.select(*[column.alias(name) for column, name in zip(selected, names)])
+    data = (data.withColumn("trafic_voix_total", F.col("trafic_voix_2g") + F.col("trafic_voix_3g") + F.col("trafic_voix_4g"))
+            .withColumn("trafic_data_total", F.col("trafic_data_2g") + F.col("trafic_data_3g") + F.col("trafic_data_4g"))
+            .withColumn("ca_total", F.col("ca_data") + F.col("ca_voix")))
+    return data.toPandas()
+
+
+def to_spark(spark: SparkSession, data: pd.DataFrame) -> DataFrame:
+    """
+    spark dataframe of a oneforall pandas dataframe, typed with the table schema, NaN as null.
+    Columns are converted once per column and sent through arrow (no python object per row).
+    """
+    types = dict(ONEFORALL_SCHEMA)
+    columns = copy_columns(data)
+    schema = StructType([StructField(column, SPARK_TYPES[types[column]](), True) for column in columns])
+    frame = pd.DataFrame(index=data.index)
+    for column in columns:
+        series = data[column]
+        if types[column] in ("FLOAT", "INTEGER"):
+            frame[column] = pd.to_numeric(series, errors="coerce").astype("float64")
+        elif types[column] == "VARCHAR":
+            frame[column] = series.astype(str).where(series.notna(), None)
+        else:
+            frame[column] = series.astype(bool).where(series.notna(), None)
+    return spark.createDataFrame(frame.reset_index(drop=True), schema)
+
+
+def write_jdbc(data: DataFrame, host: str, database: str, user: str, password: str, table: str,
+               port: str = "5432") -> None:
+    """
+    Write the months of a spark dataframe in postgres: spark loads a staging table in parallel
+    through JDBC, the months are then replaced from it in one transaction (see PgSink.write_staged)
+    """
+    columns = copy_columns(data)
+    months = sorted(str(row[0]) for row in data.select("mois").distinct().collect())
+    staging = f"{table}_spark_{uuid.uuid4().hex[:8]}"
+    (data.select(*columns).write.format("jdbc")
+     .option("url", f"jdbc:postgresql://{host}:{port}/{database}")
+     .option("dbtable", staging).option("user", user).option("password", password)
+     .option("driver", "org.postgresql.Driver")
+     .option("batchsize", CONFIG["spark"]["jdbc_batchsize"])
+     .option("numPartitions", CONFIG["pg_load"]["workers"])
+     .mode("overwrite").save())
+    PgSink(host, database, user, password, table, port).write_staged(staging, months, columns)
@@ -1,11 +1,10 @@
 # Monthly DAG
 from datetime import datetime
+import pandas as pd
 from airflow import DAG
 from airflow.utils.task_group import TaskGroup
 from airflow.operators.python import PythonOperator
 from airflow.sensors.python import PythonSensor
-from airflow.models import Variable
-from minio import Minio
 from gps import CONFIG
 from gps.common.cleaning import (
     clean_base_sites,
@@ -17,60 +16,60 @@ from gps.common.cleaning import (
     cleaning_ca_parc,
     cleaning_trafic_v2
 )
-from gps.common.enrich import oneforall, get_last_ofa
+from gps.common.datasets import dataset
+from gps.common.enrich import (oneforall, oneforall_incremental, reset_incremental, get_emitted, get_last_ofa,
+                               oneforall_batch, month_dates)
 from gps.common.alerting import alert_failure
 from gps.common.rwminio import save_minio, get_latest_file
 from gps.common.rwpg import write_pg
+from gps.common.fused import monthly_run
+from gps.common.settings import variable, minio_client, with_minio
 from gps.common.alerting import get_receivers, send_email
 from gps.common.extract import extract_pg
 
-MINIO_ENDPOINT = Variable.get('minio_host')
-MINIO_ACCESS_KEY = Variable.get('minio_access_key')
-MINIO_SECRET_KEY = Variable.get('minio_secret_key')
-
-SMTP_HOST = Variable.get('smtp_host')
-SMTP_PORT = Variable.get('smtp_port')
-SMTP_USER = Variable.get('smtp_user')
-
-PG_SAVE_HOST = Variable.get('pg_save_host')
-PG_SAVE_DB = Variable.get('pg_save_db')
-PG_SAVE_USER = Variable.get('pg_save_user')
-PG_SAVE_PASSWORD = Variable.get('pg_save_password')
-
-PG_HOST = Variable.get('pg_host')
-PG_V2_DB = Variable.get('pg_v2_db')
-PG_V2_USER = Variable.get('pg_v2_user')
-PG_V2_PASSWORD = Variable.get('pg_v2_password')
-
 DATE = "{{data_interval_start.strftime('%Y-%m-%d')}}"
-CLIENT = Minio( MINIO_ENDPOINT,
-        access_key= MINIO_ACCESS_KEY,
-        secret_key= MINIO_SECRET_KEY,
-        secure=False)
+# rendered at execution only, variables are not read when the file is parsed
+SMTP_HOST = "{{ var.value.smtp_host }}"
+SMTP_PORT = "{{ var.value.smtp_port }}"
+SMTP_USER = "{{ var.value.smtp_user }}"
+# engines of the DAG tasks, spark is left out until its local[*] equivalence check against pandas passes
+# (benchmarks/bench_pipeline.py --engines pandas spark)
+DAG_ENGINES = ("pandas", "duckdb")
+
+def task_engine(task: str) -> str:
+    """
+    engine of a task in CONFIG["engines"], error when the DAG tasks do not support it
+    """
+    engine = CONFIG["engines"][task]
+    if engine not in DAG_ENGINES:
+        raise ValueError(f"engine {engine} of {task} not supported by the DAG tasks, expected one of {DAG_ENGINES}")
+    return engine
 
 def extract_trafic_V2(**kwargs):
     """
     """
-    data = extract_pg(host = PG_HOST, database= PG_V2_DB, user= PG_V2_USER, 
-            password= PG_V2_PASSWORD , table= kwargs["thetable"] , date= kwargs["ingest_date"])
+    data = extract_pg(host = variable('pg_host'), database= variable('pg_v2_db'), user= variable('pg_v2_user'),
+            password= variable('pg_v2_password') , table= kwargs["thetable"] , date= kwargs["ingest_date"],
+            port= variable('pg_port', '5432'))
     print(data.shape)
     if  data.empty:
         raise RuntimeError(f"No data for {kwargs['ingest_date']}")
     
-    save_minio(CLIENT, kwargs["bucket"], kwargs["folder"] , kwargs["ingest_date"], data)
+    save_minio(kwargs["client"], kwargs["bucket"], kwargs["folder"] , kwargs["ingest_date"], data)
 
 def on_failure(context):
     """
     Function to handle task failure
     """
     params = {
-        "host": SMTP_HOST,
-        "port": SMTP_PORT,
-        "user": SMTP_USER,
+        "host": variable('smtp_host'),
+        "port": variable('smtp_port'),
+        "user": variable('smtp_user'),
         "task_id": context["task"].task_id,
         "dag_id": context["task"].dag_id,
         "exec_date": context.get("ts"),
         "exception": context.get("exception"),
+        "client": minio_client(),
     }
     if "cleaning_bdd" in params["task_id"]:
         params["type_fichier"] = "BASE_SITES"
@@ -88,46 +87,123 @@ def check_file(**kwargs ):
     """
     if (kwargs['table_type'] == 'OPEX_IHS') and (kwargs["date"].split('-')[1] not in ["01", "04", "07", "10"]):
         return True
-    table_obj = next((table for table in CONFIG["tables"] if table["name"] == kwargs['table_type'] ), None)
-    date_parts = kwargs["date"].split("-")
-    filename = get_latest_file(client=kwargs["client"], bucket=table_obj["bucket"], prefix=f"{table_obj['folder']}/{table_obj['folder']}_{date_parts[0]}{date_parts[1]}")
+    table_obj = dataset(kwargs['table_type'])
+    filename = get_latest_file(client=kwargs["client"], bucket=table_obj.bucket, prefix=table_obj.monthly_prefix(kwargs["date"]))
     if filename is None:
         return False
     return True
 
+def incremental(kwargs: dict) -> bool:
+    """
+    incremental param of the run (CONFIG["oneforall"]["incremental"] by default): the changed sites are
+    computed and upserted, else oneforall is rebuilt and its months replaced
+    """
+    return bool(kwargs.get("params", {}).get("incremental", CONFIG["oneforall"]["incremental"]))
+
 def gen_oneforall(**kwargs):
-    data = oneforall(
-        CLIENT,
-        kwargs["endpoint"],
-        kwargs["accesskey"],
-        kwargs["secretkey"],
-        kwargs["date"],
-        kwargs["start_date"],
-    )
+    args = (kwargs["client"], kwargs["endpoint"], kwargs["accesskey"], kwargs["secretkey"], kwargs["date"],
+            kwargs["start_date"])
+    if incremental(kwargs):
+        data, _ = oneforall_incremental(*args, checkpoint=True, engine=kwargs.get("engine", "pandas"))
+    else:
+        data = oneforall(*args, checkpoint=True, engine=kwargs.get("engine", "pandas"))
+        reset_incremental(kwargs["client"], kwargs["date"])
     if not data.empty:
-        save_minio(client=CLIENT, bucket="oneforall", folder=None, date=kwargs["date"], data=data)
+        save_minio(client=kwargs["client"], bucket="oneforall", folder=None, date=kwargs["date"], data=data)
     else:
         raise RuntimeError(f"No data for {kwargs['date']}")
 
+def write_spark(kwargs: dict, data: pd.DataFrame):
+    """
+    replace the months of data in the oneforall table through spark jdbc
+    """
+    from gps.common.spark import get_spark, to_spark, write_jdbc  # pylint: disable=import-outside-toplevel
+    session = get_spark(kwargs["endpoint"], kwargs["accesskey"], kwargs["secretkey"])
+    write_jdbc(to_spark(session, data), host=variable('pg_save_host'), database=variable('pg_save_db'),
+               user=variable('pg_save_user'), password=variable('pg_save_password'), table="oneforall",
+               port=variable('pg_save_port', '5432'))
+
 def save_in_pg(**kwargs):
     data = get_last_ofa(
-        CLIENT,
+        kwargs["client"],
         kwargs["endpoint"],
         kwargs["accesskey"],
         kwargs["secretkey"],
         kwargs["date"],
     )
-    if not data.empty:
-        write_pg(
-            host=PG_SAVE_HOST,
-            database=PG_SAVE_DB,
-            user=PG_SAVE_USER,
-            password=PG_SAVE_PASSWORD,
-            data=data,
-            table="oneforall"
-        )
-    else:
+    if data.empty:
         raise RuntimeError(f"No data for {kwargs['date']}")
+    # after an incremental run only the changed sites are upserted
+    emitted = get_emitted(kwargs["client"], kwargs["date"]) if incremental(kwargs) else None
+    if emitted is not None:
+        # removed sites are in emitted but not in data, they are deleted even when the delta is empty
+        data = data.loc[data["code_oci"].isin(emitted)]
+    if kwargs.get("engine", "pandas") == "spark" and emitted is None:
+        write_spark(kwargs, data)
+        return
+    write_pg(
+        host=variable('pg_save_host'),
+        database=variable('pg_save_db'),
+        user=variable('pg_save_user'),
+        password=variable('pg_save_password'),
+        port=variable('pg_save_port', '5432'),
+        data=data,
+        table="oneforall",
+        codes=emitted,
+        mode="replace" if emitted is None else "upsert",
+        months=[kwargs["date"][:7]],
+    )
+
+def gen_oneforall_batch(**kwargs):
+    """
+    recompute oneforall for a range of months and save all of them
+    """
+    results = oneforall_batch(
+        kwargs["client"],
+        kwargs["endpoint"],
+        kwargs["accesskey"],
+        kwargs["secretkey"],
+        month_dates(kwargs["start"], kwargs["end"]),
+        kwargs["start_date"],
+    )
+    for date, data in results.items():
+        if data.empty:
+            raise RuntimeError(f"No data for {date}")
+        save_minio(client=kwargs["client"], bucket="oneforall", folder=None, date=date, data=data)
+    if kwargs.get("engine", "pandas") == "spark":
+        write_spark(kwargs, pd.concat(results.values(), ignore_index=True))
+        return
+    write_pg(
+        host=variable('pg_save_host'),
+        database=variable('pg_save_db'),
+        user=variable('pg_save_user'),
+        password=variable('pg_save_password'),
+        port=variable('pg_save_port', '5432'),
+        data=pd.concat(results.values(), ignore_index=True),
+        table="oneforall",
+        workers=CONFIG["pg_load"]["workers"],
+    )
+
+def fused_month(**kwargs):
+    """
+    clean, generate oneforall and save it in postgres in one process
+    """
+    monthly_run(
+        kwargs["client"],
+        kwargs["endpoint"],
+        kwargs["accesskey"],
+        kwargs["secretkey"],
+        kwargs["date"],
+        kwargs["start_date"],
+        pg={
+            "host": variable('pg_save_host'),
+            "database": variable('pg_save_db'),
+            "user": variable('pg_save_user'),
+            "password": variable('pg_save_password'),
+            "port": variable('pg_save_port', '5432'),
+        },
+        checkpoint=True,
+    )
 
 def send_email_onfailure(**kwargs):
     """
@@ -157,19 +233,20 @@ with DAG(
     schedule_interval="0 0 6 * *",
     start_date=datetime(2023, 1, 6, 0, 0, 0),
     catchup=True,
+    params={"incremental": CONFIG["oneforall"]["incremental"]},
 ) as dag:
      # Task group for cleaning tasks
     with TaskGroup("cleaning", tooltip="Tasks for cleaning") as section_cleaning:
-        table_config = next((table for table in CONFIG["tables"] if table["name"] == "ks_tdb_radio_drsi"), None)
+        table_config = dataset("ks_tdb_radio_drsi")
         extract_trafic_deux = PythonOperator(
                 task_id="extract_trafic_deux",
                 provide_context=True,
-                python_callable=extract_trafic_V2,
+                python_callable=with_minio(extract_trafic_V2),
                 op_kwargs={
-                    'thetable': table_config["name"],
-                    'bucket': table_config["bucket"],
-                    'folder': table_config["folder"],
-                    'table': table_config["table"],
+                    'thetable': table_config.name,
+                    'bucket': table_config.bucket,
+                    'folder': table_config.folder,
+                    'table': table_config.table,
                     'ingest_date': DATE
                 },
                 dag=dag,
@@ -177,12 +254,8 @@ with DAG(
         clean_trafic_deux = PythonOperator(
             task_id="cleaning_trafic_deux",
             provide_context=True,
-            python_callable=cleaning_trafic_v2,
+            python_callable=with_minio(cleaning_trafic_v2),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
             },
             on_failure_callback=on_failure,
@@ -193,9 +266,8 @@ with DAG(
             mode='poke',
             poke_interval= 24* 60 *60,
             timeout = 144 * 60 * 60,
-            python_callable= check_file,
+            python_callable=with_minio(check_file),
             op_kwargs={
-                  'client': CLIENT,
                   'table_type': 'BASE_SITES',
                   'date': DATE,
             #     'smtp_host': SMTP_HOST,
@@ -220,12 +292,8 @@ with DAG(
         clean_base_site = PythonOperator(
             task_id="cleaning_bdd",
             provide_context=True,
-            python_callable=clean_base_sites,
+            python_callable=with_minio(clean_base_sites),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
             },
             on_failure_callback=on_failure,
@@ -236,9 +304,8 @@ with DAG(
             mode='poke',
             poke_interval= 24* 60 *60,
             timeout = 144 * 60 * 60,
-            python_callable= check_file,
+            python_callable=with_minio(check_file),
             op_kwargs={
-                  'client': CLIENT,
                   'table_type': 'OPEX_ESCO',
                   'date': DATE,
             #     'smtp_host': SMTP_HOST,
@@ -253,9 +320,8 @@ with DAG(
             poke_interval= 24* 60 *60,
             soft_fail = True,
             timeout = 144 * 60 * 60,
-            python_callable= check_file,
+            python_callable=with_minio(check_file),
             op_kwargs={
-                  'client': CLIENT,
                   'table_type': 'ANNEXE_OPEX_ESCO',
                   'date': DATE,
             #     'smtp_host': SMTP_HOST,
@@ -280,12 +346,8 @@ with DAG(
         clean_opex_esco = PythonOperator(
             task_id="cleaning_esco",
             provide_context=True,
-            python_callable=cleaning_esco,
+            python_callable=with_minio(cleaning_esco),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
             },
             on_failure_callback=on_failure,
@@ -296,9 +358,8 @@ with DAG(
             mode='poke',
             poke_interval= 24* 60 *60,
             timeout = 144 * 60 * 60,
-            python_callable= check_file,
+            python_callable=with_minio(check_file),
             op_kwargs={
-                  'client': CLIENT,
                   'table_type': 'OPEX_IHS',
                   'date': DATE,
             #     'smtp_host': SMTP_HOST,
@@ -321,12 +382,8 @@ with DAG(
         clean_opex_ihs = PythonOperator(
             task_id="cleaning_ihs",
             provide_context=True,
-            python_callable=cleaning_ihs,
+            python_callable=with_minio(cleaning_ihs),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
             },
             on_failure_callback=on_failure,
@@ -357,13 +414,10 @@ with DAG(
         clean_caparc = PythonOperator(
             task_id="cleaning_caparc",
             provide_context=True,
-            python_callable=cleaning_ca_parc,
+            python_callable=with_minio(cleaning_ca_parc),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
+                "engine": task_engine("cleaning_caparc"),
             },
             dag=dag,
         )
@@ -371,26 +425,20 @@ with DAG(
         clean_trafic = PythonOperator(
             task_id="cleaning_trafic",
             provide_context=True,
-            python_callable=cleaning_traffic,
+            python_callable=with_minio(cleaning_traffic),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
+                "engine": task_engine("cleaning_trafic"),
             },
             dag=dag,
         )
         clean_cssr = PythonOperator(
             task_id="cleaning_cssr",
             provide_context=True,
-            python_callable=cleaning_cssr,
+            python_callable=with_minio(cleaning_cssr),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
+                "engine": task_engine("cleaning_cssr"),
             },
             dag=dag,
         )
@@ -399,9 +447,8 @@ with DAG(
             mode='poke',
             poke_interval= 24* 60 *60,
             timeout = 144 * 60 * 60,
-            python_callable= check_file,
+            python_callable=with_minio(check_file),
             op_kwargs={
-                  'client': CLIENT,
                   'table_type': 'CONGESTION',
                   'date': DATE,
             #     'smtp_host': SMTP_HOST,
@@ -412,12 +459,8 @@ with DAG(
         clean_congestion = PythonOperator(
             task_id="cleaning_congestion",
             provide_context=True,
-            python_callable=cleaning_congestion,
+            python_callable=with_minio(cleaning_congestion),
             op_kwargs={
-                "client": CLIENT,
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
             },
             dag=dag,
@@ -450,25 +493,21 @@ with DAG(
         merge_data = PythonOperator(
             task_id="join_data",
             provide_context=True,
-            python_callable=gen_oneforall,
+            python_callable=with_minio(gen_oneforall),
             op_kwargs={
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
                 "start_date": "2023-01-06",
+                "engine": task_engine("join_data"),
             },
             dag=dag,
         )
         save_pg = PythonOperator(
             task_id="save_pg",
             provide_context=True,
-            python_callable=save_in_pg,
+            python_callable=with_minio(save_in_pg),
             op_kwargs={
-                "endpoint": MINIO_ENDPOINT,
-                "accesskey": MINIO_ACCESS_KEY,
-                "secretkey": MINIO_SECRET_KEY,
                 "date": DATE,
+                "engine": task_engine("save_pg"),
             },
             dag=dag,
         )
@@ -493,4 +532,61 @@ with DAG(
     #     dag=dag
     # )
     
-    
\ No newline at end of file
+    
+
+
+# Manual DAG to recompute oneforall history (e.g. after a threshold change)
+with DAG(
+    "enrich_batch",
+    default_args={
+        "depends_on_past": False,
+        "email": CONFIG["airflow_receivers"],
+        "email_on_failure": True,
+        "email_on_retry": False,
+        "retries": 0,
+    },
+    description="recompute oneforall for a range of months",
+    schedule_interval=None,
+    start_date=datetime(2023, 1, 6, 0, 0, 0),
+    catchup=False,
+    params={"start": "2023-01-06", "end": "2023-12-06"},
+) as batch_dag:
+    recompute = PythonOperator(
+        task_id="recompute_oneforall",
+        python_callable=with_minio(gen_oneforall_batch),
+        op_kwargs={
+            "start": "{{ params.start }}",
+            "end": "{{ params.end }}",
+            "start_date": "2023-01-06",
+            "engine": task_engine("save_pg"),
+        },
+        dag=batch_dag,
+    )
+
+
+# Manual DAG running the cleanings, oneforall and the postgres load of a month in one task,
+# dataframes stay in memory and the minio files are written in background
+with DAG(
+    "enrich_fused",
+    default_args={
+        "depends_on_past": False,
+        "email": CONFIG["airflow_receivers"],
+        "email_on_failure": True,
+        "email_on_retry": False,
+        "retries": 0,
+    },
+    description="clean monthly data and generate oneforall in one process",
+    schedule_interval=None,
+    start_date=datetime(2023, 1, 6, 0, 0, 0),
+    catchup=False,
+    params={"date": ""},
+) as fused_dag:
+    fused = PythonOperator(
+        task_id="fused_month",
+        python_callable=with_minio(fused_month),
+        op_kwargs={
+            "date": "{{ params.date or data_interval_start.strftime('%Y-%m-%d') }}",
+            "start_date": "2023-01-06",
+        },
+        dag=fused_dag,
+    )
@@ -1,17 +1,19 @@
 """  EXTRACT DAG"""
 
+import logging
 from datetime import datetime, timedelta
 from pathlib import Path
-from minio import Minio
 from airflow.operators.python import PythonOperator
 from airflow.sensors.python import PythonSensor
-from airflow.models import Variable
 from airflow import DAG
+from airflow.models.pool import Pool
 from gps import CONFIG
 
+from gps.common.datasets import DATASETS
 from gps.common.extract import extract_pg, extract_ftp, list_ftp_file
 from gps.common.rwminio import save_minio
-from gps.common.alerting import send_email
+from gps.common.alerting import send_email, send_pending_alerts
+from gps.common.settings import variable, minio_client
 
 #doc_md = Path(__file__).parents[1] / "docs/daily.md"
 
@@ -33,32 +35,18 @@ Elle interagit donc avec les daily sources (postgreSQl et FTP) et MINIO. Elle s
 - Ingest_hourly_datas_radio_prod: recupère les données concernant le trafic. La source de données est postgreSQL (Table: hourly_datas_radio_prod). Le bucket Minio est trafic et le folder trafic
 - Ingest_caparc: Cette tâche recupère les données concernant le CA et le PARC via FTP. La particularité de cette tâche est qu’elle recupère les données de d-7. Le declenchement de cette tâche depend du sensor_ca. Sensor_ca est une tâche spéciale qui verifie la présence du fichier à recupérer quotidiennement. Dès que le sensor dectecte la présence dufichier, il passe à succès et la tâche est exécutée. Au bout de 5 jours, si le fichier n’est toujours pas fourni dans la source,le sensor echoue et la tâche send_email est exécutée. Le bucket Minio est caparc et le folder caparc;
 - Send_email: envoie un mail au responsable du fichier CA et PARC afin qu’il fournissent le fichier manquant
+- send_alert_digests: envoie le recapitulatif des alertes d'echec regroupees (coalesce_window) dont la fenetre a expire sans nouvel echec
 
+Les tâches ingest_* sont des tâches mappées (une instance par table) générées à partir de la clé "extract" des tables de configs.json: ingest_<source>_<cost> (ex: ingest_pg_large pour hourly_datas_radio_prod et faitalarme). La classe de coût définit le pool et la concurrence (cost_classes), ensure_pools crée les pools manquants.
 
-"""
-
-
-PG_HOST = Variable.get('pg_host')
-PG_DB = Variable.get('pg_db')
-PG_USER = Variable.get('pg_user')
-PG_PASSWORD = Variable.get('pg_password')
-
-MINIO_ENDPOINT = Variable.get('minio_host')
-MINIO_ACCESS_KEY = Variable.get('minio_access_key')
-MINIO_SECRET_KEY = Variable.get('minio_secret_key')
 
-FTP_HOST = Variable.get('ftp_host')
-FTP_USER = Variable.get('ftp_user')
-FTP_PASSWORD = Variable.get('ftp_password')
+"""
 
-PG_SAVE_HOST = Variable.get('pg_save_host')
-PG_SAVE_DB = Variable.get('pg_save_db')
-PG_SAVE_USER = Variable.get('pg_save_user')
-PG_SAVE_PASSWORD = Variable.get('pg_save_password')
 
-SMTP_HOST = Variable.get('smtp_host')
-SMTP_PORT = Variable.get('smtp_port')
-SMTP_USER = Variable.get('smtp_user')
+# rendered at execution only, variables are not read when the file is parsed
+SMTP_HOST = "{{ var.value.smtp_host }}"
+SMTP_PORT = "{{ var.value.smtp_port }}"
+SMTP_USER = "{{ var.value.smtp_user }}"
 
 
 INGEST_PG_DATE = "{{ macros.ds_add(ds, -1) }}"
@@ -66,12 +54,6 @@ INGEST_FTP_DATE = "{{ macros.ds_add(ds, -6) }}"
 
 
 
-CLIENT = Minio( MINIO_ENDPOINT,
-        access_key= MINIO_ACCESS_KEY,
-        secret_key= MINIO_SECRET_KEY,
-        secure=False)
-
-
 # def extract_job(**kwargs):
 #     """
 #         extract callable
@@ -117,15 +99,17 @@ CLIENT = Minio( MINIO_ENDPOINT,
 
 
 def extract_job(**kwargs):
-    data = extract_pg(host = PG_HOST, database= PG_DB, user= PG_USER,
-            password= PG_PASSWORD , table= kwargs["thetable"] , date= kwargs["ingest_date"])
+    data = extract_pg(host = variable('pg_host'), database= variable('pg_db'), user= variable('pg_user'),
+            password= variable('pg_password') , table= kwargs["thetable"] , date= kwargs["ingest_date"],
+            port= variable('pg_port', '5432'))
     if kwargs["thetable"] == "hourly_datas_radio_prod" and data.empty:
-        data = extract_pg(host = PG_HOST, database= PG_DB, user= PG_USER,
-            password= PG_PASSWORD , table = "hourly_datas_radio_prod_archive" , date= kwargs["ingest_date"])
+        data = extract_pg(host = variable('pg_host'), database= variable('pg_db'), user= variable('pg_user'),
+            password= variable('pg_password') , table = "hourly_datas_radio_prod_archive" , date= kwargs["ingest_date"],
+            port= variable('pg_port', '5432'))
     if  data.empty:
         raise RuntimeError(f"No data for {kwargs['ingest_date']}")
     
-    save_minio(CLIENT, kwargs["bucket"], kwargs["folder"] , kwargs["ingest_date"], data)
+    save_minio(minio_client(), kwargs["bucket"], kwargs["folder"] , kwargs["ingest_date"], data)
             
 
 def extract_ftp_job(**kwargs):
@@ -133,10 +117,10 @@ def extract_ftp_job(**kwargs):
     extract ftp files callable
  
     """
-    data = extract_ftp(FTP_HOST, FTP_USER, FTP_PASSWORD, kwargs["ingest_date"])
+    data = extract_ftp(variable('ftp_host'), variable('ftp_user'), variable('ftp_password'), kwargs["ingest_date"])
     if  data.empty:
         raise RuntimeError(f"No data for {kwargs['ingest_date']}")
-    save_minio(CLIENT, kwargs["bucket"], kwargs["folder"], kwargs["ingest_date"], data)
+    save_minio(minio_client(), kwargs["bucket"], kwargs["folder"], kwargs["ingest_date"], data)
                 
 
 def check_file(**kwargs):
@@ -144,12 +128,45 @@ def check_file(**kwargs):
         check if file exists
     """
     filename = f"extract_vbm_{kwargs['ingest_date'].replace('-', '')}.csv"
-    liste = list_ftp_file(FTP_HOST, FTP_USER, FTP_PASSWORD)
+    liste = list_ftp_file(variable('ftp_host'), variable('ftp_user'), variable('ftp_password'))
     if filename in liste:
         return True
     return False  
 
 
+def extract_sources(source: str, cost: str, ingest_date: str) -> list:
+    """
+    op_kwargs of the tables extracted from source (pg or ftp) in a cost class
+    """
+    return [{
+                'thetable': table_config.name,
+                'bucket': table_config.bucket,
+                'folder': table_config.folder,
+                'table': table_config.table,
+                'ingest_date': ingest_date
+            }
+            for table_config in DATASETS.values()
+            if table_config.source == source and table_config.cost == cost]
+
+
+def ensure_pools():
+    """
+    create the pools of the cost classes that do not exist yet
+    """
+    for cost, cost_class in CONFIG["cost_classes"].items():
+        if Pool.get_pool(cost_class["pool"]) is None:
+            Pool.create_or_update_pool(cost_class["pool"], slots=cost_class["slots"],
+                                       description=f"{cost} extractions")
+
+
+def send_alert_digests(**kwargs):
+    """
+    send the digests of the coalesced failure alerts whose window expired
+    """
+    sent = send_pending_alerts(kwargs["host"], kwargs["port"], kwargs["user"], minio_client())
+    logging.info("%s alert digests sent", sent)
+
+
 def send_email_onfailure(**kwargs):
     """
     send email if sensor failed
@@ -208,47 +225,40 @@ with DAG(
         }
     )
 
-    tasks = []
-    for table_config in CONFIG["tables"]:
-        if table_config["name"] in ["faitalarme", "hourly_datas_radio_prod",  "Taux_succes_2g", "Taux_succes_3g"]:
-            task_id = f'ingest_{table_config["name"]}'
-            callable_fn = extract_job if table_config["name"] != "caparc" else extract_ftp_job
-            INGEST_DATE = INGEST_PG_DATE if table_config["name"] != "caparc" else INGEST_FTP_DATE
-            task = PythonOperator(
-                task_id=task_id,
-                provide_context=True,
-                python_callable=callable_fn,
-                doc_md = doc_md,
-                op_kwargs={
-                    'thetable': table_config["name"],
-                    'bucket': table_config["bucket"],
-                    'folder': table_config["folder"],
-                    'table': table_config["table"],
-                    'ingest_date': INGEST_DATE
-                },
-                dag=dag,
-            )
-            tasks.append(task)
-        if table_config["name"] == "caparc":
-            task_id = f'ingest_{table_config["name"]}'
-            callable_fn =  extract_ftp_job
-            INGEST_DATE =  INGEST_FTP_DATE
-            ingest_caparc = PythonOperator(
-                task_id=task_id,
-                provide_context=True,
+    alert_digests = PythonOperator(
+        task_id="send_alert_digests",
+        python_callable=send_alert_digests,
+        doc_md = doc_md,
+        op_kwargs={
+            'host': SMTP_HOST,
+            'port': SMTP_PORT,
+            'user': SMTP_USER,
+        }
+    )
+
+    create_pools = PythonOperator(
+        task_id="ensure_pools",
+        python_callable=ensure_pools,
+        doc_md = doc_md,
+    )
+    # one mapped task per source type and cost class, a cost class sets the pool and the concurrency
+    tasks = {}
+    for source, callable_fn, ingest_date in [("pg", extract_job, INGEST_PG_DATE),
+                                             ("ftp", extract_ftp_job, INGEST_FTP_DATE)]:
+        for cost, cost_class in CONFIG["cost_classes"].items():
+            sources = extract_sources(source, cost, ingest_date)
+            if not sources:
+                continue
+            tasks[(source, cost)] = PythonOperator.partial(
+                task_id=f"ingest_{source}_{cost}",
                 python_callable=callable_fn,
                 doc_md = doc_md,
-                op_kwargs={
-                    'thetable': table_config["name"],
-                    'bucket': table_config["bucket"],
-                    'folder': table_config["folder"],
-                    'table': table_config["table"],
-                    'ingest_date': INGEST_DATE
-                },
-                dag=dag,
-            )
-
-
-    check_file_sensor >> send_email_task
-    check_file_sensor >> ingest_caparc
-    tasks
\ No newline at end of file
+                pool=cost_class["pool"],
+                max_active_tis_per_dag=cost_class["max_active_tis_per_dag"],
+            ).expand(op_kwargs=sources)
+            create_pools >> tasks[(source, cost)]
+            if source == "ftp":
+                check_file_sensor >> tasks[(source, cost)]
+
+
+    check_file_sensor >> send_email_task
\ No newline at end of file
@@ -0,0 +1,83 @@
+""" LOCAL HTTP STAND-IN FOR THE PARAMS AND MAILS APIS"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from gps import CONFIG
+from gps.common import alerting
+
+# CONFIG url -> path of the api on the stand-in
+URLS = {"api_params": "/api/parametre", "api_mails": "/api/alerting"}
+
+
+def default_params() -> list:
+    """
+    thresholds of the params api, in percent with a decimal comma as the api sends them
+    """
+    return [{"code": code, "value": f"{CONFIG[code] * 100:g}".replace(".", ",")}
+            for code in ["intercos", "impot_taxe", "frais_distribution", "seuil_rentabilite"]]
+
+
+def default_receivers() -> list:
+    """
+    receivers of the mails api, one address per monthly file type
+    """
+    return [{"typeFichier": code, "email": [f"{code.lower()}@gps.test"]}
+            for code in ["BASE_SITES", "OPEX_ESCO", "ANNEXE_OPEX_ESCO", "OPEX_IHS", "CONGESTION"]]
+
+
+class ApiStandIn:
+    """
+    Local http server answering GET requests with json payloads (path -> payload),
+    CONFIG api urls are pointed at it while it runs.
+    usage:
+        with ApiStandIn() as api:
+            get_thresholds(), get_receivers("BASE_SITES")
+        api.requests  # [path]
+    """
+
+    def __init__(self, routes: dict = None, host: str = "127.0.0.1", port: int = 0):
+        self.routes = {URLS["api_params"]: default_params(),
+                       URLS["api_mails"]: default_receivers()} if routes is None else routes
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                stand_in.requests.append(self.path)
+                if self.path not in stand_in.routes:
+                    self.send_error(404)
+                    return
+                body = json.dumps(stand_in.routes[self.path]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.config = {}
+
+    @property
+    def url(self) -> str:
+        """
+        base url of the server
+        """
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config = {name: CONFIG[name] for name in URLS}
+        CONFIG.update({name: f"{self.url}{path}" for name, path in URLS.items()})
+        # receivers are cached by alerting, read them from the stand-in
+        alerting._DIRECTORY["loaded"] = 0.0  # pylint: disable=protected-access
+        return self
+
+    def __exit__(self, *exc):
+        CONFIG.update(self.config)
+        alerting._DIRECTORY["loaded"] = 0.0  # pylint: disable=protected-access
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,59 @@
+""" LOCAL FTP STAND-IN (dev only, requires pyftpdlib)"""
+import ftplib
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import FTPServer
+from gps import CONFIG
+
+
+class FtpStandIn:
+    """
+    Local ftp server serving the files of CONFIG["ftp_dir"] from a temporary directory.
+    ftplib connects to the default port, it is pointed at the server port while it runs.
+    usage:
+        with FtpStandIn() as ftp:
+            ftp.put("extract_vbm_20230101.csv", payload)
+            extract_ftp(ftp.host, ftp.user, ftp.password, "2023-01-01")
+    """
+
+    user = "gps"
+    password = "gps-secret"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.root = Path(tempfile.mkdtemp(prefix="gps-ftp-"))
+        (self.root / CONFIG["ftp_dir"]).mkdir()
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(self.user, self.password, str(self.root), perm="elr")
+        handler = type("Handler", (FTPHandler,), {"authorizer": authorizer, "banner": "gps ftp stand-in"})
+        self.server = FTPServer((host, port), handler)
+        self.stop = threading.Event()
+        self.thread = None
+        self.default_port = ftplib.FTP.port
+
+    def put(self, name: str, payload: bytes) -> None:
+        """
+        add a file to the ftp directory
+        """
+        (self.root / CONFIG["ftp_dir"] / name).write_bytes(payload)
+
+    def _serve(self):
+        while not self.stop.is_set():
+            self.server.serve_forever(timeout=0.1, blocking=False)
+        self.server.close_all()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        ftplib.FTP.port = self.server.address[1]
+        return self
+
+    def __exit__(self, *exc):
+        ftplib.FTP.port = self.default_port
+        self.stop.set()
+        self.thread.join()
+        shutil.rmtree(self.root, ignore_errors=True)
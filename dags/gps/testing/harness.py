@@ -0,0 +1,298 @@
+""" END TO END HARNESS (dev only)
+
+Runs the callables of the DAGs against local stand-ins of every external system:
+minio (s3 server), the params and mails apis, the ftp server, postgres (scratch database
+on a running server) and smtp, filled with synthetic data for a month.
+
+usage:
+    python -m gps.testing.harness --date 2023-01-06 --sites 1000 --pg-host 127.0.0.1 --pg-port 5432
+the daily extract DAG runs for every day of the month, then the enrich DAG runs for the month
+and the alert mails are checked against the smtp stand-in; the exit code is 1 when a task or a check failed.
+"""
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+import numpy as np
+import pendulum
+from gps import CONFIG
+from gps.common import alerting, extract, metrics, rwpg, settings
+from gps.testing import synthetic
+from gps.testing.api import ApiStandIn
+from gps.testing.ftp import FtpStandIn
+from gps.testing.pg import PgStandIn
+from gps.testing.s3 import S3StandIn
+from gps.testing.smtp import SmtpStandIn
+
+# days of source data around the month, the extract DAG reads pg at ds - 1 and ftp at ds - 6
+MARGIN = 6
+FAILED = {"failed", "upstream_failed"}
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    """
+    a port nothing listens on
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _reset() -> None:
+    """
+    forget the clients and connections cached per process, they point to the previous systems
+    """
+    settings.variable.cache_clear()
+    settings.minio_client.cache_clear()
+    extract.get_connection.cache_clear()
+    rwpg.get_engine.cache_clear()
+    rwpg.PgSink._kinds.clear()  # pylint: disable=protected-access
+
+
+class Harness:
+    """
+    Stand-ins of minio, the apis, ftp, postgres and smtp, the airflow variables the callables read
+    are set as AIRFLOW_VAR_* environment variables pointing to them.
+    usage:
+        with Harness(pg={"host": "127.0.0.1", "port": "5432", "user": "postgres"}) as harness:
+            harness.load("2023-01-06", sites=1000)
+            run_dag(extract_dag, "2023-01-07")
+    """
+
+    def __init__(self, pg: dict):
+        self.s3 = S3StandIn()
+        self.api = ApiStandIn()
+        self.ftp = FtpStandIn()
+        self.pg = PgStandIn(**pg)
+        self.smtp = SmtpStandIn(port=free_port())
+        self.stack = ExitStack()
+        self.environ = {}
+
+    def variables(self) -> dict:
+        """
+        airflow variables of the stand-ins
+        """
+        values = {"minio_host": self.s3.endpoint, "minio_access_key": self.s3.accesskey,
+                  "minio_secret_key": self.s3.secretkey, "ftp_host": self.ftp.host, "ftp_user": self.ftp.user,
+                  "ftp_password": self.ftp.password, "smtp_host": self.smtp.host, "smtp_port": str(self.smtp.port),
+                  "smtp_user": "gps@gps.test", "pg_host": self.pg.host, "pg_port": self.pg.port}
+        for prefix in ["pg", "pg_v2", "pg_save"]:
+            values.update({f"{prefix}_db": self.pg.database, f"{prefix}_user": self.pg.user,
+                           f"{prefix}_password": self.pg.password})
+        values.update({"pg_save_host": self.pg.host, "pg_save_port": self.pg.port})
+        return values
+
+    def __enter__(self):
+        for stand_in in [self.s3, self.api, self.ftp, self.pg, self.smtp]:
+            self.stack.enter_context(stand_in)
+        names = [f"AIRFLOW_VAR_{name.upper()}" for name in self.variables()]
+        self.environ = {name: os.environ.get(name) for name in names}
+        os.environ.update({f"AIRFLOW_VAR_{name.upper()}": value for name, value in self.variables().items()})
+        _reset()
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        _reset()
+        self.stack.close()
+
+    def load(self, date: str, sites: int = 1000, seed: int = 0) -> dict:
+        """
+        Synthetic data of the month of date: the monthly workbooks in minio, the source tables
+        in postgres and the ca/parc files on ftp, for the days of the month and MARGIN days around it
+        Return:
+            dict source -> rows (files for ftp)
+        """
+        rng = np.random.default_rng(seed + 1)
+        referential = synthetic.make_sites(sites, seed)
+        loaded = {"minio": len(synthetic.generate(self.s3.client(), date, sites=sites, seed=seed, extracted=False))}
+        start = datetime.strptime(date[:8] + "01", "%Y-%m-%d")
+        end = (start + timedelta(days=32)).replace(day=1)
+        day = start - timedelta(days=MARGIN)
+        while day < end + timedelta(days=MARGIN):
+            current = day.strftime("%Y-%m-%d")
+            for table, frame in synthetic.pg_tables(referential, current, rng).items():
+                self.pg.load(table, frame)
+                loaded[table] = loaded.get(table, 0) + len(frame)
+            self.ftp.put(f"extract_vbm_{day.strftime('%Y%m%d')}.csv", synthetic.vbm(referential, current, rng))
+            loaded["ftp"] = loaded.get("ftp", 0) + 1
+            day += timedelta(days=1)
+        # the archive is read when a day is missing in hourly_datas_radio_prod
+        self.pg.load("hourly_datas_radio_prod_archive", synthetic.traffic(referential, date, rng).head(0))
+        trafic_v2 = synthetic.trafic_v2(referential, date[:7], rng)
+        self.pg.load("ENERGIE.KS_TDB_RADIO_DRSI", trafic_v2)
+        loaded["ENERGIE.KS_TDB_RADIO_DRSI"] = len(trafic_v2)
+        return loaded
+
+
+def run_context(dag, date: str) -> dict:
+    """
+    template context of a run of dag whose data interval starts at date
+    """
+    from airflow import macros  # pylint: disable=import-outside-toplevel
+    from airflow.utils.context import VariableAccessor  # pylint: disable=import-outside-toplevel
+    start = pendulum.parse(date, tz="UTC")
+    return {"dag": dag, "ds": start.strftime("%Y-%m-%d"), "ds_nodash": start.strftime("%Y%m%d"),
+            "ts": start.isoformat(), "logical_date": start, "execution_date": start,
+            "data_interval_start": start,
+            "macros": macros, "params": dag.params,
+            "var": {"value": VariableAccessor(deserialize_json=False),
+                    "json": VariableAccessor(deserialize_json=True)}}
+
+
+def calls(task, context: dict) -> list:
+    """
+    (callable, rendered kwargs) of a python task, one per expansion of a mapped task
+    """
+    if hasattr(task, "expand_input"):
+        func = task.partial_kwargs["python_callable"]
+        expansions = task.expand_input.value["op_kwargs"]
+    else:
+        func, expansions = task.python_callable, [task.op_kwargs]
+    return [(func, task.render_template(kwargs, context)) for kwargs in expansions]
+
+
+def run_dag(dag, date: str, assume_success: tuple = ()) -> list:
+    """
+    Run the tasks of a dag in dependency order in this process, with the context of a run at date.
+    Sensors poke once (a soft_fail sensor is skipped when its condition is not met), mapped tasks
+    run each of their expansions, failure callbacks are not called.
+    Supported trigger rules: all_success and one_failed.
+    Args:
+        assume_success: task ids not run and considered successful (tasks of the metadata database)
+    Return:
+        measures of the tasks (see gps.common.metrics.measure) with their state and error
+    """
+    states, records = {}, []
+    context = run_context(dag, date)
+    for task in dag.topological_sort():
+        upstream = [states[task_id] for task_id in task.upstream_task_ids]
+        failed = any(state in FAILED for state in upstream)
+        if task.trigger_rule == "one_failed":
+            ready = failed
+        elif task.trigger_rule == "all_success":
+            ready = all(state == "success" for state in upstream)
+        else:
+            raise ValueError(f"trigger rule {task.trigger_rule} of {task.task_id} not supported")
+        record = {"function": task.task_id}
+        if task.task_id in assume_success:
+            state = "success"
+        elif not ready:
+            state = "upstream_failed" if failed and task.trigger_rule == "all_success" else "skipped"
+        else:
+            sensor = task.task_type.endswith("Sensor")
+            try:
+                with metrics.measure(task.task_id) as record:
+                    for func, kwargs in calls(task, context):
+                        result = func(**kwargs)
+                        if sensor and not result:
+                            raise RuntimeError(f"{task.task_id} condition not met")
+                state = "success"
+            except Exception as error:  # pylint: disable=broad-except
+                logging.exception("%s failed", task.task_id)
+                state = "skipped" if sensor and task.soft_fail else "failed"
+                record["error"] = f"{type(error).__name__}: {error}"
+        states[task.task_id] = state
+        records.append({"error": None, **record, "dag_id": dag.dag_id, "date": date, "state": state})
+    return records
+
+
+def check_alerting(harness: Harness, date: str) -> list:
+    """
+    Alert mails against the smtp stand-in: a failure alert, the digest of the alerts coalesced after it
+    and the deadline of the retries when smtp is down.
+    Return:
+        records of the checks, fields of run_dag
+    """
+    smtp, client = harness.smtp, harness.s3.client()
+    failure = {"host": smtp.host, "port": smtp.port, "user": "gps@gps.test", "task_id": "harness_task",
+               "dag_id": "harness", "exception": RuntimeError("harness failure"), "client": client}
+
+    def failure_alert():
+        alerting.alert_failure(**failure, exec_date=f"{date}T01:00:00+00:00")
+        if len(smtp.messages) != 1:
+            raise RuntimeError(f"{len(smtp.messages)} mails received, expected 1")
+
+    def digest():
+        alerting.alert_failure(**failure, exec_date=f"{date}T02:00:00+00:00")
+        later = time.time() + CONFIG["alerting"]["coalesce_window"] + 1
+        sent = alerting.send_pending_alerts(smtp.host, smtp.port, "gps@gps.test", client=client, now=later)
+        subjects = [message["Subject"] for _, _, message in smtp.messages]
+        if sent != 1 or len(subjects) != 2 or "(1 echecs)" not in subjects[-1]:
+            raise RuntimeError(f"{sent} digests sent, mails received: {subjects}")
+
+    def deadline():
+        start = time.monotonic()
+        if alerting.deliver(smtp.host, free_port(), "gps@gps.test", ["a@gps.test"], "subject", "content",
+                            retries=5, backoff=1, deadline=2):
+            raise RuntimeError("mail sent to a closed port")
+        if time.monotonic() - start > 3:
+            raise RuntimeError(f"deliver gave up after {time.monotonic() - start:.1f} s, deadline 2 s")
+
+    records = []
+    for name, check in [("failure_alert", failure_alert), ("digest", digest), ("deadline", deadline)]:
+        record = {"function": name}
+        try:
+            with metrics.measure(name) as record:
+                check()
+            state = "success"
+        except Exception as error:  # pylint: disable=broad-except
+            logging.exception("%s failed", name)
+            state = "failed"
+            record["error"] = f"{type(error).__name__}: {error}"
+        records.append({"error": None, **record, "dag_id": "alerting", "date": date, "state": state})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--date", default="2023-01-06", help="start of the data interval of the enrich run")
+    parser.add_argument("--sites", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pg-host", default="127.0.0.1")
+    parser.add_argument("--pg-port", default="5432")
+    parser.add_argument("--pg-user", default="postgres")
+    parser.add_argument("--pg-password", default=os.environ.get("PGPASSWORD", ""))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    pg = {"host": args.pg_host, "port": args.pg_port, "user": args.pg_user, "password": args.pg_password}
+    from gps.custom_dags import enrich, extract as extract_dags  # pylint: disable=import-outside-toplevel
+    records = []
+    with Harness(pg) as harness:
+        harness.load(args.date, sites=args.sites, seed=args.seed)
+        start = datetime.strptime(args.date[:8] + "01", "%Y-%m-%d")
+        end = (start + timedelta(days=32)).replace(day=1)
+        # every day of the month is ingested from pg (ds - 1) and ftp (ds - 6)
+        day = start + timedelta(days=1)
+        while day <= end + timedelta(days=MARGIN - 1):
+            records += run_dag(extract_dags.dag, day.strftime("%Y-%m-%d"), assume_success=("ensure_pools",))
+            day += timedelta(days=1)
+        records += run_dag(enrich.dag, args.date)
+        records += check_alerting(harness, args.date)
+        saved = harness.pg.query("SELECT count(*) AS rows FROM pg_tables WHERE tablename = 'oneforall'")["rows"][0]
+        if saved:
+            saved = harness.pg.query("SELECT count(*) AS rows FROM oneforall")["rows"][0]
+    print(f"{'dag':<16}{'task':<40}{'success':>8}{'skipped':>8}{'failed':>8}{'wall s':>10}")
+    for (dag_id, task_id) in dict.fromkeys((record["dag_id"], record["function"]) for record in records):
+        runs = [record for record in records if (record["dag_id"], record["function"]) == (dag_id, task_id)]
+        failed = [record for record in runs if record["state"] in FAILED]
+        wall = sum(record.get("wall_seconds") or 0 for record in runs)
+        success = sum(record["state"] == "success" for record in runs)
+        print(f"{dag_id:<16}{task_id:<40}{success:>8}{len(runs) - success - len(failed):>8}{len(failed):>8}"
+              f"{wall:>10.2f}")
+        for record in failed[:3]:
+            print(f"    {record['date']} {record['state']} {record['error']}")
+    print(f"oneforall rows in postgres: {saved}")
+    sys.exit(1 if any(record["state"] in FAILED for record in records) else 0)
+
+
+if __name__ == "__main__":
+    main()
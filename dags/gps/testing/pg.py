@@ -0,0 +1,93 @@
+""" LOCAL POSTGRES STAND-IN (dev only, scratch database on a running server)"""
+from io import StringIO
+import pandas as pd
+import psycopg2
+
+# postgres has no median aggregate, the source database does (SQL_QUERIES of gps.common.extract)
+MEDIAN = """
+CREATE FUNCTION _median(numeric[]) RETURNS numeric AS
+$$ SELECT percentile_cont(0.5) WITHIN GROUP (ORDER BY value)::numeric FROM unnest($1) AS value $$
+LANGUAGE sql IMMUTABLE;
+CREATE AGGREGATE median(numeric) (SFUNC = array_append, STYPE = numeric[], FINALFUNC = _median, INITCOND = '{}');
+"""
+TYPES = {"i": "BIGINT", "u": "BIGINT", "f": "DOUBLE PRECISION", "b": "BOOLEAN"}
+
+
+def _name(table: str) -> str:
+    """
+    quoted table name, schema.table for tables out of the public schema
+    """
+    return ".".join(f'"{part}"' for part in table.split("."))
+
+
+class PgStandIn:
+    """
+    Scratch database created on a running postgres server for the source tables of the
+    extractions and the oneforall table, dropped at exit.
+    usage:
+        with PgStandIn(host="127.0.0.1", port="5432", user="postgres") as pg:
+            pg.load("faitalarme", frame)
+            extract_pg(pg.host, pg.database, pg.user, pg.password, table="faitalarme", date="2023-01-05",
+                       port=pg.port)
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: str = "5432", user: str = "postgres", password: str = "",
+                 database: str = "gps_standin"):
+        self.host = host
+        self.port = str(port)
+        self.user = user
+        self.password = password
+        self.database = database
+
+    def connect(self, database: str = None):
+        """
+        connection to the scratch database (or another database of the server)
+        """
+        return psycopg2.connect(host=self.host, port=self.port, user=self.user, password=self.password,
+                                database=database or self.database)
+
+    def _server(self, statement: str) -> None:
+        conn = self.connect("postgres")
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(statement)
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        self._server(f'DROP DATABASE IF EXISTS "{self.database}" WITH (FORCE)')
+        self._server(f'CREATE DATABASE "{self.database}"')
+        with self.connect() as conn, conn.cursor() as cur:
+            cur.execute(MEDIAN)
+        conn.close()
+        return self
+
+    def __exit__(self, *exc):
+        self._server(f'DROP DATABASE IF EXISTS "{self.database}" WITH (FORCE)')
+
+    def load(self, table: str, data: pd.DataFrame) -> None:
+        """
+        append rows to a table (schema.table), created from the dtypes of data when missing
+        """
+        columns = ", ".join(f'"{name}" {TYPES.get(dtype.kind, "TEXT")}' for name, dtype in data.dtypes.items())
+        names = ", ".join(f'"{name}"' for name in data.columns)
+        buffer = StringIO(data.to_csv(index=False, header=False))
+        with self.connect() as conn, conn.cursor() as cur:
+            if "." in table:
+                cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{table.split(".")[0]}"')
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {_name(table)} ({columns})")
+            cur.copy_expert(f"COPY {_name(table)} ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+        conn.close()
+
+    def query(self, sql: str) -> pd.DataFrame:
+        """
+        result of a query on the scratch database
+        """
+        conn = self.connect()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                return pd.DataFrame(cur.fetchall(), columns=[column.name for column in cur.description])
+        finally:
+            conn.close()
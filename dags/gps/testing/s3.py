@@ -0,0 +1,42 @@
+""" LOCAL S3 STAND-IN FOR MINIO (dev only, requires moto[server])"""
+import logging
+from minio import Minio
+from moto.server import ThreadedMotoServer
+
+
+class S3StandIn:
+    """
+    In-process s3 compatible server, used by the Minio client and by pandas (s3fs) as minio is.
+    usage:
+        with S3StandIn() as s3:
+            cleaning_traffic(s3.client(), s3.endpoint, s3.accesskey, s3.secretkey, "2023-01-06")
+    """
+
+    accesskey = "gps"
+    secretkey = "gps-secret"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = ThreadedMotoServer(ip_address=host, port=port, verbose=False)
+
+    def __enter__(self):
+        # one log line per request otherwise
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.server.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.stop()
+
+    @property
+    def endpoint(self) -> str:
+        """
+        host:port of the server, the minio_host variable
+        """
+        host, port = self.server.get_host_and_port()
+        return f"{host}:{port}"
+
+    def client(self) -> Minio:
+        """
+        minio client of the server
+        """
+        return Minio(self.endpoint, access_key=self.accesskey, secret_key=self.secretkey, secure=False)
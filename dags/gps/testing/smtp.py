@@ -0,0 +1,60 @@
+""" LOCAL SMTP STAND-IN (dev only, requires aiosmtpd)"""
+from email import message_from_bytes
+from email.policy import default
+from aiosmtpd.controller import Controller
+
+
+class _Recorder:
+    """
+    aiosmtpd handler keeping every envelope received
+    """
+
+    def __init__(self):
+        self.envelopes = []
+        self.sessions = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        # sessions are counted on first delivery, ids of finished sessions can be reused
+        if not getattr(session, "gps_counted", False):
+            session.gps_counted = True
+            self.sessions += 1
+        return "250 Message accepted for delivery"
+
+
+class SmtpStandIn:
+    """
+    Local smtp server recording received messages.
+    usage:
+        with SmtpStandIn() as smtp:
+            send_email(smtp.host, smtp.port, "gps@orange.com", ["a@b.c"], "subject", "content")
+        smtp.messages  # [(sender, [recipients], email.message.EmailMessage)]
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8025):
+        self.host = host
+        self.port = port
+        self.handler = _Recorder()
+        self.controller = Controller(self.handler, hostname=host, port=port)
+
+    def __enter__(self):
+        self.controller.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.controller.stop()
+
+    @property
+    def messages(self) -> list:
+        """
+        received messages
+        """
+        return [(envelope.mail_from, list(envelope.rcpt_tos), message_from_bytes(envelope.content, policy=default))
+                for envelope in self.handler.envelopes]
+
+    @property
+    def sessions(self) -> int:
+        """
+        number of smtp sessions that delivered a message
+        """
+        return self.handler.sessions
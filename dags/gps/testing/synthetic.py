@@ -0,0 +1,316 @@
+""" SYNTHETIC GPS DATA
+
+Generates the raw files the cleaning functions read for one month, at any number of sites:
+daily traffic, cssr 2g/3g, ca/parc and alarm csv files (as the extract DAG saves them),
+the monthly trafic v2 file and the BASE_SITES, OPEX_ESCO (and annexe), OPEX_IHS and CONGESTION workbooks
+(layout of the samples under data/). Values are random but consistent between files:
+every file refers to the same sites, so the oneforall join matches as in production.
+The source tables of the extractions (pg_tables) and the ftp ca/parc file (vbm) are built
+from the same sites for the stand-ins of gps.testing.
+"""
+import calendar
+from io import BytesIO
+import numpy as np
+import pandas as pd
+from gps.common.datasets import dataset
+
+REGIONS = ["ABIDJAN", "CENTRE", "CENTRE-EST", "NORD", "SUD", "OUEST", "EST"]
+TECHNOS = ["2G", "3G", "4G"]
+# sheets of the opex ihs workbook: (sheet name, header row, share of the ihs sites)
+IHS_SHEETS = [("OCI-MLL 1108 SIT Q1 -2023", 15, 0.6), ("OCI-COLOC 395 SIT Q1-2023", 14, 0.35),
+              ("OCI-MLL BPCI 22 SIT Q1-2023", 15, 0.05)]
+
+
+def make_sites(count: int, seed: int = 0) -> pd.DataFrame:
+    """
+    site referential shared by every generated file
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, count + 1)
+    width = max(4, len(str(count)))
+    ihs = rng.random(count) < 0.35
+    region = rng.choice(REGIONS, count)
+    return pd.DataFrame({
+        "id": ids,
+        "code oci": [f"OCI{i:0{width}d}" for i in ids],
+        "autre code": np.where(ihs, [f"IHS_{r[:3]}_{i:0{width}d}M" for r, i in zip(region, ids)],
+                               [f"{r[:3]}{i:0{width}d}" for r, i in zip(region, ids)]),
+        "gestionnaire": np.where(ihs, "IHS", "Esco"),
+        "site": [f"SITE_{i}" for i in ids],
+        "region": region,
+        "longitude": np.round(rng.uniform(-8.5, -2.5, count), 6),
+        "latitude": np.round(rng.uniform(4.3, 10.7, count), 6),
+        # traffic scale of the site, a few big urban sites carry most of the traffic (pareto)
+        "weight": rng.pareto(1.5, count) + 0.1,
+    })
+
+
+def base_sites(sites: pd.DataFrame, rng) -> pd.DataFrame:
+    """
+    BASE_SITES sheet, most sites in service in a locality
+    """
+    count = len(sites)
+    return pd.DataFrame({
+        "SITE": sites["site"], "CODE OCI": sites["code oci"], "AUTRE CODE": sites["autre code"],
+        "LONGITUDE": sites["longitude"], "LATITUDE": sites["latitude"],
+        "TYPE DU SITE": rng.choice(["Macro", "Micro", "Indoor"], count, p=[0.85, 0.1, 0.05]),
+        "STATUT": rng.choice(["Service", "Déploiement"], count, p=[0.97, 0.03]),
+        "COMMUNE": [f"COMMUNE_{i % 200}" for i in sites["id"]],
+        "DEPARTEMENT": [f"DEPARTEMENT_{i % 50}" for i in sites["id"]],
+        "REGION": sites["region"],
+        "LOCALISATION": np.where(sites["region"] == "ABIDJAN", "Abidjan", "Intérieur"),
+        "VILLE": [f"VILLE_{i % 100}" for i in sites["id"]],
+        "PARTENAIRES": rng.choice(["MTN", "MOOV", ""], count),
+        "PROPRIETAIRE": np.where(sites["gestionnaire"] == "IHS", "IHS", rng.choice(["OCI", "Particulier"], count)),
+        "GESTIONNAIRE": sites["gestionnaire"],
+        "TYPE GEOLOCALITE": rng.choice(["Chef-lieu", "Village", "Quartier"], count),
+        "POSITION SITE": rng.choice(["Localité", "localité", "Axe Routier"], count, p=[0.6, 0.3, 0.1]),
+        "PROJET": rng.choice(["CORE", "RURAL", "SWAP"], count),
+        "CLUTTER": rng.choice(["URBAIN", "RURAL", "DENSE URBAIN"], count),
+    })
+
+
+def opex_esco(sites: pd.DataFrame, rng) -> pd.DataFrame:
+    """
+    Fichier_de_calcul sheet of the esco opex, sites managed by esco
+    """
+    esco = sites.loc[sites["gestionnaire"] == "Esco"]
+    count = len(esco)
+    costs = {name: np.round(rng.uniform(low, high, count), 2) for name, (low, high) in
+             {"O&M": (4e4, 1e5), "Energy": (1e5, 6e5), "Infra": (1e5, 4e5),
+              "Maintenance Passive preventive": (1e4, 5e4), "Gardes de securite": (2e4, 8e4)}.items()}
+    discount = np.round(-rng.uniform(0, 2e4, count), 2)
+    volume = np.round(-rng.uniform(0, 1e4, count), 2)
+    total = sum(costs.values()) + discount + volume
+    return pd.DataFrame({"#": np.arange(1, count + 1), "Code Site OCI": esco["code oci"].to_numpy(),
+                         "Code site": esco["autre code"].to_numpy(), "Nom du site": esco["site"].to_numpy(),
+                         **costs, "Discount": discount, "Volume discount": volume,
+                         "Total redevances HT": total, "TVA : 18%": np.round(total * 0.18, 2),
+                         "Total redevances TTC": np.round(total * 1.18, 2)})
+
+
+def annexe_esco(sites: pd.DataFrame, rng) -> pd.DataFrame:
+    """
+    Fichier_de_calcul sheet of the esco opex annexe, a few esco sites with a prefixed code oci
+    """
+    annexe = opex_esco(sites, rng)
+    annexe = annexe.loc[rng.random(len(annexe)) < 0.05]
+    return annexe.assign(**{"Code Site OCI": "ANNEXE " + annexe["Code Site OCI"]})
+
+
+def opex_ihs(sites: pd.DataFrame, rng) -> dict:
+    """
+    sheets of the ihs opex (sheet name -> (header row, dataframe)), quarterly amounts
+    """
+    ihs = sites.loc[sites["gestionnaire"] == "IHS"]
+    cuts = np.cumsum([0] + [int(round(share * len(ihs))) for _, _, share in IHS_SHEETS])
+    cuts[-1] = len(ihs)
+    sheets = {}
+    for (name, header, _), start, end in zip(IHS_SHEETS, cuts[:-1], cuts[1:]):
+        part = ihs.iloc[start:end]
+        amount = "TRIMESTRE 1 - HT" if "BPCI 22" in name else "TRIMESTRE HT"
+        sheets[name] = (header, pd.DataFrame({
+            "SITE ID IHS": part["autre code"].to_numpy(), "SITE NAME": part["site"].to_numpy(),
+            "CATEGORY": rng.choice(["MLL", "COLOC", "BTS"], len(part)),
+            amount: np.round(rng.uniform(1e6, 3e6, len(part)), 2)}))
+    return sheets
+
+
+def congestion(sites: pd.DataFrame, month: str, rng) -> pd.DataFrame:
+    """
+    CONGESTION sheet, cells and congested cells per techno
+    """
+    count = len(sites)
+    data = {"PERIODE": month, "CODE_SITE": sites["code oci"], "ID_SITE": sites["id"], "SITE": sites["site"],
+            "LATITUDE": sites["latitude"], "LONGITUDE": sites["longitude"]}
+    for techno in ["2g", "3g", "4g"]:
+        cells = rng.integers(1, 12, count)
+        data[f"CELLULES_{techno.upper()}_CONGESTIONNEES"] = np.minimum(rng.poisson(0.3, count), cells)
+        data[f"CELLULES_{techno.upper()}"] = cells
+    return pd.DataFrame(data)
+
+
+def traffic(sites: pd.DataFrame, day: str, rng) -> pd.DataFrame:
+    """
+    hourly_datas_radio_prod extraction of a day: traffic per site and techno, a few missing values
+    """
+    frame = pd.DataFrame({"date_jour": int(day.replace("-", "")),
+                          "code_site": np.repeat(sites["code oci"].to_numpy(), len(TECHNOS)),
+                          "techno": np.tile(TECHNOS, len(sites))})
+    weight = np.repeat(sites["weight"].to_numpy(), len(TECHNOS))
+    frame["trafic_voix"] = np.round(weight * rng.gamma(2.0, 150.0, len(frame)), 4)
+    frame["trafic_data"] = np.round(weight * rng.gamma(2.0, 20.0, len(frame)), 6)
+    frame.loc[rng.random(len(frame)) < 0.01, "trafic_data"] = np.nan
+    return frame[["date_jour", "code_site", "trafic_voix", "trafic_data", "techno"]]
+
+
+def cssr(sites: pd.DataFrame, day: str, techno: str, rng) -> pd.DataFrame:
+    """
+    Taux_succes_2g / Taux_succes_3g extraction of a day
+    """
+    count = len(sites)
+    avg = np.round(np.clip(rng.normal(97, 3, count), 0, 100), 4)
+    return pd.DataFrame({"date_jour": int(day.replace("-", "")), "code_site": sites["code oci"],
+                         "min_cssr_cs": np.round(avg * rng.uniform(0.5, 1, count), 4),
+                         "max_cssr_cs": 100.0, "avg_cssr_cs": avg, "median_cssr_cs": np.minimum(avg + 1, 100),
+                         "techno": techno})
+
+
+def caparc(sites: pd.DataFrame, day: str, rng) -> pd.DataFrame:
+    """
+    ftp ca/parc file of a day as extract_ftp returns it
+    """
+    count = len(sites)
+    weight = sites["weight"].to_numpy()
+    parc = {name: rng.poisson(weight * scale).astype(float) for name, scale in
+            [("parc", 900), ("parc_data", 500), ("parc_2g", 400), ("parc_3g", 250), ("parc_4g", 200),
+             ("parc_5g", 5), ("parc_other", 20)]}
+    frame = pd.DataFrame({"day_id": day.replace("-", ""), "id_site": sites["id"],
+                          "ca_voix": np.round(weight * rng.gamma(2.0, 5e4, count), 2),
+                          "ca_data": np.round(weight * rng.gamma(2.0, 3e4, count), 2), **parc})
+    frame["month_id"] = frame["day_id"].str[:4].str.cat(frame["day_id"].str[4:6], "-")
+    return frame
+
+
+def alarms(sites: pd.DataFrame, day: str, rng) -> pd.DataFrame:
+    """
+    faitalarme extraction of a day, alarms of a few sites
+    """
+    count = max(1, len(sites) // 20)
+    delay = rng.exponential(3600, count).round()
+    cells = rng.integers(1, 6, count)
+    return pd.DataFrame({"date": day, "code_site": rng.choice(sites["code oci"], count),
+                         "techno": rng.choice(TECHNOS, count),
+                         "alarm_end": np.where(rng.random(count) < 0.9, f"{day} 23:59:59", None),
+                         "delay": delay, "nbrecellule": cells, "delaycellule": delay * cells})
+
+
+def trafic_v2(sites: pd.DataFrame, month: str, rng) -> pd.DataFrame:
+    """
+    KS_TDB_RADIO_DRSI extraction of a month, decimal commas as in the source table
+    """
+    technos = TECHNOS + ["4G_TDD"]
+    frame = pd.DataFrame({"DATE_ID": f"{month}-01", "ID_SITE": np.repeat(sites["id"].to_numpy(), len(technos)),
+                          "TECHNO": np.tile(technos, len(sites))})
+    weight = np.repeat(sites["weight"].to_numpy(), len(technos))
+    frame["TRAFIC_DATA_GO"] = [f"{value:.3f}".replace(".", ",") for value in weight * rng.gamma(2.0, 600, len(frame))]
+    frame["TRAFIC_VOIX_ERL"] = [f"{value:.3f}".replace(".", ",") for value in weight * rng.gamma(2.0, 40, len(frame))]
+    frame["NBRE_CELLULE"] = rng.integers(1, 12, len(frame))
+    frame["NBRE_CELLULE_CONGESTIONNE"] = np.minimum(rng.poisson(0.3, len(frame)), frame["NBRE_CELLULE"])
+    return frame
+
+
+def cells(sites: pd.DataFrame, count: int = 3) -> pd.DataFrame:
+    """
+    cells of the sites (code oci, cell name), the bcf/wbts names of the source tables
+    """
+    codes = np.repeat(sites["code oci"].to_numpy(), count)
+    return pd.DataFrame({"code_site": codes, "name": [f"{code}_{i % count + 1}" for i, code in enumerate(codes)]})
+
+
+def pg_tables(sites: pd.DataFrame, day: str, rng) -> dict:
+    """
+    rows of a day in the source tables of SQL_QUERIES (table -> dataframe), cell level rows
+    the queries aggregate per site; the names are the ones of the queries as postgres folds them
+    """
+    date_jour = int(day.replace("-", ""))
+    cell = cells(sites)
+    count = len(cell)
+    success = np.round(np.clip(rng.normal(97, 3, (2, count)), 0, 100), 4)
+    alarm = alarms(sites, day, rng).drop(columns="delaycellule")
+    return {
+        "hourly_datas_radio_prod": traffic(sites, day, rng),
+        "taux_succes_2g": pd.DataFrame({"date_jour": date_jour, "bcf_name": cell["name"],
+                                        "cssr_cs": success[0].astype(str), "techno": "2G"}),
+        "taux_succes_3g": pd.DataFrame({"date_jour": date_jour, "wbts_name": cell["name"],
+                                        "3g_call_setup_suceess_rate_speech_h": success[1].astype(str),
+                                        "techno": "3G"}),
+        "call_drop_2g": pd.DataFrame({"date_jour": date_jour, "bcf_name": cell["name"],
+                                      "drop_after_tch_assign": rng.poisson(2, count).astype(str), "techno": "2G"}),
+        "call_drop_3g": pd.DataFrame({"date_jour": date_jour, "wbts_name": cell["name"],
+                                      "number_of_call_drop_3g": rng.poisson(2, count).astype(str), "techno": "3G"}),
+        "faitalarme": alarm,
+    }
+
+
+def vbm(sites: pd.DataFrame, day: str, rng) -> bytes:
+    """
+    extract_vbm_YYYYMMDD.csv file of the ftp server (semicolon separated, upper case header)
+    """
+    frame = caparc(sites, day, rng).drop(columns="month_id")
+    frame.columns = frame.columns.str.upper()
+    return frame.to_csv(index=False, sep=";").encode("utf-8")
+
+
+def workbook(sheets: dict) -> bytes:
+    """
+    xlsx file of sheets (name -> (header row, dataframe)), a title above the header as in the samples
+    """
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for name, (header, frame) in sheets.items():
+            frame.to_excel(writer, sheet_name=name, startrow=header, index=False)
+            if header:
+                writer.sheets[name].cell(row=1, column=1, value=name)
+    return buffer.getvalue()
+
+
+def put(client, bucket: str, name: str, payload: bytes) -> None:
+    """
+    write an object, the bucket is created if needed
+    """
+    if not client.bucket_exists(bucket):
+        client.make_bucket(bucket)
+    client.put_object(bucket, name, BytesIO(payload), length=len(payload))
+
+
+def generate(client, date: str, sites: int = 1000, days: int = None, seed: int = 0, extracted: bool = True) -> dict:
+    """
+    Write the raw files of the month of date in minio (or a stand-in).
+    Args:
+        client: Minio client
+        date: execution date of the monthly run (YYYY-MM-DD), the monthly files are dated with it
+        sites: number of sites
+        days: number of daily files, the whole month by default (cleaning_ca_parc needs every day)
+        seed: random seed
+        extracted: write the files of the extractions too (daily csv files and trafic v2),
+            False when the pg and ftp stand-ins serve them to the DAG
+    Return:
+        dict object name -> size in bytes
+    """
+    rng = np.random.default_rng(seed)
+    year, month, _ = date.split("-")
+    days = days or calendar.monthrange(int(year), int(month))[1]
+    referential = make_sites(sites, seed)
+    written = {}
+
+    def write(table: str, name: str, payload: bytes):
+        objet = dataset(table)
+        put(client, objet.bucket, f"{objet.folder}/{name}", payload)
+        written[f"{objet.bucket}/{objet.folder}/{name}"] = len(payload)
+
+    def csv(frame: pd.DataFrame) -> bytes:
+        return frame.to_csv(index=False).encode("utf-8")
+
+    for day in range(1, days + 1 if extracted else 1):
+        current = f"{year}-{month}-{day:02d}"
+        name = f"{year}/{month}/{day:02d}.csv"
+        write("hourly_datas_radio_prod", name, csv(traffic(referential, current, rng)))
+        write("Taux_succes_2g", name, csv(cssr(referential, current, "2G", rng)))
+        write("Taux_succes_3g", name, csv(cssr(referential, current, "3G", rng)))
+        write("caparc", name, csv(caparc(referential, current, rng)))
+        write("faitalarme", name, csv(alarms(referential, current, rng)))
+    if extracted:
+        write("ks_tdb_radio_drsi", f"{year}/{month}/{date.split('-')[2]}.csv",
+              csv(trafic_v2(referential, f"{year}-{month}", rng)))
+    stamp = f"{year}{month}"
+    write("BASE_SITES", f"BASE_SITES_{stamp}.xlsx",
+          workbook({"BD de sites": (0, base_sites(referential, rng))}))
+    write("OPEX_ESCO", f"OPEX_ESCO_{stamp}.xlsx",
+          workbook({"Fichier_de_calcul": (3, opex_esco(referential, rng))}))
+    write("ANNEXE_OPEX_ESCO", f"ANNEXE_OPEX_ESCO_{stamp}.xlsx",
+          workbook({"Fichier_de_calcul": (3, annexe_esco(referential, rng))}))
+    write("OPEX_IHS", f"OPEX_IHS_{stamp}.xlsx", workbook(opex_ihs(referential, rng)))
+    write("CONGESTION", f"CONGESTION_{stamp}.xlsx",
+          workbook({"CONGESTION": (0, congestion(referential, f"{year}-{month}", rng))}))
+    return written